@@ -6,8 +6,10 @@ from contextlib import suppress
 
 from pyrogram import idle
 
-from . import app, commands, download, user
-from .housekeeping import run_schedules
+from . import app, catalog, commands, dashboard, dedup, download, eventstore, fswatch, metrics, outbox, sessions, telemetry, user
+from .housekeeping import reconcile_catalog, run_schedules
+from .rescan import run_rescanner
+from .scanner import run_health_probes
 
 
 # ---------- Resilience configuration ----------
@@ -64,6 +66,7 @@ async def _ensure_connected():
                 )
 
         # ---------- full stop → start cycle ----------
+        telemetry.reconnects.inc()
         try:
             await asyncio.wait_for(app.stop(), timeout=_CLIENT_OP_TIMEOUT)
         except asyncio.TimeoutError:
@@ -162,6 +165,19 @@ async def _stop_safely(client, name: str):
 async def main():
     logging.info("Registering commands...")
     commands.register(app)
+    metrics.load_clients_index()
+    # One-shot import of weekly JSONL files the indexed store hasn't seen yet
+    await asyncio.to_thread(eventstore.import_jsonl)
+    metrics.load_rollups()
+    # Updates Telegram redelivers right after a restart are recognised too (DEDUP_PERSIST=1)
+    dedup.load()
+    # Watch the share first, so nothing that lands during the walk below goes unseen
+    await asyncio.to_thread(fswatch.start)
+    # Pick up files the catalog doesn't know yet (added outside the bot, or before it existed)
+    await reconcile_catalog()
+
+    # Replies to the first updates go through the outbox, so it runs before the client starts
+    outbox_task = asyncio.create_task(outbox.run_outbox(), name="outbox")
 
     # ---- Initial start with retries ----
     logging.info("Starting bot (resilient)…")
@@ -197,6 +213,9 @@ async def main():
             logging.exception("User client failed to start (continuing without it).")
 
     logging.info("Starting background tasks...")
+    metrics_task = asyncio.create_task(
+        metrics.run_event_writer(), name="metrics-writer"
+    )
     manager_task = asyncio.create_task(
         download.manager.run(), name="download-manager"
     )
@@ -206,6 +225,24 @@ async def main():
     health_task = asyncio.create_task(
         _health_watchdog(), name="health-watchdog"
     )
+    rescan_task = asyncio.create_task(
+        run_rescanner(), name="rescanner"
+    )
+    clamav_probe_task = asyncio.create_task(
+        run_health_probes(), name="clamav-probes"
+    )
+    dashboard_task = asyncio.create_task(
+        dashboard.run_dashboard(), name="dashboard"
+    )
+    sessions_task = asyncio.create_task(
+        sessions.run_sweeper(), name="session-sweeper"
+    )
+    telemetry_tasks = []
+    if telemetry.PROMETHEUS_PORT:
+        telemetry_tasks = [
+            asyncio.create_task(telemetry.run_server(), name="telemetry-http"),
+            asyncio.create_task(telemetry.run_loop_lag_monitor(), name="loop-lag"),
+        ]
 
     logging.info("Bot started! I'm @%s", me.username)
 
@@ -213,14 +250,30 @@ async def main():
         await idle()  # blocks until stop signal
     finally:
         logging.info("Stopping background tasks...")
-        for t in (manager_task, housekeeping_task, health_task):
+        for t in (
+            manager_task, housekeeping_task, health_task, rescan_task, clamav_probe_task,
+            dashboard_task, sessions_task, *telemetry_tasks,
+        ):
             t.cancel()
         with suppress(Exception):
             await asyncio.gather(
-                manager_task, housekeeping_task, health_task,
+                manager_task, housekeeping_task, health_task, rescan_task,
+                clamav_probe_task, dashboard_task, sessions_task, *telemetry_tasks,
                 return_exceptions=True,
             )
 
+        metrics_task.cancel()
+        outbox_task.cancel()
+        with suppress(Exception):
+            await asyncio.gather(metrics_task, outbox_task, return_exceptions=True)
+        with suppress(Exception):
+            await metrics.close_event_writer()
+        eventstore.close()
+        fswatch.stop()
+        catalog.close()
+        sessions.close()
+        dedup.close()
+
         logging.info("Stopping bot...")
         await _stop_safely(app, "Bot")
 
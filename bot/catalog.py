@@ -0,0 +1,543 @@
+# bot/catalog.py
+"""
+Catalog of stored files (SQLite under CONFIG_FOLDER).
+
+One row per file in the download folder, keyed by its path relative to
+BASE_FOLDER: size, mtime, owner, SHA-256, last scan verdict, expiry and
+warned state. The download pipeline adds rows as files land; retention
+reads the expiry index instead of listing and stat()ing the whole share.
+Files that appear by other means (the SMB share, /use subfolders) are
+picked up as they change by the inotify watcher (fswatch), and by
+reconcile(), a parallel recursive walk run at startup and, when the
+watcher is off, before the nightly retention pass.
+"""
+import os
+import re
+import time
+import stat
+import hashlib
+import sqlite3
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from . import BASE_FOLDER, CONFIG_FOLDER
+
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "30") or "30")
+CATALOG_WALK_THREADS = int(os.getenv("CATALOG_WALK_THREADS", "8") or "8")     # parallel scandir/stat workers for full walks
+
+_STAT_CHUNK = 256       # stat() calls per pool task when a directory is large
+
+CATALOG_DB = Path(CONFIG_FOLDER) / "catalog.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path       TEXT PRIMARY KEY,     -- relative to BASE_FOLDER
+    size       INTEGER NOT NULL,
+    mtime      REAL    NOT NULL,
+    owner_id   INTEGER,
+    owner      TEXT,                 -- "@username" / "id:<n>" of the uploader, if known
+    sha256     TEXT,
+    verdict    TEXT,                 -- "clean" | "error" | null (never scanned by the bot)
+    scanned_at INTEGER,
+    added_at   INTEGER NOT NULL,
+    expires_at INTEGER NOT NULL,
+    warned_at  INTEGER,
+    pinned     INTEGER NOT NULL DEFAULT 0    -- admin-pinned: never expired or evicted
+);
+CREATE INDEX IF NOT EXISTS ix_files_expires ON files(expires_at);
+"""
+
+_conn: Optional[sqlite3.Connection] = None
+_lock = threading.RLock()
+
+
+def _db() -> sqlite3.Connection:
+    global _conn
+    with _lock:
+        if _conn is None:
+            CATALOG_DB.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(CATALOG_DB), check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            _conn = conn
+        return _conn
+
+
+def close():
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+
+def rel(path: str) -> str:
+    return os.path.relpath(os.path.abspath(path), os.path.abspath(BASE_FOLDER))
+
+
+def abspath(relpath: str) -> str:
+    return os.path.join(BASE_FOLDER, relpath)
+
+
+def expiry_for(mtime: float) -> int:
+    return int(mtime + RETENTION_DAYS * 86400)
+
+
+def file_hash(path: str, chunk: int = 1 << 20) -> Optional[str]:
+    """SHA-256 of a file, streamed in 1 MiB chunks (blocking; run in a worker thread)."""
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            while True:
+                b = f.read(chunk)
+                if not b:
+                    break
+                h.update(b)
+    except OSError:
+        logging.warning("catalog: could not hash %s", path, exc_info=True)
+        return None
+    return h.hexdigest()
+
+
+# ========= Writes =========
+
+def add(
+    path: str,
+    owner_id: Optional[int] = None,
+    owner: Optional[str] = None,
+    sha256: Optional[str] = None,
+    verdict: Optional[str] = None,
+):
+    """
+    Record (or replace) a stored file; a re-upload under the same name starts
+    a new retention clock but keeps an admin pin.
+    """
+    st = os.stat(path)
+    now = int(time.time())
+    with _lock:
+        db = _db()
+        with db:
+            db.execute(
+                "INSERT INTO files "
+                "(path, size, mtime, owner_id, owner, sha256, verdict, scanned_at, added_at, expires_at, warned_at) "
+                "VALUES (?,?,?,?,?,?,?,?,?,?,NULL) "
+                "ON CONFLICT (path) DO UPDATE SET size = excluded.size, mtime = excluded.mtime, "
+                "owner_id = excluded.owner_id, owner = excluded.owner, sha256 = excluded.sha256, "
+                "verdict = excluded.verdict, scanned_at = excluded.scanned_at, added_at = excluded.added_at, "
+                "expires_at = excluded.expires_at, warned_at = NULL",
+                (
+                    rel(path), int(st.st_size), float(st.st_mtime), owner_id, owner, sha256, verdict,
+                    now if verdict else None, now, expiry_for(st.st_mtime),
+                ),
+            )
+
+
+def set_verdict(path: str, verdict: str):
+    with _lock:
+        db = _db()
+        with db:
+            db.execute(
+                "UPDATE files SET verdict = ?, scanned_at = ? WHERE path = ?",
+                (verdict, int(time.time()), rel(path)),
+            )
+
+
+def mark_warned(relpath: str, ts: Optional[int] = None):
+    with _lock:
+        db = _db()
+        with db:
+            db.execute("UPDATE files SET warned_at = ? WHERE path = ?", (int(ts or time.time()), relpath))
+
+
+def set_pinned(relpath: str, pinned: bool) -> bool:
+    """Pin or unpin a catalogued file; False if there is no such row."""
+    with _lock:
+        db = _db()
+        with db:
+            cur = db.execute("UPDATE files SET pinned = ? WHERE path = ?", (int(bool(pinned)), relpath))
+    return cur.rowcount > 0
+
+
+def remove(relpath: str):
+    with _lock:
+        db = _db()
+        with db:
+            db.execute("DELETE FROM files WHERE path = ?", (relpath,))
+
+
+def refresh(relpath: str) -> Optional[sqlite3.Row]:
+    """
+    Re-stat one catalogued file. Drops the row if the file is gone (or is no
+    longer a regular file inside BASE_FOLDER) and moves its expiry if the file
+    was modified since it was recorded. Returns the current row or None.
+    """
+    p = abspath(relpath)
+    try:
+        st = os.lstat(p)
+        inside = os.path.realpath(p).startswith(os.path.realpath(BASE_FOLDER) + os.sep)
+    except FileNotFoundError:
+        st, inside = None, False
+    if st is None or not inside or not os.path.isfile(p) or os.path.islink(p):
+        remove(relpath)
+        return None
+    with _lock:
+        db = _db()
+        with db:
+            row = db.execute("SELECT * FROM files WHERE path = ?", (relpath,)).fetchone()
+            if row is not None and (row["mtime"] != st.st_mtime or row["size"] != st.st_size):
+                db.execute(
+                    "UPDATE files SET size = ?, mtime = ?, expires_at = ?, warned_at = NULL WHERE path = ?",
+                    (int(st.st_size), float(st.st_mtime), expiry_for(st.st_mtime), relpath),
+                )
+                row = db.execute("SELECT * FROM files WHERE path = ?", (relpath,)).fetchone()
+    return row
+
+
+def upsert(path: str):
+    """
+    Record a file seen on disk without touching what the bot knows about it
+    (owner, hash, verdict, pin); only a changed size/mtime moves its expiry.
+    Anything that is not a regular file inside BASE_FOLDER drops the row.
+    """
+    r = rel(path)
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        st = None
+    if st is None or r == ".." or r.startswith(".." + os.sep) or not stat.S_ISREG(st.st_mode):
+        remove(r)
+        return
+    with _lock:
+        db = _db()
+        with db:
+            db.execute(
+                "INSERT INTO files (path, size, mtime, added_at, expires_at) VALUES (?,?,?,?,?) "
+                "ON CONFLICT (path) DO UPDATE SET size = excluded.size, mtime = excluded.mtime, "
+                "expires_at = excluded.expires_at, warned_at = NULL "
+                "WHERE size != excluded.size OR mtime != excluded.mtime",
+                (r, int(st.st_size), float(st.st_mtime), int(time.time()), expiry_for(st.st_mtime)),
+            )
+
+
+def rename(old_path: str, new_path: str):
+    """Follow a file renamed inside the share, keeping its row (owner, verdict, pin, warned state)."""
+    old, new = rel(old_path), rel(new_path)
+    with _lock:
+        db = _db()
+        with db:
+            db.execute("DELETE FROM files WHERE path = ?", (new,))
+            moved = db.execute("UPDATE files SET path = ? WHERE path = ?", (new, old)).rowcount
+    if not moved:
+        upsert(new_path)
+
+
+def rename_tree(old_dir: str, new_dir: str):
+    """Re-key every row under a directory that was renamed inside the share."""
+    old, new = rel(old_dir), rel(new_dir)
+    with _lock:
+        db = _db()
+        with db:
+            db.execute("DELETE FROM files WHERE path GLOB ?", (_glob_prefix(new),))
+            db.execute(
+                "UPDATE files SET path = ? || substr(path, ?) WHERE path GLOB ?",
+                (new, len(old) + 1, _glob_prefix(old)),
+            )
+
+
+def remove_tree(dirpath: str):
+    """Drop every row under a directory that was deleted or moved out of the share."""
+    with _lock:
+        db = _db()
+        with db:
+            db.execute("DELETE FROM files WHERE path GLOB ?", (_glob_prefix(rel(dirpath)),))
+
+
+# ========= Queries =========
+
+def expiring(before_ts: int, unwarned_only: bool = False, after_ts: Optional[int] = None) -> List[sqlite3.Row]:
+    """Unpinned rows with after_ts < expires_at <= before_ts, soonest first (an index range scan)."""
+    sql = "SELECT * FROM files WHERE expires_at <= ? AND pinned = 0"
+    args: list = [int(before_ts)]
+    if after_ts is not None:
+        sql += " AND expires_at > ?"
+        args.append(int(after_ts))
+    if unwarned_only:
+        sql += " AND warned_at IS NULL"
+    sql += " ORDER BY expires_at"
+    with _lock:
+        return _db().execute(sql, args).fetchall()
+
+
+def find(name: str) -> List[sqlite3.Row]:
+    """Rows for a relative path, or for a bare file name in any subfolder."""
+    name = name.strip().lstrip("/")
+    with _lock:
+        db = _db()
+        rows = db.execute("SELECT * FROM files WHERE path = ?", (name,)).fetchall()
+        if not rows and "/" not in name:
+            rows = db.execute(
+                "SELECT * FROM files WHERE path GLOB ? ORDER BY path", ("*/" + _glob_escape(name),)
+            ).fetchall()
+    return rows
+
+
+def pinned() -> List[sqlite3.Row]:
+    with _lock:
+        return _db().execute("SELECT * FROM files WHERE pinned = 1 ORDER BY path").fetchall()
+
+
+EVICTION_POLICIES = ("oldest", "largest", "lru")
+
+def eviction_candidates(policy: str = "oldest", added_before: Optional[int] = None) -> List[sqlite3.Row]:
+    """
+    Unpinned rows in eviction order: oldest mtime first, largest first, or
+    least recently accessed first ("lru" stats every candidate for its atime,
+    so it costs a pass over the catalog; it only runs above the high watermark).
+    With `added_before`, rows added at or after that time are left out.
+    """
+    order = {"oldest": "mtime", "largest": "size DESC", "lru": "mtime"}.get(policy)
+    if order is None:
+        raise ValueError(f"unknown eviction policy {policy!r}")
+    where, args = "pinned = 0", []
+    if added_before is not None:
+        where += " AND added_at < ?"
+        args.append(int(added_before))
+    with _lock:
+        rows = _db().execute(f"SELECT * FROM files WHERE {where} ORDER BY {order}", args).fetchall()
+    if policy == "lru":
+        def atime(r):
+            try:
+                return os.lstat(abspath(r["path"])).st_atime
+            except OSError:
+                return 0.0
+        rows.sort(key=atime)
+    return rows
+
+
+def oldest_mtime() -> Optional[float]:
+    with _lock:
+        row = _db().execute("SELECT MIN(mtime) FROM files").fetchone()
+    return row[0] if row else None
+
+
+def count_expiring(after_ts: int, before_ts: int) -> int:
+    with _lock:
+        row = _db().execute(
+            "SELECT COUNT(*) FROM files WHERE expires_at > ? AND expires_at <= ?", (int(after_ts), int(before_ts))
+        ).fetchone()
+    return int(row[0])
+
+
+# ========= Walk & reconcile =========
+
+WalkEntry = Tuple[str, int, float]      # (absolute path, size, mtime)
+
+def _scan_dir(path: str) -> Tuple[List[os.DirEntry], List[str]]:
+    """One directory: (regular-file entries, subdirectories). Symlinks are neither followed nor returned."""
+    files: List[os.DirEntry] = []
+    dirs: List[str] = []
+    try:
+        with os.scandir(path) as it:
+            for e in it:
+                try:
+                    if e.is_dir(follow_symlinks=False):
+                        dirs.append(e.path)
+                    elif e.is_file(follow_symlinks=False):
+                        files.append(e)
+                except OSError:
+                    continue
+    except OSError:
+        logging.warning("catalog: cannot list %s", path, exc_info=True)
+    return files, dirs
+
+
+def _stat_entries(entries: List[os.DirEntry]) -> List[WalkEntry]:
+    out: List[WalkEntry] = []
+    for e in entries:
+        try:
+            st = e.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        out.append((e.path, int(st.st_size), float(st.st_mtime)))
+    return out
+
+
+def walk(root: str = BASE_FOLDER, threads: int = CATALOG_WALK_THREADS, stats: Optional[dict] = None) -> Iterator[WalkEntry]:
+    """
+    Recursive os.scandir walk yielding every regular file under `root`.
+    Directories are listed in parallel on a thread pool and the stat() calls
+    of large directories are split into chunks, so a share with one huge
+    folder or thousands of small ones both keep the pool busy. Symlinked
+    files and directories are skipped (same rule as retention: nothing
+    outside BASE_FOLDER is ever reached). Pass `stats` to get dir/file counts.
+    """
+    stats = stats if stats is not None else {}
+    stats.setdefault("dirs", 0)
+    stats.setdefault("files", 0)
+    with ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix="catalog-walk") as pool:
+        pending = {pool.submit(_scan_dir, root)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                res = fut.result()
+                if isinstance(res, list):
+                    stats["files"] += len(res)
+                    yield from res
+                    continue
+                files, dirs = res
+                stats["dirs"] += 1
+                for d in dirs:
+                    pending.add(pool.submit(_scan_dir, d))
+                for i in range(0, len(files), _STAT_CHUNK):
+                    pending.add(pool.submit(_stat_entries, files[i:i + _STAT_CHUNK]))
+
+
+def _glob_escape(text: str) -> str:
+    """`text` as a literal GLOB pattern (GLOB, unlike LIKE, is case-sensitive)."""
+    return re.sub(r"([*?[])", r"[\1]", text)
+
+
+def _glob_prefix(reldir: str) -> str:
+    """GLOB pattern matching every path under a relative directory ("" = everything)."""
+    if reldir in ("", "."):
+        return "*"
+    return _glob_escape(reldir) + "/*"
+
+
+def _lstat_file(relpath: str) -> Optional[Tuple[int, float]]:
+    """(size, mtime) of a regular file under BASE_FOLDER right now, or None."""
+    try:
+        st = os.lstat(abspath(relpath))
+    except OSError:
+        return None
+    return (int(st.st_size), float(st.st_mtime)) if stat.S_ISREG(st.st_mode) else None
+
+
+def _apply(
+    found: Dict[str, Tuple[int, float]],
+    known: Dict[str, Tuple[int, float, int]],
+    sidecars: List[str],
+    stats: dict,
+    started: int,
+):
+    """
+    Write one walk's outcome: add/update `found`, drop rows in `known` that weren't found, fold sidecars.
+    The walk ran unlocked since `started`, so rows added after that are left alone and every path is
+    stat()ed again before it is inserted or deleted (the pipeline or retention may have moved first).
+    """
+    with _lock:
+        db = _db()
+        now = int(time.time())
+        with db:
+            for r, (size, mtime) in found.items():
+                prev = known.get(r)
+                if prev is None:
+                    current = _lstat_file(r)
+                    if current is None:
+                        continue        # deleted since the walk saw it
+                    size, mtime = current
+                    db.execute(
+                        "INSERT INTO files (path, size, mtime, added_at, expires_at) VALUES (?,?,?,?,?)",
+                        (r, size, mtime, now, expiry_for(mtime)),
+                    )
+                    stats["added"] += 1
+                elif prev[:2] != (size, mtime):
+                    db.execute(
+                        "UPDATE files SET size = ?, mtime = ?, expires_at = ?, warned_at = NULL WHERE path = ?",
+                        (size, mtime, expiry_for(mtime), r),
+                    )
+                    stats["updated"] += 1
+            for r in set(known) - set(found):
+                if known[r][2] >= started or _lstat_file(r) is not None:
+                    continue            # landed during the walk
+                db.execute("DELETE FROM files WHERE path = ?", (r,))
+                stats["removed"] += 1
+            for path in sidecars:
+                target = rel(path[: -len(".warned")])
+                if target in found:
+                    try:
+                        warned = int(os.lstat(path).st_mtime)
+                    except OSError:
+                        warned = now
+                    db.execute(
+                        "UPDATE files SET warned_at = COALESCE(warned_at, ?) WHERE path = ?", (warned, target),
+                    )
+                try:
+                    os.unlink(path)
+                    stats["sidecars"] += 1
+                except OSError:
+                    logging.warning("catalog: could not remove sidecar %s", path)
+
+
+def reconcile(root: Optional[str] = None) -> dict:
+    """
+    Bring the catalog in line with the share (BASE_FOLDER and every /use
+    subfolder, or just the subtree at `root`): add files it doesn't know,
+    update ones whose mtime/size changed, drop rows for vanished files and
+    fold legacy ".warned" sidecars into warned_at (removing the sidecar).
+    The walk runs without holding the catalog lock. Blocking; run it in a
+    worker thread. Returns counters and the pass cost ("dirs", "files",
+    "seconds").
+    """
+    stats = {"added": 0, "updated": 0, "removed": 0, "sidecars": 0}
+    t0 = time.monotonic()
+    started = int(time.time())
+    root = root or BASE_FOLDER
+    found: Dict[str, Tuple[int, float]] = {}
+    sidecars: List[str] = []
+    for path, size, mtime in walk(root, stats=stats):
+        if path.endswith(".warned"):
+            sidecars.append(path)
+        else:
+            found[rel(path)] = (size, mtime)
+
+    with _lock:
+        known = {
+            r["path"]: (r["size"], r["mtime"], r["added_at"])
+            for r in _db().execute(
+                "SELECT path, size, mtime, added_at FROM files WHERE path GLOB ?", (_glob_prefix(rel(root)),)
+            )
+        }
+        _apply(found, known, sidecars, stats, started)
+    stats["seconds"] = time.monotonic() - t0
+    logging.info(
+        "catalog: reconciled %d file(s) in %d dir(s) under %s in %.2fs (+%d, ~%d, -%d, %d sidecar(s) migrated)",
+        stats["files"], stats["dirs"], rel(root), stats["seconds"],
+        stats["added"], stats["updated"], stats["removed"], stats["sidecars"],
+    )
+    return stats
+
+
+def sync_dir(path: str) -> dict:
+    """
+    reconcile() for the files directly inside one directory (not its
+    subdirectories): the targeted rescan the watcher runs for folders whose
+    mtime moved while it was not listening. Blocking.
+    """
+    stats = {"added": 0, "updated": 0, "removed": 0, "sidecars": 0}
+    started = int(time.time())
+    entries, _ = _scan_dir(path)
+    found: Dict[str, Tuple[int, float]] = {}
+    sidecars: List[str] = []
+    for p, size, mtime in _stat_entries(entries):
+        if p.endswith(".warned"):
+            sidecars.append(p)
+        else:
+            found[rel(p)] = (size, mtime)
+    pattern = _glob_prefix(rel(path))
+    with _lock:
+        known = {
+            r["path"]: (r["size"], r["mtime"], r["added_at"])
+            for r in _db().execute(
+                "SELECT path, size, mtime, added_at FROM files "
+                "WHERE path GLOB ? AND path NOT GLOB ?",
+                (pattern, pattern + "/*"),
+            )
+        }
+        _apply(found, known, sidecars, stats, started)
+    return stats
@@ -1,5 +1,8 @@
 import logging
 from textwrap import dedent
+from asyncio import create_task, to_thread
+from datetime import datetime
+from time import time
 
 from pyrogram import filters
 from pyrogram.client import Client
@@ -7,17 +10,24 @@ from pyrogram.enums import ParseMode
 from pyrogram.handlers import CallbackQueryHandler, MessageHandler
 from pyrogram.types import Message
 
-from . import DL_FOLDER, download, folder, sysinfo, user
+from . import ADMINS, DL_FOLDER, catalog, download, folder, outbox, sysinfo, user
 from .util import checkAdmins
 from .desc_cache import put as desc_put
-from .metrics import send_weekly_report
+from .metrics import (
+    EXPORT_FORMATS, export_events, flush_events, parse_range, range_stats,
+    send_weekly_report, stage_percentiles,
+)
+from .notifier import notify_document
 
 from pyrogram.enums import ParseMode
 from .messages import (
     start_text, help_text, usage_text,
-    use_need_path, use_path_warning, use_ok, leave_ok, get_folder,
+    use_need_path, use_path_warning, use_bad_path, use_ok, leave_ok, get_folder,
     add_need_user_client, add_need_link, add_invalid_link, add_message_not_found, add_no_media,
-    weekly_report_done, weekly_report_failed, unsupported_media
+    weekly_report_done, weekly_report_failed, unsupported_media, perf_text, perf_bad_days,
+    stats_text, stats_usage,
+    export_usage, export_started, export_caption, export_done, export_failed,
+    pin_not_found, pin_ambiguous, pin_ok, pin_list, pin_admins_only,
 )
 
 bot_help = """
@@ -46,6 +56,11 @@ def register(app: Client):
     addCommand(app, getFolder, "get")
     addCommand(app, addByLink, "add")
     addCommand(app, weekly_report_cmd, "weekly")
+    addCommand(app, perf_cmd, "perf")
+    addCommand(app, stats_cmd, "stats")
+    addCommand(app, export_cmd, "export")
+    addCommand(app, pin_cmd, "pin")
+    addCommand(app, unpin_cmd, "unpin")
 
     # ---- Handlers ----
     scope = filters.incoming & (filters.private | filters.group)
@@ -76,7 +91,7 @@ def register(app: Client):
     )
 
     async def _reject_unsupported(_, message: Message):
-        await message.reply(unsupported_media(), parse_mode=ParseMode.MARKDOWN)
+        await outbox.reply(message, unsupported_media(), parse_mode=ParseMode.MARKDOWN)
 
     app.add_handler(
         MessageHandler(
@@ -88,7 +103,7 @@ def register(app: Client):
     logging.info("commands: unsupported media handler registered")
 
     # Description cache: plain text that isn't a command (stored silently)
-    text_filters = filters.text & ~filters.command(["start", "help", "usage", "add", "use", "leave", "get", "weekly"])
+    text_filters = filters.text & ~filters.command(["start", "help", "usage", "add", "use", "leave", "get", "weekly", "perf", "stats", "export", "pin", "unpin"])
     app.add_handler(
         MessageHandler(
             remember_desc,
@@ -124,11 +139,11 @@ from .messages import (
 
 async def start(_, message: Message):
     """Shows bot start message"""
-    await message.reply(start_text(), parse_mode=ParseMode.MARKDOWN)
+    await outbox.reply(message, start_text(), parse_mode=ParseMode.MARKDOWN)
 
 async def botHelp(_, message: Message):
     """Send this message"""
-    await message.reply(help_text(), parse_mode=ParseMode.MARKDOWN)
+    await outbox.reply(message, help_text(), parse_mode=ParseMode.MARKDOWN)
 
 async def addByLink(_, message: Message):
     """
@@ -136,17 +151,17 @@ async def addByLink(_, message: Message):
     First argument is the message link where file is, second is optional and can be used to rename file
     """
     if not user:
-        await message.reply(add_need_user_client())
+        await outbox.reply(message, add_need_user_client())
         return
 
     parts = (message.text or "").split()
     if len(parts) == 1 or "://" not in parts[1]:
-        await message.reply(add_need_link())
+        await outbox.reply(message, add_need_link())
         return
 
     linkParts = parts[1].split("/c/")
     if len(linkParts) < 2:
-        await message.reply(add_invalid_link())
+        await outbox.reply(message, add_invalid_link())
         return
 
     ids = linkParts[1].split("/")
@@ -156,11 +171,11 @@ async def addByLink(_, message: Message):
         messages = await user.get_messages(chatID, [messageID])
     except Exception as error:
         logging.error("Getting messages from user", {"chatID": chatID, "messageID": messageID}, error)
-        await message.reply(add_message_not_found())
+        await outbox.reply(message, add_message_not_found())
         return
 
     if not messages or not messages[0].media:
-        await message.reply(add_no_media())
+        await outbox.reply(message, add_no_media())
         return
 
     await download.handler.addFileFromUser(messages[0], message)
@@ -171,7 +186,7 @@ async def usage(_, message: Message):
     You can use it to know if your storage has enough available space
     """
     u = sysinfo.diskUsage(DL_FOLDER)
-    await message.reply(usage_text(u.capacity, u.used, u.free), parse_mode=ParseMode.MARKDOWN)
+    await outbox.reply(message, usage_text(u.capacity, u.used, u.free), parse_mode=ParseMode.MARKDOWN)
 
 async def useFolder(_, message: Message):
     """
@@ -181,25 +196,29 @@ async def useFolder(_, message: Message):
     args = (message.text or "").split()
     userSetPath = " ".join(args[1:]).strip()
     if not userSetPath:
-        await message.reply(use_need_path())
+        await outbox.reply(message, use_need_path())
         return
 
     path = userSetPath.replace("../", "").replace("/..", "")
     if userSetPath != path:
-        await message.reply(use_path_warning(path, " ".join(args[1:])), parse_mode=ParseMode.MARKDOWN)
+        await outbox.reply(message, use_path_warning(path, " ".join(args[1:])), parse_mode=ParseMode.MARKDOWN)
 
-    folder.set(path)
-    await message.reply(use_ok())
+    try:
+        folder.set(message.chat.id, path)
+    except ValueError:
+        await outbox.reply(message, use_bad_path(" ".join(args[1:])), parse_mode=ParseMode.MARKDOWN)
+        return
+    await outbox.reply(message, use_ok())
 
 async def leaveFolder(_, message: Message):
     """Go back to default download folder"""
-    folder.reset()
-    await message.reply(leave_ok())
+    folder.reset(message.chat.id)
+    await outbox.reply(message, leave_ok())
 
 async def getFolder(_, message: Message):
     """Get actual download folder"""
-    path = folder.getPath()
-    await message.reply(get_folder(path), parse_mode=ParseMode.MARKDOWN)
+    path = folder.getPath(message.chat.id)
+    await outbox.reply(message, get_folder(path), parse_mode=ParseMode.MARKDOWN)
 
 async def remember_desc(_, message: Message):
     """Cache a free-text description to attach to the next upload from this chat."""
@@ -210,7 +229,117 @@ async def weekly_report_cmd(_, message):
     """Generate and send the weekly analytics report to the admin channel"""
     try:
         await send_weekly_report()
-        await message.reply(weekly_report_done())
+        await outbox.reply(message, weekly_report_done())
     except Exception:
         logging.exception("Failed to send weekly report")
-        await message.reply(weekly_report_failed())
+        await outbox.reply(message, weekly_report_failed())
+
+async def perf_cmd(_, message: Message):
+    """
+    Show p50/p95 latency of each download stage (queue, first byte, transfer, scan, notify)
+    Optional argument is the number of days to look back, 7 by default
+    """
+    args = (message.text or "").split()
+    try:
+        days = max(1, int(args[1])) if len(args) > 1 else 7
+    except ValueError:
+        await outbox.reply(message, perf_bad_days(), parse_mode=ParseMode.MARKDOWN)
+        return
+
+    await flush_events()
+    end = int(time()) + 1
+    stages = stage_percentiles(end - days * 86400, end)
+    rows = [(st, jobs, p[0.5], p[0.95]) for st, jobs, p in stages]
+    await outbox.reply(message, perf_text(days, rows), parse_mode=ParseMode.MARKDOWN)
+
+async def stats_cmd(_, message: Message):
+    """
+    Upload statistics for any period: /stats <from> <to> [user|ext]
+    Dates are YYYY-MM-DD (inclusive); the optional third argument breaks the totals down by client or file type
+    """
+    args = (message.text or "").split()[1:]
+    by = args[2].lower() if len(args) > 2 else None
+    try:
+        first, last = (datetime.strptime(a, "%Y-%m-%d").strftime("%Y-%m-%d") for a in args[:2])
+    except ValueError:
+        first = last = None
+    if len(args) < 2 or first is None or first > last or by not in (None, "user", "ext"):
+        await outbox.reply(message, stats_usage(), parse_mode=ParseMode.MARKDOWN)
+        return
+
+    await flush_events()
+    payload = await to_thread(range_stats, first, last, by)
+    await outbox.reply(message, stats_text(payload), parse_mode=ParseMode.MARKDOWN)
+
+async def export_cmd(_, message: Message):
+    """
+    Export metrics events as a gzip-compressed file to the admin channel: /export <range> [csv|jsonl]
+    Range is 30d, 2025-W05, 2025-03, 2025-03-01 or 2025-03-01..2025-03-31; jsonl by default
+    """
+    args = (message.text or "").split()[1:]
+    fmt = args[1].lower() if len(args) > 1 else "jsonl"
+    try:
+        start, end, label = parse_range(args[0] if args else "")
+    except ValueError:
+        start = None
+    if start is None or fmt not in EXPORT_FORMATS:
+        await outbox.reply(message, export_usage(), parse_mode=ParseMode.MARKDOWN)
+        return
+
+    await outbox.reply(message, export_started(label, fmt), parse_mode=ParseMode.MARKDOWN)
+    # The export can take a while on long ranges; don't hold the handler
+    create_task(_run_export(message, start, end, fmt, label))
+
+async def _run_export(message: Message, start: int, end: int, fmt: str, label: str):
+    try:
+        await flush_events()
+        path, count = await to_thread(export_events, start, end, fmt, label)
+        if not await notify_document(str(path), export_caption(label, fmt, count)):
+            raise RuntimeError("export delivery failed")
+        await outbox.reply(message, export_done(count))
+    except Exception:
+        logging.exception("Export %s (%s) failed", label, fmt)
+        await outbox.reply(message, export_failed())
+
+def _is_admin(message: Message) -> bool:
+    """Sender (or chat) is listed in ADMINS, by @username or numeric id."""
+    ids = set()
+    for who in (getattr(message, "from_user", None), getattr(message, "chat", None)):
+        if who is None:
+            continue
+        if getattr(who, "username", None):
+            ids.update({who.username, f"@{who.username}"})
+        if getattr(who, "id", None):
+            ids.add(str(who.id))
+    return bool(ids & set(ADMINS))
+
+async def _set_pin(message: Message, pinned: bool):
+    name = " ".join((message.text or "").split()[1:]).strip()
+    if not name:
+        rows = await to_thread(catalog.pinned)
+        await outbox.reply(message, pin_list([r["path"] for r in rows]), parse_mode=ParseMode.MARKDOWN)
+        return
+    # Pins exempt files from eviction, so only admins may change them (even in PUBLIC_MODE)
+    if not _is_admin(message):
+        await outbox.reply(message, pin_admins_only())
+        return
+    rows = await to_thread(catalog.find, name)
+    if not rows:
+        await outbox.reply(message, pin_not_found(name), parse_mode=ParseMode.MARKDOWN)
+        return
+    if len(rows) > 1:
+        await outbox.reply(message, pin_ambiguous(name, [r["path"] for r in rows]), parse_mode=ParseMode.MARKDOWN)
+        return
+    await to_thread(catalog.set_pinned, rows[0]["path"], pinned)
+    await outbox.reply(message, pin_ok(rows[0]["path"], pinned), parse_mode=ParseMode.MARKDOWN)
+
+async def pin_cmd(_, message: Message):
+    """
+    Protect a stored file from retention and capacity eviction: /pin <file name or path>
+    Without an argument, lists pinned files
+    """
+    await _set_pin(message, True)
+
+async def unpin_cmd(_, message: Message):
+    """Remove the protection set with /pin"""
+    await _set_pin(message, False)
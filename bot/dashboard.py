@@ -0,0 +1,168 @@
+# bot/dashboard.py
+"""
+Live dashboard: one pinned message in the private channel, edited every
+DASHBOARD_INTERVAL seconds with every running and queued download
+(progress, speed, ETA, scan stage) and the combined throughput.
+
+The message id is kept in CONFIG_FOLDER/dashboard.json so a restart keeps
+editing the same message; if it was deleted a new one is posted and
+pinned. Edits go through the outbox as progress traffic, so the dashboard
+never delays replies to users. While it is on, the per-upload "new
+request" notices are not sent (finish notices still are).
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from pyrogram.enums import ParseMode
+
+from . import CONFIG_FOLDER, app, outbox
+from .download import manager
+from .download.types import Download
+from .messages import dashboard_text
+from .notifier import PRIVATE_CHANNEL_ID
+from .util import humanReadableSize, humanReadableTime
+
+DASHBOARD_INTERVAL = int(os.getenv("DASHBOARD_INTERVAL", "0") or "0")      # seconds between edits; 0 = off
+DASHBOARD_MAX_ROWS = int(os.getenv("DASHBOARD_MAX_ROWS", "15") or "15")    # jobs listed (the rest are counted)
+
+STATE_FILE = Path(CONFIG_FOLDER) / "dashboard.json"     # {"chat_id": ..., "message_id": ...}
+
+# Edit errors meaning the message is gone for good: post a new one
+_GONE = ("MessageIdInvalid", "MessageAuthorRequired", "ChatWriteForbidden")
+
+
+def enabled() -> bool:
+    return bool(DASHBOARD_INTERVAL > 0 and PRIVATE_CHANNEL_ID)
+
+
+def _stage(d: Download) -> str:
+    if d.scan_end:
+        return "finishing"
+    if d.scan_start:
+        return "scanning"
+    if d.first_byte and not d.last_byte:
+        return "downloading"
+    if d.last_byte:
+        return "finishing"
+    return "starting"
+
+
+def render(now: Optional[float] = None) -> str:
+    """Dashboard text for the current running and queued jobs."""
+    now = now or time.time()
+    running, queued = [], []
+    throughput = 0.0
+    jobs = list(manager.active)
+    for d in jobs:
+        stage = _stage(d)
+        if stage == "downloading":
+            speed = d.received / max(1e-6, now - d.first_byte)
+            throughput += speed
+            eta = int((d.size - d.received) / max(1e-6, speed)) if d.size else 0
+            pct = (d.received / d.size * 100) if d.size else 0.0
+            since = eta
+        else:
+            speed, pct = 0.0, 0.0
+            entered = {"starting": d.started, "scanning": d.scan_start, "finishing": d.scan_end or d.last_byte}[stage]
+            since = int(now - (entered or now))
+        running.append((
+            d.filename, stage, humanReadableSize(d.received), humanReadableSize(d.size),
+            pct, humanReadableSize(speed), humanReadableTime(max(0, since)),
+        ))
+    for d in list(manager.downloads):
+        queued.append((d.filename, humanReadableTime(max(0, int(now - (d.enqueued or now))))))
+
+    running_total, queued_total = len(running), len(queued)
+    running = running[:DASHBOARD_MAX_ROWS]
+    queued = queued[:max(0, DASHBOARD_MAX_ROWS - len(running))]
+    return dashboard_text(
+        running, queued, humanReadableSize(throughput),
+        datetime.fromtimestamp(now).strftime("%H:%M:%S"), running_total, queued_total,
+    )
+
+
+def _load_state() -> Optional[int]:
+    try:
+        if STATE_FILE.exists():
+            st = json.loads(STATE_FILE.read_text("utf-8"))
+            if int(st.get("chat_id", 0)) == PRIVATE_CHANNEL_ID:
+                return int(st["message_id"])
+    except Exception:
+        logging.exception("dashboard: failed to read %s", STATE_FILE)
+    return None
+
+
+def _save_state(message_id: Optional[int]):
+    try:
+        if message_id is None:
+            STATE_FILE.unlink(missing_ok=True)
+            return
+        tmp = STATE_FILE.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps({"chat_id": PRIVATE_CHANNEL_ID, "message_id": message_id}), encoding="utf-8")
+        tmp.replace(STATE_FILE)
+    except Exception:
+        logging.exception("dashboard: failed to write %s", STATE_FILE)
+
+
+async def _post(text: str) -> int:
+    msg = await outbox.send_message(PRIVATE_CHANNEL_ID, text, priority=outbox.ADMIN, parse_mode=ParseMode.MARKDOWN)
+    try:
+        await outbox.submit(
+            PRIVATE_CHANNEL_ID,
+            lambda: app.pin_chat_message(PRIVATE_CHANNEL_ID, msg.id, disable_notification=True),
+            outbox.ADMIN, "pin",
+        )
+    except Exception:
+        logging.warning("dashboard: could not pin message %s (missing admin right?)", msg.id)
+    _save_state(msg.id)
+    return msg.id
+
+
+async def _edit(message_id: int, text: str):
+    await outbox.submit(
+        PRIVATE_CHANNEL_ID,
+        lambda: app.edit_message_text(
+            PRIVATE_CHANNEL_ID, message_id, text,
+            parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True,
+        ),
+        outbox.PROGRESS, "edit_dashboard", key=("dashboard", PRIVATE_CHANNEL_ID),
+    )
+
+
+async def run_dashboard():
+    """Keep the dashboard message current until cancelled (no-op unless DASHBOARD_INTERVAL is set)."""
+    if not enabled():
+        return
+    message_id = _load_state()
+    was_idle = False
+    while True:
+        try:
+            idle = not manager.active and not manager.downloads
+            if not (idle and was_idle):        # one "nothing running" edit, then quiet until work arrives
+                text = render()
+                if message_id is None:
+                    message_id = await _post(text)
+                else:
+                    try:
+                        await _edit(message_id, text)
+                    except Exception as e:
+                        if type(e).__name__ in _GONE:
+                            logging.warning("dashboard: message %s is gone; posting a new one", message_id)
+                            message_id = None
+                            _save_state(None)
+                            continue
+                        if type(e).__name__ != "MessageNotModified":
+                            raise
+            was_idle = idle
+            await asyncio.sleep(DASHBOARD_INTERVAL)
+        except asyncio.CancelledError:
+            break
+        except Exception:
+            logging.exception("dashboard: update failed")
+            await asyncio.sleep(DASHBOARD_INTERVAL)
@@ -0,0 +1,120 @@
+# bot/dedup.py
+"""
+Seen-message set that makes upload handling idempotent.
+
+After a reconnect Telegram may deliver the same update again; without a
+check the same (chat_id, message_id) would be queued, downloaded and
+scanned twice. Handlers call first_time() before they enqueue anything.
+
+The set is bounded both ways: entries older than DEDUP_WINDOW seconds are
+dropped and at most DEDUP_MAX are kept (oldest first). With
+DEDUP_PERSIST=1 entries are also written to CONFIG_FOLDER/seen.db and
+the window is reloaded at startup, so redeliveries right after a restart
+are caught too.
+"""
+import os
+import time
+import sqlite3
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Tuple
+
+from . import CONFIG_FOLDER, telemetry
+
+DEDUP_WINDOW = int(os.getenv("DEDUP_WINDOW", "86400") or "86400")      # seconds a message id is remembered
+DEDUP_MAX = int(os.getenv("DEDUP_MAX", "50000") or "50000")            # entries kept in memory
+DEDUP_PERSIST = os.getenv("DEDUP_PERSIST", "0") == "1"
+
+SEEN_DB = Path(CONFIG_FOLDER) / "seen.db"
+
+_PRUNE_EVERY = 1000     # inserts between deletes of expired rows on disk
+
+Key = Tuple[int, int]   # (chat_id, message_id)
+
+_seen: "OrderedDict[Key, float]" = OrderedDict()     # insertion order == time order
+_conn: Optional[sqlite3.Connection] = None
+_inserts = 0
+
+_duplicates = telemetry.Counter("duplicate_updates", "Redelivered messages ignored by the seen-message set")
+
+
+def _db() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        SEEN_DB.parent.mkdir(parents=True, exist_ok=True)
+        _conn = sqlite3.connect(str(SEEN_DB))
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS seen ("
+            "chat_id INTEGER NOT NULL, message_id INTEGER NOT NULL, ts REAL NOT NULL, "
+            "PRIMARY KEY (chat_id, message_id))"
+        )
+        _conn.execute("CREATE INDEX IF NOT EXISTS ix_seen_ts ON seen(ts)")
+    return _conn
+
+
+def close():
+    global _conn
+    if _conn is not None:
+        _conn.close()
+        _conn = None
+
+
+def load():
+    """Reload the current window from disk (no-op unless DEDUP_PERSIST=1)."""
+    if not DEDUP_PERSIST:
+        return
+    try:
+        rows = _db().execute(
+            "SELECT chat_id, message_id, ts FROM seen WHERE ts > ? ORDER BY ts DESC LIMIT ?",
+            (time.time() - DEDUP_WINDOW, DEDUP_MAX),
+        ).fetchall()
+    except sqlite3.Error:
+        logging.exception("dedup: failed to load %s", SEEN_DB)
+        return
+    for chat_id, message_id, ts in reversed(rows):
+        _seen[(chat_id, message_id)] = ts
+    logging.info("dedup: %d recent message id(s) loaded", len(rows))
+
+
+def _expire(now: float):
+    cutoff = now - DEDUP_WINDOW
+    while _seen:
+        ts = next(iter(_seen.values()))
+        if ts > cutoff and len(_seen) <= DEDUP_MAX:
+            break
+        _seen.popitem(last=False)
+
+
+def _persist(key: Key, now: float):
+    global _inserts
+    try:
+        db = _db()
+        with db:
+            db.execute("INSERT OR IGNORE INTO seen (chat_id, message_id, ts) VALUES (?,?,?)", (*key, now))
+            _inserts += 1
+            if _inserts % _PRUNE_EVERY == 0:
+                db.execute("DELETE FROM seen WHERE ts <= ?", (now - DEDUP_WINDOW,))
+    except sqlite3.Error:
+        logging.exception("dedup: failed to record %s", key)
+
+
+def first_time(chat_id: int, message_id: int) -> bool:
+    """
+    Record (chat_id, message_id) and return True, or return False if it was
+    already seen within the window (a redelivered update to ignore).
+    """
+    now = time.time()
+    _expire(now)
+    key = (int(chat_id or 0), int(message_id))
+    if key in _seen:
+        _duplicates.inc()
+        logging.warning("dedup: ignoring redelivered message %s in chat %s", message_id, chat_id)
+        return False
+    _seen[key] = now
+    _expire(now)
+    if DEDUP_PERSIST:
+        _persist(key, now)
+    return True
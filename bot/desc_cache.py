@@ -1,20 +1,13 @@
 # desc_cache.py
-import os
-import time
-from typing import Optional, Dict, Tuple
+# Pending descriptions now live in the per-chat session store, which expires them on a timer
+from typing import Optional
 
-TTL = int(os.getenv("DESC_TTL_SECONDS", "180") or "180")  # 3 minutes
-_store: Dict[int, Tuple[str, float]] = {}
+from . import sessions
+
+TTL = sessions.DESC_TTL  # 3 minutes by default (DESC_TTL_SECONDS)
 
 def put(chat_id: int, text: str) -> None:
-    if text and text.strip():
-        _store[chat_id] = (text.strip(), time.time())
+    sessions.put_desc(chat_id, text)
 
 def take(chat_id: int) -> Optional[str]:
-    item = _store.pop(chat_id, None)
-    if not item:
-        return None
-    text, ts = item
-    if time.time() - ts > TTL:
-        return None
-    return text
+    return sessions.take_desc(chat_id)
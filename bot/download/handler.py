@@ -1,16 +1,18 @@
 import os
+import asyncio
 import logging
 from random import randint
+from time import time
 from pyrogram.enums import ParseMode
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
 
-from .. import app, folder
+from .. import BASE_FOLDER, app, dashboard, dedup, outbox, sessions, user
 from ..notifier import notify
 from ..notify_helpers import media_resolution, channel_handle, author_display
 from ..messages import admin_upload_started, file_added, file_exists
 from ..desc_cache import take as desc_take
-from .types import Download
-from .manager import downloads
+from .types import QueuedJob
+from .manager import downloads, wake
 from ..metrics import append_event
 
 
@@ -40,7 +42,48 @@ def _contact_button_for(msg: Message):
     return InlineKeyboardMarkup([[InlineKeyboardButton("Send Message", url=url)]])
 
 
+_background = set()     # announcement tasks, referenced until they finish
+
+
+def _announce(message: Message, filename: str, desc):
+    """Metrics event and admin "new upload request" for a queued job, off the handler's critical path."""
+    async def announce():
+        try:
+            append_event(
+                "upload_started",
+                user_id=getattr(getattr(message, "from_user", None), "id", None),
+                username=getattr(getattr(message, "from_user", None), "username", None),
+                chat=getattr(getattr(message, "chat", None), "username", None) or "private",
+                filename=filename,
+                has_desc=bool(desc),
+                media=getattr(getattr(message, "media", None), "value", None),
+            )
+            # The live dashboard shows new requests instead, when on
+            if dashboard.enabled():
+                return
+            await notify(
+                admin_upload_started(
+                    channel_handle=channel_handle(message),
+                    filename=filename,
+                    resolution=media_resolution(message),
+                    link=None,          # no inline link; we use a button
+                    author=author_display(message),
+                ),
+                reply_markup=_contact_button_for(message)
+            )
+        except Exception:
+            logging.exception("announce failed for %s", filename)
+
+    task = asyncio.create_task(announce())
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
 async def addFile(_, message: Message):
+    # A redelivered update (e.g. after a reconnect) must not queue the file twice
+    if not dedup.first_time(message.chat.id, message.id):
+        return
+
     # Description: prefer caption, else cached text
     desc = (getattr(message, "caption", None) or "").strip() or desc_take(message.chat.id)
     logging.warning("addFile: caption/desc=%r", desc)
@@ -55,56 +98,40 @@ async def addFile(_, message: Message):
     filename = filename.lstrip("/\\")  # avoid absolute paths
 
     # Path checks
-    file_display = os.path.join(folder.getPath(), filename)
-    real_file = os.path.join(folder.get(), filename)
+    chat_id = message.chat.id
+    rel_folder = sessions.folder(chat_id, activity=True)
+    file_display = os.path.join("/" + rel_folder, filename)
+    real_file = os.path.join(BASE_FOLDER, rel_folder, filename)
     if os.path.isfile(real_file):
-        return await message.reply(file_exists(file_display), quote=True, parse_mode=ParseMode.MARKDOWN)
+        return await outbox.reply(message, file_exists(file_display), quote=True, parse_mode=ParseMode.MARKDOWN)
 
-    # Progress message
-    progress = await message.reply(file_added(file_display), quote=True, parse_mode=ParseMode.MARKDOWN)
     logging.info("addFile: caption=%r desc=%r filename=%r", caption, desc, filename)
 
-    # Enqueue
-    downloads.append(
-        Download(
-            client=app,
-            id=message.id,
-            filename=filename,
-            from_message=message,
-            progress_message=progress,
-            description=desc,
-        )
-    )
-
-    append_event(
-        "upload_started",
-        user_id=getattr(getattr(message, "from_user", None), "id", None),
-        username=getattr(getattr(message, "from_user", None), "username", None),
-        chat=getattr(getattr(message, "chat", None), "username", None) or "private",
+    # Enqueue first and let the scheduler start it; the reply and notices follow in the background
+    job = QueuedJob(
+        client=app,
+        fetch_client=app,
+        from_message=message,
+        progress_message=None,
         filename=filename,
-        has_desc=bool(desc),
-        media=getattr(getattr(message, "media", None), "value", None),
+        folder=rel_folder,
+        description=desc,
+        enqueued=time(),
+        reply_chat_id=chat_id,
     )
-
-    # Admin “new upload request” with buttons
-    res = media_resolution(message)
-    chan = channel_handle(message)
-    author = author_display(message)
-    buttons = _contact_button_for(message)
-
-    await notify(
-        admin_upload_started(
-            channel_handle=chan,
-            filename=filename,
-            resolution=res,
-            link=None,          # no inline link; we use a button
-            author=author,
-        ),
-        reply_markup=buttons
+    downloads.append(job)
+    wake()
+    job.attach_reply(
+        outbox.reply(message, file_added(file_display), quote=True, parse_mode=ParseMode.MARKDOWN)
     )
+    _announce(message, filename, desc)
 
 
 async def addFileFromUser(fileMessage: Message, linkMessage: Message):
+    # Keyed on the command message: asking for the same file again is a new request, a redelivery is not
+    if not dedup.first_time(linkMessage.chat.id, linkMessage.id):
+        return
+
     # Description from file caption (or cached)
     desc = (getattr(fileMessage, "caption", None) or "").strip() or desc_take(fileMessage.chat.id)
 
@@ -121,50 +148,29 @@ async def addFileFromUser(fileMessage: Message, linkMessage: Message):
         filename = _pick_filename_from_media(fileMessage, filename)
     filename = filename.lstrip("/\\")  # avoid absolute paths
 
-    file_display = os.path.join(folder.getPath(), filename)
-    real_file = os.path.join(folder.get(), filename)
+    chat_id = linkMessage.chat.id
+    rel_folder = sessions.folder(chat_id, activity=True)
+    file_display = os.path.join("/" + rel_folder, filename)
+    real_file = os.path.join(BASE_FOLDER, rel_folder, filename)
     if os.path.isfile(real_file):
-        return await linkMessage.reply(text=f"File `{file_display}` already exists!", quote=True)
+        return await outbox.reply(linkMessage, f"File `{file_display}` already exists!", quote=True)
 
-    progress = await linkMessage.reply(
-        f"File `{file_display}` added to list.", quote=True, parse_mode=ParseMode.MARKDOWN
-    )
     logging.info("addFileFromUser: caption=%r desc=%r filename=%r", caption, desc, filename)
 
-    downloads.append(
-        Download(
-            client=app,
-            id=fileMessage.id,
-            filename=filename,
-            from_message=fileMessage,
-            progress_message=progress,
-            description=desc,
-        )
-    )
-
-    append_event(
-        "upload_started",
-        user_id=getattr(getattr(fileMessage, "from_user", None), "id", None),
-        username=getattr(getattr(fileMessage, "from_user", None), "username", None),
-        chat=getattr(getattr(fileMessage, "chat", None), "username", None) or "private",
+    job = QueuedJob(
+        client=app,
+        fetch_client=user or app,       # the source channel is only visible to the user account
+        from_message=fileMessage,
+        progress_message=None,
         filename=filename,
-        has_desc=bool(desc),
-        media=getattr(getattr(fileMessage, "media", None), "value", None),
+        folder=rel_folder,
+        description=desc,
+        enqueued=time(),
+        reply_chat_id=chat_id,
     )
-
-    # Admin “new upload request” with buttons
-    res = media_resolution(fileMessage)
-    chan = channel_handle(fileMessage)
-    author = author_display(fileMessage)
-
-    buttons = _contact_button_for(fileMessage)  # <-- fixed
-    await notify(
-        admin_upload_started(
-            channel_handle=chan,
-            filename=filename,
-            resolution=res,
-            link=None,
-            author=author,
-        ),
-        reply_markup=buttons
+    downloads.append(job)
+    wake()
+    job.attach_reply(
+        outbox.reply(linkMessage, f"File `{file_display}` added to list.", quote=True, parse_mode=ParseMode.MARKDOWN)
     )
+    _announce(fileMessage, filename, desc)
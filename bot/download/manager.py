@@ -1,17 +1,17 @@
 import os
 import logging
-from asyncio import create_task, sleep
+from asyncio import Event, TimeoutError, create_task, gather, to_thread, wait_for
 from datetime import datetime, timedelta
 from time import time
-from typing import List
+from typing import List, Optional, Set
 
 from pyrogram.client import Client
 from pyrogram.enums import ParseMode
 from pyrogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
 
-from .. import BASE_FOLDER, MAX_SIMULTANEOUS_TRANSMISSIONS
+from .. import BASE_FOLDER, MAX_SIMULTANEOUS_TRANSMISSIONS, catalog, outbox, telemetry
 from ..util import humanReadableSize, humanReadableTime, safe_relpath
-from .types import Download
+from .types import Download, QueuedJob
 
 from ..notifier import notify
 from ..messages import (
@@ -29,12 +29,27 @@ from ..notify_helpers import media_resolution, channel_handle, author_display
 
 from ..scanner import scan_path
 from ..metrics import append_event
+from ..eventstore import client_key
+from ..housekeeping import request_eviction
 
 
-downloads: List[Download] = []
+downloads: List[QueuedJob] = []
+# Jobs past the queue (transferring, scanning or notifying), for the dashboard
+active: List[Download] = []
 running: int = 0
 # List of downloads to stop
 stop: List[int] = []
+_wakeup: Optional[Event] = None
+
+telemetry.register_collector(
+    "queue_depth", "Jobs waiting to start, per lane", "gauge",
+    lambda: [({"lane": "downloads"}, len(downloads))]
+    + [({"lane": f"outbox_{p}"}, n) for p, n in outbox.depth().items()],
+)
+telemetry.register_collector(
+    "downloads_running", "Downloads currently transferring or being scanned", "gauge",
+    lambda: [({}, running)],
+)
 
 
 def _contact_button_for_message(msg):
@@ -52,37 +67,133 @@ def _contact_button_for_message(msg):
     return InlineKeyboardMarkup([[InlineKeyboardButton("Send Message", url=url)]])
 
 
+def _target_path(download: Download) -> str:
+    # The chat's /use folder (captured when the job was queued) + a plain file name
+    path = os.path.join(BASE_FOLDER, download.folder, safe_relpath(download.filename))
+    base = os.path.realpath(BASE_FOLDER)
+    if os.path.commonpath([os.path.realpath(path), base]) != base:
+        raise ValueError(f"target {path!r} is outside {BASE_FOLDER}")
+    return path
+
+
+def _event() -> Event:
+    global _wakeup
+    if _wakeup is None:
+        _wakeup = Event()
+    return _wakeup
+
+
+def wake():
+    """Let the scheduler look at the queue now (a job was queued or a slot freed)."""
+    _event().set()
+
+
+def active_paths() -> Set[str]:
+    """Catalog paths (relative to BASE_FOLDER) of downloads still transferring or being scanned."""
+    out = set()
+    for d in list(active):
+        try:
+            out.add(catalog.rel(_target_path(d)))
+        except ValueError:
+            pass
+    return out
+
+
 async def run():
     global running
+    event = _event()
     while True:
-        for download in list(downloads):
+        event.clear()
+        for job in list(downloads):
             if running == MAX_SIMULTANEOUS_TRANSMISSIONS:
                 break
-            create_task(downloadFile(download))
-            logging.info(f"New download initialized: {download.filename}")
+            create_task(startJob(job))
+            logging.info(f"New download initialized: {job.filename}")
             running += 1
-            downloads.remove(download)
+            downloads.remove(job)
         try:
-            await sleep(1)
+            await wait_for(event.wait(), timeout=1)
+        except TimeoutError:
+            pass
         except Exception:
             break
 
 
+async def _materialize(job: QueuedJob) -> Optional[Download]:
+    """Fetch the job's messages again now that it starts; None if the source or reply is gone."""
+    pending = job.reply
+    try:
+        if pending is not None:
+            # Started before its "added" reply went out: wait for that instead of fetching it
+            from_message, progress_message = await gather(
+                job.fetch_client.get_messages(job.chat_id, job.message_id), pending,
+            )
+        elif job.reply_message_id is None:
+            logging.warning("[DL] reply for %s was never sent", job.filename)
+            return None
+        else:
+            from_message = await job.fetch_client.get_messages(job.chat_id, job.message_id)
+            progress_message = await job.client.get_messages(job.reply_chat_id, job.reply_message_id)
+    except Exception:
+        logging.exception("[DL] could not fetch messages for %s", job.filename)
+        return None
+    if getattr(from_message, "empty", False) or not getattr(from_message, "media", None):
+        logging.warning("[DL] source message for %s is gone", job.filename)
+        return None
+    if getattr(progress_message, "empty", False):
+        logging.warning("[DL] progress message for %s is gone", job.filename)
+        return None
+    return Download(
+        client=job.client,
+        id=job.id,
+        filename=job.filename,
+        from_message=from_message,
+        progress_message=progress_message,
+        size=job.size,
+        description=job.description,
+        folder=job.folder,
+        enqueued=job.enqueued,
+    )
+
+
+async def startJob(job: QueuedJob):
+    global running
+    download = await _materialize(job)
+    if download is None:
+        running -= 1
+        wake()
+        outbox.submit(
+            job.reply_chat_id,
+            lambda: job.client.send_message(
+                job.reply_chat_id, download_failed_user(job.filename),
+                reply_to_message_id=job.reply_message_id, parse_mode=ParseMode.MARKDOWN,
+            ),
+            outbox.USER, "send_message",
+        )
+        append_event(
+            "upload_finished",
+            result="error",
+            user_id=job.user_id,
+            username=job.username,
+            chat=job.chat_name,
+            filename=job.filename,
+            size_bytes=0,
+            duration_sec=0.0,
+            speed_mb_s=0.0,
+        )
+        return
+    await downloadFile(download)
+
+
 async def downloadFile(download: Download):
     global running
-    await download.progress_message.edit(
-        text=starting_download(),
+    outbox.edit(
+        download.progress_message,
+        starting_download(),
         parse_mode=ParseMode.MARKDOWN,
     )
     download.started = time()
-
-    # Resolve paths safely
-    clean_name = safe_relpath(download.filename)
-    target_path = os.path.join(BASE_FOLDER, clean_name)
-    logging.info(
-        "[DL] saving to %s (BASE_FOLDER=%s, raw filename=%r)",
-        target_path, BASE_FOLDER, download.filename
-    )
+    active.append(download)
 
     # Info for admin summary
     res_str = media_resolution(download.from_message)
@@ -101,12 +212,20 @@ async def downloadFile(download: Download):
     buttons = _contact_button_for_message(download.from_message)
 
     try:
+        # Resolve paths safely (a folder that escapes BASE_FOLDER fails the job)
+        target_path = _target_path(download)
+        logging.info(
+            "[DL] saving to %s (BASE_FOLDER=%s, raw filename=%r)",
+            target_path, BASE_FOLDER, download.filename
+        )
+
         result = await download.client.download_media(
             message=download.from_message,
             file_name=target_path,
             progress=createProgress(download.client),
             progress_args=(download,),
         )
+        download.last_byte = time()
 
         # If the transmission was cancelled, Pyrogram returns a non-str/None or raises;
         # createProgress() already handled user + admin notifications & cleanup.
@@ -115,6 +234,7 @@ async def downloadFile(download: Download):
                 logging.info("[DL] Download was cancelled by user; skipping failure/finished notifications.")
                 return
 
+            download.outcome = "error"
             append_event(
                 "upload_finished",
                 result="error",
@@ -128,11 +248,12 @@ async def downloadFile(download: Download):
             )
 
             # Not cancelled: real failure
-            await download.progress_message.reply(
+            outbox.reply(
+                download.progress_message,
                 download_failed_user(download.filename),
                 parse_mode=ParseMode.MARKDOWN,
             )
-            await notify(
+            download.notice = await notify(
                 admin_upload_finished(
                     channel_handle=chan,
                     author=author,
@@ -157,7 +278,8 @@ async def downloadFile(download: Download):
         time_took = humanReadableTime(int(seconds_took))
         size_h = humanReadableSize(download.size)
 
-        await download.progress_message.edit(
+        outbox.edit(
+            download.progress_message,
             download_success_user(download.filename, size_h, time_took, speed_h),
             parse_mode=ParseMode.MARKDOWN,
         )
@@ -172,8 +294,16 @@ async def downloadFile(download: Download):
 
         # === Antivirus check ===
         av_status = "clean"
+        digest = None
         try:
-            res = scan_path(real_filename)
+            # clamd round-trip can take minutes on big files; keep it off the loop.
+            # The catalog hash is computed alongside while the file is still in page cache.
+            download.scan_start = time()
+            res, digest = await gather(
+                to_thread(scan_path, real_filename, file_size_bytes),
+                to_thread(catalog.file_hash, real_filename),
+            )
+            download.scan_end = time()
             if res.status == "infected":
                 av_status = f"infected:{res.signature or 'unknown'}"
                 try:
@@ -182,11 +312,13 @@ async def downloadFile(download: Download):
                     logging.exception("Failed to remove infected file %s", real_filename)
 
                 # Tell USER
-                await download.progress_message.reply(
+                outbox.reply(
+                    download.progress_message,
                     download_infected_user(download.filename, res.signature or "unknown"),
                     parse_mode=ParseMode.MARKDOWN,
                 )
 
+                download.outcome = "infected"
                 append_event(
                     "upload_finished",
                     result="infected",
@@ -199,7 +331,7 @@ async def downloadFile(download: Download):
                     speed_mb_s=float(avg_speed_mb_s),
                 )
                 # Admin: finished (infected/removed)
-                await notify(
+                download.notice = await notify(
                     admin_upload_finished(
                         channel_handle=chan,
                         author=author,
@@ -233,7 +365,21 @@ async def downloadFile(download: Download):
             logging.exception("AV handling failed")
             av_status = "error"
 
+        # Catalog the stored file (retention works off its expiry index)
+        try:
+            u = getattr(download.from_message, "from_user", None)
+            await to_thread(
+                catalog.add, real_filename,
+                getattr(u, "id", None), client_key(getattr(u, "username", None), getattr(u, "id", None)),
+                digest, "clean" if av_status == "clean" else "error",
+            )
+        except Exception:
+            logging.exception("Failed to catalog %s", real_filename)
+        # A burst can fill the volume long before the nightly pass; check the watermark now
+        request_eviction()
+
         # Log clean finish (or scan_error if above)
+        download.outcome = "clean" if av_status == "clean" else av_status
         append_event(
             "upload_finished",
             result="clean" if av_status == "clean" else av_status,
@@ -247,7 +393,7 @@ async def downloadFile(download: Download):
         )
 
         # Admin: finished (clean OR scan error)
-        await notify(
+        download.notice = await notify(
             admin_upload_finished(
                 channel_handle=chan,
                 author=author,
@@ -265,9 +411,10 @@ async def downloadFile(download: Download):
     except Exception:
         logging.exception("Download pipeline crashed for %s", download.filename)
         try:
-            await download.progress_message.reply(download_failed_user(download.filename))
+            outbox.reply(download.progress_message, download_failed_user(download.filename))
         except Exception:
             pass
+        download.outcome = "error"
         append_event(
             "upload_finished",
             result="error",
@@ -279,7 +426,7 @@ async def downloadFile(download: Download):
             duration_sec=float(max(0.0, (download.last_update - download.started))),
             speed_mb_s=0.0,
         )
-        await notify(
+        download.notice = await notify(
             admin_upload_finished(
                 channel_handle=chan,
                 author=author,
@@ -295,6 +442,52 @@ async def downloadFile(download: Download):
         )
     finally:
         running -= 1
+        wake()
+        active.remove(download)
+        _finish_spans(download)
+
+
+def _finish_spans(download: Download):
+    """Record the spans once the final admin notice has left the outbox (at once if there is none)."""
+    def finish(_=None):
+        download.notify_done = time()
+        _record_spans(download)
+
+    if download.notice is None or download.notice.done():
+        finish()
+    else:
+        download.notice.add_done_callback(finish)
+
+
+def _record_spans(download: Download):
+    """Log one job_spans event with the raw stage marks and the duration of each stage reached."""
+    d = download
+    marks = {
+        "enqueued": d.enqueued, "started": d.started, "first_byte": d.first_byte,
+        "last_byte": d.last_byte, "scan_start": d.scan_start, "scan_end": d.scan_end,
+        "notify_done": d.notify_done,
+    }
+    spans = (
+        ("queued", d.enqueued, d.started),
+        ("first_byte", d.started, d.first_byte),
+        ("transfer", d.first_byte, d.last_byte),
+        ("scan", d.scan_start, d.scan_end),
+        ("notify", d.scan_end or d.last_byte, d.notify_done),
+        ("total", d.enqueued or d.started, d.notify_done),
+    )
+    stages = {name: round(b - a, 3) for name, a, b in spans if a and b and b >= a}
+    try:
+        append_event(
+            "job_spans",
+            result=d.outcome or ("cancelled" if d.cancelled else "error"),
+            user_id=getattr(getattr(d.from_message, "from_user", None), "id", None),
+            filename=d.filename,
+            size_bytes=int(d.size or 0),
+            marks={k: round(v, 3) for k, v in marks.items() if v},
+            stages=stages,
+        )
+    except Exception:
+        logging.exception("Failed to record stage spans for %s", d.filename)
 
 
 def createProgress(client: Client):
@@ -306,7 +499,7 @@ def createProgress(client: Client):
 
             # Remove any partial file
             try:
-                target_path = os.path.join(BASE_FOLDER, safe_relpath(download.filename))
+                target_path = _target_path(download)
                 if os.path.exists(target_path):
                     os.remove(target_path)
                     logging.info("[DL] Cancelled: removed partial file %s", target_path)
@@ -316,13 +509,11 @@ def createProgress(client: Client):
                 logging.exception("Failed to remove partial file on cancel")
 
             # Tell the user
-            try:
-                await download.progress_message.edit(
-                    text=download_cancelled_user(download.filename),
-                    parse_mode=ParseMode.MARKDOWN,
-                )
-            except Exception:
-                pass
+            outbox.edit(
+                download.progress_message,
+                download_cancelled_user(download.filename),
+                parse_mode=ParseMode.MARKDOWN,
+            )
 
             # Tell admin with a DM button
             try:
@@ -330,6 +521,7 @@ def createProgress(client: Client):
                 author = author_display(download.from_message)
                 buttons = _contact_button_for_message(download.from_message)
 
+                download.outcome = "cancelled"
                 append_event(
                     "upload_finished",
                     result="cancelled",
@@ -342,7 +534,7 @@ def createProgress(client: Client):
                     speed_mb_s=0.0,
                 )
 
-                await notify(
+                download.notice = await notify(
                     admin_upload_cancelled(chan, author, download.filename),
                     reply_markup=buttons,
                 )
@@ -353,6 +545,12 @@ def createProgress(client: Client):
             client.stop_transmission()
             return
 
+        if not download.first_byte and received > 0:
+            download.first_byte = time()
+        telemetry.download_bytes.inc(max(0, received - download.received))
+        download.received = received
+        download.size = total
+
         # Only update download progress if the last update is 1 second old:
         # avoids flood on very fast networks
         now = time()
@@ -363,27 +561,26 @@ def createProgress(client: Client):
         avg_speed = received / max(1e-6, (now - download.started))
         tte = int((total - received) / max(1e-6, avg_speed)) if total else 0
 
-        try:
-            await download.progress_message.edit(
-                text=download_progress(
-                    download.filename,
-                    humanReadableSize(received),
-                    humanReadableSize(total),
-                    percent,
-                    humanReadableSize(avg_speed),
-                    humanReadableTime(tte),
-                ),
-                parse_mode=ParseMode.MARKDOWN,
-                reply_markup=InlineKeyboardMarkup(
-                    [[InlineKeyboardButton("Stop", callback_data=f"stop {download.id}")]]
-                ),
-            )
-        except Exception:
-            # If the message was deleted or can’t be edited, ignore and keep downloading
-            pass
+        # Queued behind user-facing sends; a newer edit replaces one still waiting
+        outbox.edit(
+            download.progress_message,
+            download_progress(
+                download.filename,
+                humanReadableSize(received),
+                humanReadableSize(total),
+                percent,
+                humanReadableSize(avg_speed),
+                humanReadableTime(tte),
+            ),
+            priority=outbox.PROGRESS,
+            method="edit_progress",
+            parse_mode=ParseMode.MARKDOWN,
+            reply_markup=InlineKeyboardMarkup(
+                [[InlineKeyboardButton("Stop", callback_data=f"stop {download.id}")]]
+            ),
+        )
 
         download.last_update = now
-        download.size = total
 
     return progress
 
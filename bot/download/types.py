@@ -1,3 +1,4 @@
+from asyncio import Future
 from dataclasses import dataclass
 from typing import Optional  # ← add this
 
@@ -15,5 +16,75 @@ class Download:
     started: float = 0
     last_update: float = 0
     size: int = 0
+    received: int = 0
     description: Optional[str] = None
+    folder: str = ""            # the chat's /use folder, relative to BASE_FOLDER
     cancelled: bool = False
+    # Stage marks (epoch seconds, 0 = not reached): enqueued → started → first_byte
+    # → last_byte → scan_start/scan_end → notify_done
+    enqueued: float = 0
+    first_byte: float = 0
+    last_byte: float = 0
+    scan_start: float = 0
+    scan_end: float = 0
+    notify_done: float = 0
+    outcome: str = ""
+    notice: Optional[Future] = None     # the final admin notice while it is in the outbox
+
+
+class QueuedJob:
+    """
+    A job waiting in the download queue. Keeps only the message ids, the file size and
+    the few display fields the queue needs; the Message objects (with their chat,
+    user and media graphs) are fetched again when the job starts.
+
+    The job can be queued before the bot's "added to list" reply exists: pass
+    progress_message=None with the chat the reply goes to, and attach_reply()
+    the outbox future once it is submitted.
+    """
+    __slots__ = (
+        "client", "fetch_client", "id", "chat_id", "message_id", "reply_chat_id", "reply_message_id", "reply",
+        "filename", "folder", "description", "size", "user_id", "username", "chat_name", "enqueued",
+    )
+
+    def __init__(
+        self,
+        client: Client,
+        fetch_client: Client,
+        from_message: Message,
+        progress_message: Optional[Message],
+        filename: str,
+        folder: str = "",
+        description: Optional[str] = None,
+        enqueued: float = 0,
+        reply_chat_id: Optional[int] = None,
+    ):
+        media = getattr(from_message, from_message.media.value, None) if getattr(from_message, "media", None) else None
+        user = getattr(from_message, "from_user", None)
+        self.client = client                    # downloads the file
+        self.fetch_client = fetch_client        # can see the source message again (the user client for /add links)
+        self.id = from_message.id
+        self.chat_id = from_message.chat.id
+        self.message_id = from_message.id
+        self.reply_chat_id = progress_message.chat.id if progress_message else reply_chat_id
+        self.reply_message_id = progress_message.id if progress_message else None
+        self.reply: Optional[Future] = None     # the reply while it is still in the outbox
+        self.filename = filename
+        self.folder = folder
+        self.description = description
+        self.size = int(getattr(media, "file_size", 0) or 0)
+        self.user_id = getattr(user, "id", None)
+        self.username = getattr(user, "username", None)
+        self.chat_name = getattr(from_message.chat, "username", None) or "private"
+        self.enqueued = enqueued
+
+    def attach_reply(self, reply: Future):
+        """Track the pending reply; once sent only its ids are kept."""
+        self.reply = reply
+        reply.add_done_callback(self._replied)
+
+    def _replied(self, reply: Future):
+        self.reply = None
+        if not reply.cancelled() and reply.exception() is None:
+            message = reply.result()
+            self.reply_chat_id, self.reply_message_id = message.chat.id, message.id
@@ -0,0 +1,444 @@
+# bot/eventstore.py
+"""
+Indexed metrics event store (SQLite under METRICS_DIR).
+
+The weekly events-YYYY-Www.jsonl files stay the append-only log (closed
+weeks are later compacted into events-YYYY-Www.jsonl.gz segments, which
+read the same way); every batch the metrics writer flushes is mirrored here so rollups, per-user lookups and
+arbitrary time ranges are index scans instead of JSON parsing. Per-day
+counters (day_stats) and quantile sketches (day_sketches) are maintained in
+the same transaction, so range reports only touch one row per day and key.
+
+The `imported` table records, per weekly log, how many of its records are
+in the store; it is advanced in the same transaction as the insert, so
+after a crash or a failed write import_jsonl() resumes where the store
+stopped instead of skipping or duplicating events.
+
+One-shot import of existing JSONL files:
+    python -m bot.eventstore [events-2025-W01.jsonl ...]
+"""
+import os
+import sys
+import gzip
+import json
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from . import CONFIG_FOLDER
+from .sketch import LogHistogram
+
+METRICS_DIR = Path(CONFIG_FOLDER) / "metrics"
+EVENTS_DB = METRICS_DIR / "events.db"
+
+# Per-day quantile sketches are kept for these upload_finished fields,
+# plus one "stage_<name>" sketch per pipeline stage found in job_spans events
+SKETCHED = ("duration_sec", "speed_mb_s")
+
+# Record keys stored in their own columns; everything else goes to `extra` (JSON)
+_COLUMNS = (
+    "ts", "kind", "user_id", "username", "chat", "filename", "result",
+    "size_bytes", "duration_sec", "speed_mb_s", "has_desc", "media",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id           INTEGER PRIMARY KEY,
+    ts           INTEGER NOT NULL,
+    kind         TEXT    NOT NULL,
+    user_id      INTEGER,
+    username     TEXT,
+    chat         TEXT,
+    filename     TEXT,
+    result       TEXT,
+    size_bytes   INTEGER,
+    duration_sec REAL,
+    speed_mb_s   REAL,
+    has_desc     INTEGER,
+    media        TEXT,
+    extra        TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_events_ts      ON events(ts);
+CREATE INDEX IF NOT EXISTS ix_events_kind_ts ON events(kind, ts);
+CREATE INDEX IF NOT EXISTS ix_events_user_ts ON events(user_id, ts);
+CREATE TABLE IF NOT EXISTS day_sketches (
+    day  TEXT NOT NULL,          -- local date, YYYY-MM-DD
+    name TEXT NOT NULL,          -- "duration_sec" | "speed_mb_s"
+    data TEXT NOT NULL,          -- LogHistogram.to_dict() as JSON
+    PRIMARY KEY (day, name)
+);
+CREATE TABLE IF NOT EXISTS day_stats (
+    day           TEXT    NOT NULL,          -- local date, YYYY-MM-DD
+    dim           TEXT    NOT NULL,          -- "all" | "user" | "ext"
+    key           TEXT    NOT NULL,          -- "" for "all", client key or extension otherwise
+    started       INTEGER NOT NULL DEFAULT 0,
+    finished      INTEGER NOT NULL DEFAULT 0,
+    clean         INTEGER NOT NULL DEFAULT 0,
+    clean_bytes   INTEGER NOT NULL DEFAULT 0,
+    infected      INTEGER NOT NULL DEFAULT 0,
+    cancelled     INTEGER NOT NULL DEFAULT 0,
+    errors        INTEGER NOT NULL DEFAULT 0,
+    deleted       INTEGER NOT NULL DEFAULT 0,
+    deleted_bytes INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, dim, key)
+);
+CREATE TABLE IF NOT EXISTS imported (
+    file        TEXT PRIMARY KEY,    -- weekly log name (a .gz segment counts as its log)
+    events      INTEGER NOT NULL,    -- records of the log (segment first, then plain file) in the store
+    imported_at INTEGER NOT NULL
+);
+"""
+_INSERT = (
+    "INSERT INTO events (ts, kind, user_id, username, chat, filename, result, "
+    "size_bytes, duration_sec, speed_mb_s, has_desc, media, extra) "
+    "VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)"
+)
+
+_STAT_FIELDS = (
+    "started", "finished", "clean", "clean_bytes", "infected",
+    "cancelled", "errors", "deleted", "deleted_bytes",
+)
+_UPSERT_STATS = (
+    f"INSERT INTO day_stats (day, dim, key, {', '.join(_STAT_FIELDS)}) "
+    f"VALUES (?,?,?,{','.join('?' * len(_STAT_FIELDS))}) "
+    "ON CONFLICT (day, dim, key) DO UPDATE SET "
+    + ", ".join(f"{f} = {f} + excluded.{f}" for f in _STAT_FIELDS)
+)
+
+_conn: Optional[sqlite3.Connection] = None
+# One connection shared by the loop and the writer thread
+_lock = threading.RLock()
+
+
+def _reader() -> sqlite3.Connection:
+    """Separate short-lived connection for streaming reads (WAL lets them run alongside writes)."""
+    _db()
+    conn = sqlite3.connect(str(EVENTS_DB), check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _db() -> sqlite3.Connection:
+    global _conn
+    with _lock:
+        if _conn is None:
+            METRICS_DIR.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(EVENTS_DB), check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            _conn = conn
+        return _conn
+
+
+def close():
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+
+# ========= Keys =========
+
+def client_key(username: Optional[str], user_id: Optional[int]) -> str:
+    if username:
+        return f"@{username}"
+    return f"id:{user_id}" if user_id is not None else "unknown"
+
+def ext_of(name: str) -> str:
+    _, ext = os.path.splitext(name or "")
+    return (ext[1:].lower() if ext else "noext")
+
+def _day_of(ts) -> str:
+    return datetime.fromtimestamp(int(ts or 0)).strftime("%Y-%m-%d")
+
+
+# ========= Writes =========
+
+def _row(rec: dict) -> tuple:
+    extra = {k: v for k, v in rec.items() if k not in _COLUMNS}
+    has_desc = rec.get("has_desc")
+    return (
+        int(rec.get("ts", 0)),
+        str(rec.get("kind") or ""),
+        rec.get("user_id"),
+        rec.get("username"),
+        rec.get("chat"),
+        rec.get("filename"),
+        rec.get("result"),
+        rec.get("size_bytes"),
+        rec.get("duration_sec"),
+        rec.get("speed_mb_s"),
+        None if has_desc is None else int(bool(has_desc)),
+        rec.get("media"),
+        json.dumps(extra, ensure_ascii=False) if extra else None,
+    )
+
+
+def _sketch_samples(batch: List[dict]) -> Dict[tuple, List[float]]:
+    """
+    Per-(day, name) samples: SKETCHED fields of clean finished uploads (same
+    population as WeekRollup) and stage durations of every job_spans event.
+    """
+    out: Dict[tuple, List[float]] = {}
+    for rec in batch:
+        kind = rec.get("kind")
+        if kind == "job_spans":
+            day = datetime.fromtimestamp(int(rec.get("ts", 0))).strftime("%Y-%m-%d")
+            for stage, secs in (rec.get("stages") or {}).items():
+                out.setdefault((day, f"stage_{stage}"), []).append(float(secs or 0.0))
+            continue
+        if kind != "upload_finished" or rec.get("result") != "clean":
+            continue
+        day = datetime.fromtimestamp(int(rec.get("ts", 0))).strftime("%Y-%m-%d")
+        for name in SKETCHED:
+            out.setdefault((day, name), []).append(float(rec.get(name, 0) or 0.0))
+    return out
+
+
+def _update_day_sketches(db: sqlite3.Connection, batch: List[dict]):
+    for (day, name), values in _sketch_samples(batch).items():
+        row = db.execute("SELECT data FROM day_sketches WHERE day = ? AND name = ?", (day, name)).fetchone()
+        h = LogHistogram.from_dict(json.loads(row[0])) if row else LogHistogram()
+        h.extend(values)
+        db.execute(
+            "INSERT OR REPLACE INTO day_sketches (day, name, data) VALUES (?,?,?)",
+            (day, name, json.dumps(h.to_dict())),
+        )
+
+
+def _stat_deltas(batch: List[dict]) -> Dict[tuple, List[int]]:
+    """(day, dim, key) -> increments for _STAT_FIELDS."""
+    out: Dict[tuple, List[int]] = {}
+
+    def bump(day, dim, key, **inc):
+        row = out.setdefault((day, dim, key), [0] * len(_STAT_FIELDS))
+        for f, n in inc.items():
+            row[_STAT_FIELDS.index(f)] += n
+
+    for rec in batch:
+        kind = rec.get("kind")
+        day = _day_of(rec.get("ts"))
+        size = int(rec.get("size_bytes", 0) or 0)
+        who = client_key(rec.get("username"), rec.get("user_id"))
+        if kind == "upload_started":
+            bump(day, "all", "", started=1)
+            bump(day, "user", who, started=1)
+        elif kind == "upload_finished":
+            result = rec.get("result")
+            if result == "clean":
+                inc = {"finished": 1, "clean": 1, "clean_bytes": size}
+            elif result in ("infected", "cancelled"):
+                inc = {"finished": 1, result: 1}
+            else:
+                inc = {"finished": 1, "errors": 1}
+            bump(day, "all", "", **inc)
+            bump(day, "user", who, **inc)
+            bump(day, "ext", ext_of(rec.get("filename", "")), **inc)
+        elif kind == "retention_deleted":
+            bump(day, "all", "", deleted=1, deleted_bytes=size)
+    return out
+
+
+def _update_day_stats(db: sqlite3.Connection, batch: List[dict]):
+    db.executemany(_UPSERT_STATS, [(*k, *v) for k, v in _stat_deltas(batch).items()])
+
+
+_ADVANCE = (
+    "INSERT INTO imported (file, events, imported_at) VALUES (?,?,?) "
+    "ON CONFLICT (file) DO UPDATE SET events = events + excluded.events, imported_at = excluded.imported_at"
+)
+
+
+def insert(batch: List[dict], progress: Optional[Dict[str, int]] = None):
+    """
+    Insert a batch of event records (and fold them into the day sketches) in
+    one transaction. `progress` maps log name -> records of the batch just
+    appended to that weekly log; its import position moves in the same
+    transaction.
+    """
+    if not batch:
+        return
+    now = int(datetime.now().timestamp())
+    with _lock:
+        db = _db()
+        with db:
+            db.executemany(_INSERT, [_row(r) for r in batch])
+            _update_day_sketches(db, batch)
+            _update_day_stats(db, batch)
+            for name, n in (progress or {}).items():
+                db.execute(_ADVANCE, (log_name(Path(name)), int(n), now))
+
+
+# ========= Reads =========
+
+def _record(row: sqlite3.Row) -> dict:
+    rec = {k: row[k] for k in _COLUMNS if row[k] is not None}
+    if "has_desc" in rec:
+        rec["has_desc"] = bool(rec["has_desc"])
+    if row["extra"]:
+        try:
+            rec.update(json.loads(row["extra"]))
+        except Exception:
+            pass
+    return rec
+
+
+def query(
+    start_ts: int,
+    end_ts: int,
+    kinds: Optional[Iterable[str]] = None,
+    user_id: Optional[int] = None,
+    batch: int = 1000,
+) -> Iterator[dict]:
+    """
+    Yield events with start_ts <= ts < end_ts in time order, optionally
+    filtered by kind(s) and user. Rows are fetched in batches, so long ranges
+    don't materialize in memory.
+    """
+    sql = "SELECT * FROM events WHERE ts >= ? AND ts < ?"
+    args: list = [int(start_ts), int(end_ts)]
+    if kinds:
+        kinds = list(kinds)
+        sql += f" AND kind IN ({','.join('?' * len(kinds))})"
+        args += kinds
+    if user_id is not None:
+        sql += " AND user_id = ?"
+        args.append(int(user_id))
+    sql += " ORDER BY ts, id"
+
+    conn = _reader()
+    try:
+        cur = conn.execute(sql, args)
+        while True:
+            rows = cur.fetchmany(batch)
+            if not rows:
+                break
+            for r in rows:
+                yield _record(r)
+    finally:
+        conn.close()
+
+
+def has_events(start_ts: int, end_ts: int) -> bool:
+    with _lock:
+        row = _db().execute(
+            "SELECT 1 FROM events WHERE ts >= ? AND ts < ? LIMIT 1", (int(start_ts), int(end_ts))
+        ).fetchone()
+    return row is not None
+
+
+def merged_sketch(name: str, start_ts: int, end_ts: int) -> LogHistogram:
+    """Merge the persisted per-day sketches of `name` for every day touching [start_ts, end_ts)."""
+    first = datetime.fromtimestamp(int(start_ts)).strftime("%Y-%m-%d")
+    last = datetime.fromtimestamp(max(int(start_ts), int(end_ts) - 1)).strftime("%Y-%m-%d")
+    h = LogHistogram()
+    with _lock:
+        rows = _db().execute(
+            "SELECT data FROM day_sketches WHERE name = ? AND day >= ? AND day <= ?", (name, first, last)
+        ).fetchall()
+    for (data,) in rows:
+        h.merge(LogHistogram.from_dict(json.loads(data)))
+    return h
+
+
+def day_stats(first_day: str, last_day: str, dim: str = "all", limit: Optional[int] = None) -> List[dict]:
+    """
+    Daily counters summed over first_day..last_day (YYYY-MM-DD, inclusive),
+    one dict per key of `dim`, biggest clean volume first.
+    """
+    sql = (
+        f"SELECT key, {', '.join(f'SUM({f})' for f in _STAT_FIELDS)} FROM day_stats "
+        "WHERE dim = ? AND day >= ? AND day <= ? GROUP BY key ORDER BY SUM(clean_bytes) DESC, SUM(finished) DESC"
+    )
+    args: list = [dim, first_day, last_day]
+    if limit:
+        sql += " LIMIT ?"
+        args.append(int(limit))
+    with _lock:
+        rows = _db().execute(sql, args).fetchall()
+    return [{"key": r[0], **{f: int(v or 0) for f, v in zip(_STAT_FIELDS, r[1:])}} for r in rows]
+
+
+# ========= Importer =========
+
+def log_name(path: Path) -> str:
+    """Name a weekly log is tracked under, whether plain or a compacted .gz segment."""
+    name = Path(path).name
+    return name[:-3] if name.endswith(".gz") else name
+
+
+def iter_log(path: Path) -> Iterator[dict]:
+    """Stream the records of a weekly log, plain JSONL or gzip-compressed."""
+    path = Path(path)
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except Exception:
+                continue
+
+
+def _log_records(folder: Path, name: str) -> Iterator[dict]:
+    """Records of one weekly log in write order: its compacted segment, then the plain file."""
+    for path in (folder / (name + ".gz"), folder / name):
+        if path.exists():
+            yield from iter_log(path)
+
+
+def import_jsonl(paths: Optional[Iterable[Path]] = None) -> int:
+    """
+    Import weekly log records that aren't in the store yet (all of
+    METRICS_DIR/events-*-W*.jsonl[.gz] by default), resuming each log from
+    its recorded position; a compacted segment counts as the log it was made
+    from. Returns the number of events imported.
+    """
+    if paths is None:
+        paths = sorted(METRICS_DIR.glob("events-*-W*.jsonl")) + sorted(METRICS_DIR.glob("events-*-W*.jsonl.gz"))
+    logs: Dict[str, Path] = {}
+    for path in paths:
+        logs.setdefault(log_name(Path(path)), Path(path).parent)
+    total = 0
+    for name, folder in logs.items():
+        n = 0
+        chunk: List[dict] = []
+        with _lock:
+            db = _db()
+            row = db.execute("SELECT events FROM imported WHERE file = ?", (name,)).fetchone()
+            done = int(row[0]) if row else 0
+            with db:
+                for i, rec in enumerate(_log_records(folder, name)):
+                    if i < done:
+                        continue
+                    chunk.append(rec)
+                    if len(chunk) >= 5000:
+                        db.executemany(_INSERT, [_row(r) for r in chunk])
+                        _update_day_sketches(db, chunk)
+                        _update_day_stats(db, chunk)
+                        n += len(chunk)
+                        chunk = []
+                if chunk:
+                    db.executemany(_INSERT, [_row(r) for r in chunk])
+                    _update_day_sketches(db, chunk)
+                    _update_day_stats(db, chunk)
+                    n += len(chunk)
+                if n or row is None:
+                    db.execute(_ADVANCE, (name, n, int(datetime.now().timestamp())))
+        if n:
+            logging.info("eventstore: imported %d event(s) from %s", n, name)
+        total += n
+    return total
+
+
+if __name__ == "__main__":
+    files = [Path(a) for a in sys.argv[1:]] or None
+    n = import_jsonl(files)
+    print(f"Imported {n} event(s) into {EVENTS_DB}")
@@ -1,27 +1,21 @@
 import os
 
-from . import BASE_FOLDER
+from . import BASE_FOLDER, sessions
 
-storage = BASE_FOLDER
+# The /use folder is per chat (see sessions); each function takes the chat id.
 
 
-def reset():
-    global storage
-    storage = BASE_FOLDER
+def reset(chat_id: int):
+    sessions.reset_folder(chat_id)
 
 
-def set(path: str):
-    global storage
-    storage = os.path.join(BASE_FOLDER, path)
-    try:
-        os.mkdir(storage)
-    except FileExistsError:
-        pass
+def set(chat_id: int, path: str):
+    sessions.set_folder(chat_id, path)
 
 
-def getPath() -> str:
-    return storage.replace(BASE_FOLDER, "", 1) or "/"
+def getPath(chat_id: int) -> str:
+    return "/" + sessions.folder(chat_id)
 
 
-def get() -> str:
-    return storage
+def get(chat_id: int) -> str:
+    return os.path.join(BASE_FOLDER, sessions.folder(chat_id))
@@ -0,0 +1,390 @@
+# bot/fswatch.py
+"""
+Linux inotify watcher that keeps the file catalog in sync as the share
+changes, instead of finding out on the next full walk.
+
+Every directory under BASE_FOLDER gets a watch (inotify is not recursive;
+new subdirectories are added as they appear). Events are read on a
+dedicated thread, never on the event loop, and applied to the catalog
+one file at a time: writes and creations upsert, deletions remove,
+renames inside the share keep the row (owner, verdict, pin) under its new
+path and renames out of it drop the row.
+
+When the kernel queue overflows (IN_Q_OVERFLOW) events were lost, so the
+watcher re-lists the directory tree, compares each folder's mtime with the
+one it last saw and re-syncs only the folders that changed.
+
+ctypes only, no extra dependency. Off on other platforms, when
+CATALOG_WATCH=0, or when the watch limit (fs.inotify.max_user_watches) is
+too low for the share; the nightly full walk covers those cases.
+"""
+import os
+import sys
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+from . import BASE_FOLDER, catalog, telemetry
+
+CATALOG_WATCH = os.getenv("CATALOG_WATCH", "1") != "0"
+
+# <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+_MASK = (
+    IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+)
+
+_EVENT = struct.Struct("iIII")      # wd, mask, cookie, len (name follows, NUL-padded)
+_READ_SIZE = 64 * 1024
+_POLL = 1.0                         # seconds between stop-flag checks while idle
+
+# Not catalogued: legacy warning sidecars and Pyrogram's in-progress downloads
+_IGNORED_SUFFIXES = (".warned", ".temp")
+
+_events = telemetry.Counter("fswatch_events", "Filesystem events applied to the catalog", ("kind",))
+_overflows = telemetry.Counter("fswatch_overflows", "inotify queue overflows (each triggers a targeted rescan)")
+
+
+class _Inotify:
+    """Thin ctypes binding over libc's inotify calls."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add = libc.inotify_add_watch
+        self._add.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self._rm = libc.inotify_rm_watch
+        self._rm.argtypes = (ctypes.c_int, ctypes.c_int)
+        self.fd = libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+    def add_watch(self, path: str, mask: int) -> int:
+        wd = self._add(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def rm_watch(self, wd: int):
+        self._rm(self.fd, wd)       # EINVAL once the kernel already dropped it; nothing to do
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _Watcher:
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.ino = _Inotify()
+        self.dirs: Dict[int, str] = {}          # wd -> directory
+        self.wds: Dict[str, int] = {}           # directory -> wd
+        self.mtimes: Dict[str, float] = {}      # directory -> mtime when last in sync
+        # MOVED_FROM halves waiting for their MOVED_TO: cookie -> (path, is_dir, batch)
+        self.moves: Dict[int, Tuple[str, bool, int]] = {}
+        self.batch = 0
+
+    # ----- watches -----
+
+    def _watch(self, path: str) -> bool:
+        try:
+            wd = self.ino.add_watch(path, _MASK)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                raise       # out of watches: the caller gives up on watching
+            return False    # vanished or not a directory (any more)
+        self.dirs[wd] = path
+        self.wds[path] = wd
+        self._note_mtime(path)
+        return True
+
+    def _note_mtime(self, path: str):
+        try:
+            self.mtimes[path] = os.lstat(path).st_mtime
+        except OSError:
+            self.mtimes.pop(path, None)
+
+    def watch_tree(self, top: str) -> List[str]:
+        """Watch `top` and every directory under it; returns the directories newly watched."""
+        added: List[str] = []
+        stack = [top]
+        while stack:
+            d = stack.pop()
+            if d not in self.wds:
+                if not self._watch(d):
+                    continue
+                added.append(d)
+            _, subdirs = catalog._scan_dir(d)
+            stack.extend(subdirs)
+        return added
+
+    def _forget(self, top: str):
+        """Drop the watches on `top` and everything below it (a moved-out folder keeps them otherwise)."""
+        prefix = top + os.sep
+        for d in [d for d in self.wds if d == top or d.startswith(prefix)]:
+            wd = self.wds.pop(d)
+            self.dirs.pop(wd, None)
+            self.mtimes.pop(d, None)
+            self.ino.rm_watch(wd)
+
+    def _rekey(self, old: str, new: str):
+        """A watched directory was renamed: its watches stay, only the paths move."""
+        prefix = old + os.sep
+        for d in [d for d in self.wds if d == old or d.startswith(prefix)]:
+            moved = new + d[len(old):]
+            wd = self.wds.pop(d)
+            self.wds[moved] = wd
+            self.dirs[wd] = moved
+            if d in self.mtimes:
+                self.mtimes[moved] = self.mtimes.pop(d)
+
+    # ----- events -----
+
+    def _dir_arrived(self, path: str):
+        # Files can land in a new folder before its watch exists: sync what is already there
+        for d in self.watch_tree(path):
+            catalog.sync_dir(d)
+
+    def _dir_gone(self, path: str):
+        self._forget(path)
+        catalog.remove_tree(path)
+
+    def _apply(self, wd: int, mask: int, cookie: int, name: str, touched: Set[str]):
+        parent = self.dirs.get(wd)
+        if parent is None:
+            return
+        if mask & IN_IGNORED:
+            self.dirs.pop(wd, None)
+            if self.wds.get(parent) == wd:
+                self.wds.pop(parent, None)
+                self.mtimes.pop(parent, None)
+            return
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            if parent == self.root:
+                logging.error("fswatch: %s was %s; catalog falls back to full walks",
+                              parent, "deleted" if mask & IN_DELETE_SELF else "moved")
+                raise _RootGone()
+            return      # a subfolder: handled through its parent's DELETE / MOVED_FROM
+        if not name:
+            return
+
+        path = os.path.join(parent, name)
+        is_dir = bool(mask & IN_ISDIR)
+        touched.add(parent)
+        if not is_dir and name.endswith(_IGNORED_SUFFIXES):
+            if mask & IN_MOVED_FROM:
+                self.moves[cookie] = (path, False, self.batch)      # a finished download's .temp -> final name
+            return
+
+        if mask & IN_MOVED_FROM:
+            self.moves[cookie] = (path, is_dir, self.batch)
+            return
+        if mask & IN_MOVED_TO:
+            src = self.moves.pop(cookie, None)
+            if src is None:
+                kind = "moved_in"
+                if is_dir:
+                    self._dir_arrived(path)
+                else:
+                    catalog.upsert(path)
+            elif is_dir:
+                kind = "renamed"
+                self._rekey(src[0], path)
+                catalog.rename_tree(src[0], path)
+            else:
+                kind = "renamed"
+                catalog.rename(src[0], path)
+        elif mask & IN_DELETE:
+            kind = "deleted"
+            if is_dir:
+                self._dir_gone(path)
+            else:
+                catalog.remove(catalog.rel(path))
+        elif is_dir:
+            if not mask & IN_CREATE:
+                return
+            kind = "dir_created"
+            self._dir_arrived(path)
+        else:
+            kind = "written"
+            catalog.upsert(path)
+        _events.inc(kind=kind)
+
+    def _settle_moves(self, everything: bool = False):
+        """MOVED_FROM with no MOVED_TO by the next read: the entry left the share."""
+        for cookie, (path, is_dir, batch) in list(self.moves.items()):
+            if everything or batch < self.batch:
+                del self.moves[cookie]
+                if is_dir:
+                    self._dir_gone(path)
+                elif not path.endswith(_IGNORED_SUFFIXES):
+                    catalog.remove(catalog.rel(path))
+                _events.inc(kind="moved_out")
+
+    def rescan(self):
+        """After an overflow: watch new folders, drop vanished ones, re-sync folders whose mtime moved."""
+        _overflows.inc()
+        self._settle_moves(everything=True)
+        seen: Set[str] = set()
+        changed: List[str] = []
+        stack = [self.root]
+        while stack:
+            d = stack.pop()
+            seen.add(d)
+            try:
+                mtime = os.lstat(d).st_mtime
+            except OSError:
+                continue
+            if d not in self.wds:
+                if not self._watch(d):
+                    continue
+                changed.append(d)
+            elif self.mtimes.get(d) != mtime:
+                self.mtimes[d] = mtime
+                changed.append(d)
+            _, subdirs = catalog._scan_dir(d)
+            stack.extend(subdirs)
+        for d in [d for d in self.wds if d not in seen]:
+            self._dir_gone(d)
+        for d in changed:
+            catalog.sync_dir(d)
+        logging.warning("fswatch: event queue overflowed; re-synced %d of %d folder(s)", len(changed), len(seen))
+
+    def _read(self) -> Optional[bytes]:
+        ready, _, _ = select.select([self.ino.fd], [], [], _POLL)
+        if not ready:
+            return None
+        try:
+            return os.read(self.ino.fd, _READ_SIZE)
+        except InterruptedError:
+            return None
+
+    def run(self, stop: threading.Event):
+        while not stop.is_set():
+            buf = self._read()
+            if not buf:
+                self._settle_moves(everything=True)
+                continue
+            self.batch += 1
+            touched: Set[str] = set()
+            overflow = False
+            off = 0
+            while off + _EVENT.size <= len(buf):
+                wd, mask, cookie, length = _EVENT.unpack_from(buf, off)
+                off += _EVENT.size
+                name = os.fsdecode(buf[off:off + length].rstrip(b"\0"))
+                off += length
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                try:
+                    self._apply(wd, mask, cookie, name, touched)
+                except _RootGone:
+                    raise
+                except Exception:
+                    logging.exception("fswatch: failed to apply event %#x for %s", mask, name)
+            if overflow:
+                self.rescan()
+                continue
+            self._settle_moves()
+            for d in touched:
+                if d in self.wds:
+                    self._note_mtime(d)
+
+    def close(self):
+        self.ino.close()
+
+
+class _RootGone(Exception):
+    pass
+
+
+_watcher: Optional[_Watcher] = None
+_thread: Optional[threading.Thread] = None
+_stop = threading.Event()
+
+
+def _loop(w: _Watcher):
+    try:
+        w.run(_stop)
+    except _RootGone:
+        pass
+    except Exception:
+        logging.exception("fswatch: watcher thread died; catalog falls back to full walks")
+    finally:
+        w.close()
+
+
+def start() -> bool:
+    """
+    Watch every folder under BASE_FOLDER and start the reader thread.
+    Blocking (one inotify_add_watch per folder); run it in a worker thread
+    before the startup reconcile so nothing lands unseen in between.
+    Returns False when watching is off or not possible here.
+    """
+    global _watcher, _thread
+    if not CATALOG_WATCH or _thread is not None:
+        return False
+    if not sys.platform.startswith("linux"):
+        logging.info("fswatch: inotify needs Linux; catalog relies on full walks")
+        return False
+    try:
+        w = _Watcher(BASE_FOLDER)
+    except (OSError, AttributeError):
+        logging.warning("fswatch: inotify unavailable; catalog relies on full walks", exc_info=True)
+        return False
+    try:
+        w.watch_tree(w.root)
+    except OSError:
+        logging.error(
+            "fswatch: ran out of inotify watches after %d folder(s); raise fs.inotify.max_user_watches. "
+            "Catalog relies on full walks.", len(w.wds),
+        )
+        w.close()
+        return False
+    _stop.clear()
+    _watcher = w
+    _thread = threading.Thread(target=_loop, args=(w,), name="fswatch", daemon=True)
+    _thread.start()
+    logging.info("fswatch: watching %d folder(s) under %s", len(w.wds), w.root)
+    return True
+
+
+def stop():
+    global _watcher, _thread
+    if _thread is None:
+        return
+    _stop.set()
+    _thread.join(timeout=_POLL * 5)
+    _watcher, _thread = None, None
+
+
+def running() -> bool:
+    """True while the watcher keeps the catalog current (the nightly full walk can be skipped)."""
+    return _thread is not None and _thread.is_alive()
+
+
+telemetry.register_collector(
+    "fswatch_watches", "Folders under inotify watch (0 = watcher off)", "gauge",
+    lambda: [({}, len(_watcher.wds) if running() else 0)],
+)
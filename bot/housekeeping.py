@@ -1,18 +1,41 @@
 import os
+import shutil
 import asyncio
 import time
 import logging
-from datetime import datetime
-from pathlib import Path
+import tempfile
+from typing import List, Optional, Tuple
 
-from . import folder
-from .messages import retention_warning, retention_deleted
-from .notifier import notify
-from .metrics import append_event, send_weekly_report
+from . import BASE_FOLDER, catalog, fswatch, telemetry
+from .messages import (
+    retention_digest, retention_digest_line, retention_digest_page, retention_digest_document,
+)
+from .notifier import notify, notify_document
+from .metrics import append_event, compact_event_logs, send_weekly_report
+from .scheduler import add_job, run_scheduler
 
 RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "30") or "30")
 RETENTION_NOTICE_DAYS = int(os.getenv("RETENTION_NOTICE_DAYS", "2") or "2")
 RETENTION_WARN_ONCE = os.getenv("RETENTION_WARN_ONCE", "1") != "0"  # warn once by default
+RETENTION_DIGEST_TOP = int(os.getenv("RETENTION_DIGEST_TOP", "10") or "10")          # largest files listed in each digest
+RETENTION_DIGEST_INLINE = int(os.getenv("RETENTION_DIGEST_INLINE", "100") or "100")  # longer lists go out as a document
+
+# Capacity eviction: above EVICT_HIGH_WATERMARK % used, delete by EVICT_POLICY down to EVICT_LOW_WATERMARK %
+EVICT_HIGH_WATERMARK = float(os.getenv("EVICT_HIGH_WATERMARK", "0") or "0")      # 0 = disabled
+EVICT_LOW_WATERMARK = float(os.getenv("EVICT_LOW_WATERMARK", "80") or "80")
+EVICT_POLICY = (os.getenv("EVICT_POLICY", "oldest") or "oldest").lower()         # oldest | largest | lru
+EVICT_GRACE_HOURS = float(os.getenv("EVICT_GRACE_HOURS", "24") or "24")           # files added more recently are never evicted
+if EVICT_POLICY not in catalog.EVICTION_POLICIES:
+    logging.error("EVICT_POLICY=%r is not one of %s; using 'oldest'", EVICT_POLICY, ", ".join(catalog.EVICTION_POLICIES))
+    EVICT_POLICY = "oldest"
+
+_PAGE_CHARS = 3800      # Telegram caps messages at 4096 characters
+
+_walk_seconds = telemetry.Histogram(
+    "catalog_walk_seconds", "Duration of full catalog walks over the share",
+    (0.1, 0.5, 1, 5, 15, 60, 300, 900),
+)
+_walk_files = telemetry.Gauge("catalog_walk_files", "Files seen by the last full catalog walk")
 
 DISK_USAGE_DAY = (os.getenv("DISK_USAGE_DAY", "Monday") or "Monday").lower()
 DISK_USAGE_HOUR = int(os.getenv("DISK_USAGE_HOUR", "9"))
@@ -22,132 +45,254 @@ DAY_INDEX = {
     "friday": 4, "saturday": 5, "sunday": 6
 }
 
+# Cron expressions (see bot.scheduler); the weekly default follows DISK_USAGE_DAY/HOUR
+SCHEDULE_WEEKLY_REPORT = os.getenv("SCHEDULE_WEEKLY_REPORT") or (
+    f"0 {DISK_USAGE_HOUR} * * {(DAY_INDEX.get(DISK_USAGE_DAY, 0) + 1) % 7}"
+)
+SCHEDULE_RETENTION = os.getenv("SCHEDULE_RETENTION") or "0 3 * * *"
+
 
 def now_ts() -> float:
     return time.time()
 
 
-def file_age_days(p: Path) -> int:
-    try:
-        st = p.stat()
-        return int((now_ts() - st.st_mtime) / 86400.0)
-    except Exception:
-        return 0
+def _age_days(mtime: float) -> int:
+    return int((now_ts() - mtime) / 86400.0)
+
+
+async def reconcile_catalog():
+    """Walk the whole share (all subfolders) into the catalog and record what the pass cost."""
+    st = await asyncio.to_thread(catalog.reconcile)
+    _walk_seconds.observe(st["seconds"])
+    _walk_files.set(st["files"])
+    append_event(
+        "catalog_walk",
+        files=int(st["files"]),
+        dirs=int(st["dirs"]),
+        duration_sec=float(st["seconds"]),
+        added=int(st["added"]),
+        updated=int(st["updated"]),
+        removed=int(st["removed"]),
+    )
 
 
-def _safe_regular_file(p: Path, base: Path) -> bool:
+def _write_list(kind: str, items: List[Tuple[str, int, int]]) -> str:
+    fd, path = tempfile.mkstemp(prefix=f"retention-{kind}-", suffix=".tsv")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write("filename\tage_days\tsize_bytes\n")
+        for fn, age, size in items:
+            f.write(f"{fn}\t{age}\t{size}\n")
+    return path
+
+
+async def _send_digest(kind: str, items: List[Tuple[str, int, int]], **extra):
     """
-    Resolve symlinks and ensure the file lives directly under the base folder.
-    Prevents accidental deletes outside of /data via symlinks.
+    One digest per run and category: totals plus the largest files, then the
+    full list as a few paginated messages, or as a document when it's long.
     """
+    if not items:
+        return
+    top = sorted(items, key=lambda it: -it[2])[:RETENTION_DIGEST_TOP]
+    await notify(retention_digest(kind, len(items), sum(it[2] for it in items), top, RETENTION_NOTICE_DAYS, **extra))
+    if len(items) <= len(top):
+        return
+
+    items = sorted(items)
+    if len(items) > RETENTION_DIGEST_INLINE:
+        path = await asyncio.to_thread(_write_list, kind, items)
+        try:
+            await notify_document(path, retention_digest_document(kind, len(items)))
+        finally:
+            os.unlink(path)
+        return
+
+    pages: List[List[str]] = [[]]
+    size = 0
+    for fn, age, sz in items:
+        line = retention_digest_line(fn, age, sz)
+        if pages[-1] and size + len(line) + 1 > _PAGE_CHARS:
+            pages.append([])
+            size = 0
+        pages[-1].append(line)
+        size += len(line) + 1
+    for i, lines in enumerate(pages, start=1):
+        await notify(retention_digest_page(kind, lines, i, len(pages)))
+
+
+async def do_retention():
+    """
+    Warn about and delete expiring files. Candidates come from the catalog's
+    expiry index; only those are re-checked on disk. Admins get one digest
+    per category instead of a message per file.
+    """
+    now = int(now_ts())
+    notice_until = now + RETENTION_NOTICE_DAYS * 86400
+
+    # --- Warning window (T - notice_days ... T - 1)
+    warned: List[Tuple[str, int, int]] = []
+    for row in await asyncio.to_thread(catalog.expiring, notice_until, RETENTION_WARN_ONCE, now):
+        row = await asyncio.to_thread(catalog.refresh, row["path"])
+        if row is None or not (now < row["expires_at"] <= notice_until):
+            continue
+        if RETENTION_WARN_ONCE and row["warned_at"]:
+            continue
+        warned.append((row["path"], _age_days(row["mtime"]), int(row["size"])))
     try:
-        rp = p.resolve(strict=True)
-        return rp.is_file() and rp.parent == base.resolve(strict=True)
-    except FileNotFoundError:
-        return False
+        await _send_digest("warn", warned)
+        for name, _, _ in warned:
+            catalog.mark_warned(name)
+        logging.info("housekeeping: warned about %d file(s)", len(warned))
     except Exception:
-        logging.exception("housekeeping: resolve failed for %s", p)
-        return False
+        logging.exception("housekeeping: warning digest failed")
 
+    # --- Deletion at/after retention threshold
+    deleted: List[Tuple[str, int, int]] = []
+    for row in await asyncio.to_thread(catalog.expiring, now):
+        row = await asyncio.to_thread(catalog.refresh, row["path"])
+        if row is None or row["expires_at"] > now:
+            continue
+        name, age, size_b = row["path"], _age_days(row["mtime"]), int(row["size"])
+        try:
+            os.unlink(catalog.abspath(name))
+            catalog.remove(name)
+            append_event(
+                "retention_deleted",
+                filename=name,
+                size_bytes=size_b,
+                age_days=int(age),
+            )
+            deleted.append((name, age, size_b))
+            logging.info("housekeeping: deleted: %s (age=%d, size=%d)", name, age, size_b)
+        except Exception:
+            logging.exception("housekeeping: failed to delete %s", name)
+    try:
+        await _send_digest("deleted", deleted)
+    except Exception:
+        logging.exception("housekeeping: deletion digest failed")
 
-def _warn_flag(p: Path) -> Path:
-    # Sidecar marker to warn only once per file within the T-RETENTION_NOTICE window
-    return p.with_name(p.name + ".warned")
 
+# ========= Capacity eviction =========
 
-async def do_retention():
-    base = Path(folder.get())
-    if not base.exists():
-        logging.info("housekeeping: base folder missing: %s", base)
+_evict_lock = asyncio.Lock()
+_evict_task: Optional[asyncio.Task] = None
+
+def _disk_usage() -> Tuple[int, int]:
+    """(total, used) bytes of the download volume (one statvfs call)."""
+    u = shutil.disk_usage(BASE_FOLDER)
+    return u.total, u.used
+
+def _percent(total: int, used: int) -> float:
+    return used * 100.0 / total if total else 0.0
+
+
+def request_eviction():
+    """
+    Cheap check for the download pipeline to call after storing a file:
+    start an eviction pass in the background if usage is above the high mark.
+    """
+    global _evict_task
+    if EVICT_HIGH_WATERMARK <= 0 or (_evict_task is not None and not _evict_task.done()):
         return
+    try:
+        if _percent(*_disk_usage()) < EVICT_HIGH_WATERMARK:
+            return
+    except OSError:
+        logging.exception("housekeeping: disk usage check failed")
+        return
+    _evict_task = asyncio.create_task(enforce_watermarks(), name="evict")
 
-    warn_window_start = max(0, RETENTION_DAYS - RETENTION_NOTICE_DAYS)
 
-    for p in base.iterdir():
-        if not _safe_regular_file(p, base):
-            continue
+async def enforce_watermarks():
+    """
+    If the volume is above EVICT_HIGH_WATERMARK, delete unpinned catalogued
+    files in EVICT_POLICY order until it is below EVICT_LOW_WATERMARK.
+    Every eviction is a retention_deleted event (reason "watermark").
+    Files added within EVICT_GRACE_HOURS and downloads still in the pipeline
+    are never evicted.
+    """
+    # Imported here: the download manager imports this module for request_eviction()
+    from .download.manager import active_paths
 
-        age = file_age_days(p)
-
-        # --- Warning window (T - notice_days ... T - 1)
-        if warn_window_start <= age < RETENTION_DAYS:
-            flag = _warn_flag(p)
-            should_warn = True
-            if RETENTION_WARN_ONCE and flag.exists():
-                should_warn = False
-            if should_warn:
-                try:
-                    await notify(retention_warning(p.name, age, RETENTION_NOTICE_DAYS))
-                    logging.info("housekeeping: warned: %s (age=%d)", p.name, age)
-                    if RETENTION_WARN_ONCE:
-                        try:
-                            flag.touch(exist_ok=True)
-                        except Exception:
-                            logging.exception("housekeeping: failed to write warn flag for %s", p)
-                except Exception:
-                    logging.exception("housekeeping: warning notify failed for %s", p)
-
-        # --- Deletion at/after retention threshold
-        if age >= RETENTION_DAYS:
-            size_b = 0
+    if EVICT_HIGH_WATERMARK <= 0:
+        return
+    async with _evict_lock:
+        total, used = _disk_usage()
+        before = _percent(total, used)
+        if before < EVICT_HIGH_WATERMARK:
+            return
+        target = int(total * EVICT_LOW_WATERMARK / 100.0)
+        logging.warning(
+            "housekeeping: disk at %.1f%% (high mark %.0f%%); evicting %s first down to %.0f%%",
+            before, EVICT_HIGH_WATERMARK, EVICT_POLICY, EVICT_LOW_WATERMARK,
+        )
+        evicted: List[Tuple[str, int, int]] = []
+        need = used - target
+        grace = int(time.time() - EVICT_GRACE_HOURS * 3600)
+        for row in await asyncio.to_thread(catalog.eviction_candidates, EVICT_POLICY, grace):
+            if need <= 0:
+                # Sizes in the catalog are an estimate of what unlinking frees; confirm with the volume
+                total, used = _disk_usage()
+                need = used - target
+                if need <= 0:
+                    break
+            row = await asyncio.to_thread(catalog.refresh, row["path"])
+            if row is None or row["pinned"] or row["added_at"] >= grace or row["path"] in active_paths():
+                continue
+            name, age, size_b = row["path"], _age_days(row["mtime"]), int(row["size"])
             try:
-                size_b = p.stat().st_size
+                os.unlink(catalog.abspath(name))
+                catalog.remove(name)
             except Exception:
-                pass
+                logging.exception("housekeeping: failed to evict %s", name)
+                continue
+            append_event(
+                "retention_deleted",
+                filename=name,
+                size_bytes=size_b,
+                age_days=int(age),
+                reason="watermark",
+                policy=EVICT_POLICY,
+            )
+            evicted.append((name, age, size_b))
+            need -= size_b
 
-            try:
-                p.unlink()
-                # clean warn flag if present
-                try:
-                    wf = _warn_flag(p)
-                    if wf.exists():
-                        wf.unlink(missing_ok=True)
-                except Exception:
-                    logging.exception("housekeeping: failed to remove warn flag for %s", p)
-
-                # metrics + notify
-                append_event(
-                    "retention_deleted",
-                    filename=p.name,
-                    size_bytes=int(size_b),
-                    age_days=int(age),
-                )
-                await notify(retention_deleted(p.name, age))
-                logging.info("housekeeping: deleted: %s (age=%d, size=%d)", p.name, age, size_b)
-            except Exception:
-                logging.exception("housekeeping: failed to delete %s", p)
+        after = _percent(*_disk_usage())
+        if after >= EVICT_LOW_WATERMARK:
+            logging.error("housekeeping: eviction stopped at %.1f%% — nothing left to evict (pinned or foreign data)", after)
+        try:
+            await _send_digest("evicted", evicted, fill=(before, after))
+        except Exception:
+            logging.exception("housekeeping: eviction digest failed")
+
+
+async def _weekly_report():
+    await send_weekly_report()
+    logging.info("housekeeping: weekly report sent")
+
+
+async def _nightly():
+    try:
+        # With the watcher up the catalog is already current; the walk is only the fallback
+        if not fswatch.running():
+            await reconcile_catalog()
+    except Exception:
+        logging.exception("housekeeping: catalog walk failed")
+    await do_retention()
+    await enforce_watermarks()
+    try:
+        await compact_event_logs()
+    except Exception:
+        logging.exception("housekeeping: event log compaction failed")
 
 
 async def run_schedules():
     """
-    Simple scheduler loop:
+    Register the housekeeping jobs and run the scheduler:
       - Weekly report: on configured weekday & hour (admin dashboard)
-      - Retention pass: daily at ~03:00
+      - Retention pass: daily at 03:00 (after a catalog walk of every subfolder),
+        followed by compaction of closed weekly event logs
+    Missed runs (bot down at the time) are caught up on startup.
     """
-    while True:
-        try:
-            now = datetime.now()
-            # Weekly analytics report at configured weekday/hour (once at minute :00)
-            if (
-                now.weekday() == DAY_INDEX.get(DISK_USAGE_DAY, 0)
-                and now.hour == DISK_USAGE_HOUR
-                and now.minute == 0
-            ):
-                try:
-                    await send_weekly_report()
-                    logging.info("housekeeping: weekly report sent")
-                except Exception:
-                    logging.exception("housekeeping: weekly report failed")
-                await asyncio.sleep(61)  # prevent double-fire within the same minute
-
-            # Daily retention at ~03:00
-            if now.hour == 3 and now.minute == 0:
-                await do_retention()
-                await asyncio.sleep(61)
-
-        except asyncio.CancelledError:
-            break
-        except Exception:
-            logging.exception("housekeeping tick failed")
-
-        await asyncio.sleep(30)
+    add_job("weekly_report", SCHEDULE_WEEKLY_REPORT, _weekly_report)
+    add_job("retention", SCHEDULE_RETENTION, _nightly)
+    await run_scheduler()
@@ -1,7 +1,7 @@
 # messages.py
 from textwrap import dedent
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 from .util import humanReadableSize
 
 def _md(s: str) -> str:
@@ -129,6 +129,65 @@ def retention_warning(filename: str, age_days: int, delete_in_days: int) -> str:
 def retention_deleted(filename: str, age_days: int) -> str:
     return f"🧹 Видалено `{_md(filename)}` (вік: {age_days} дн.)."
 
+# --- Адмін: дайджести ретенції (один на прогін на категорію) ---
+_DIGEST_TITLES = {
+    "warn": "Наближається видалення",
+    "deleted": "Видалено за ретенцією",
+    "evicted": "Звільнено місце на диску",
+}
+
+def retention_digest(
+    kind: str, count: int, total_bytes: int, top: List[Tuple[str, int, int]],
+    notice_days: int = 0, fill: Optional[Tuple[float, float]] = None,
+) -> str:
+    """
+    kind: "warn" | "deleted" | "evicted"; top: (filename, age_days, size_bytes), largest first;
+    fill: disk usage % before/after an eviction pass.
+    """
+    title = _DIGEST_TITLES.get(kind, kind)
+    if kind == "warn":
+        head = f"⚠️ **{title}** — {count} файл(и), {humanReadableSize(total_bytes)}; буде видалено протягом {notice_days} дн."
+    elif kind == "evicted":
+        head = f"🚨 **{title}** — {count} файл(и), {humanReadableSize(total_bytes)}"
+        if fill:
+            head += f"; заповнення {fill[0]:.0f}% → {fill[1]:.0f}%"
+    else:
+        head = f"🧹 **{title}** — {count} файл(и), {humanReadableSize(total_bytes)}"
+    lines = [head, "", f"**Найбільші ({len(top)})**" if count > len(top) else "**Файли**"]
+    for fn, age, size in top:
+        lines.append(retention_digest_line(fn, age, size))
+    return "\n".join(lines)
+
+def retention_digest_line(filename: str, age_days: int, size_bytes: int) -> str:
+    return f"• `{_md(filename)}` — {humanReadableSize(size_bytes)}, {age_days} дн."
+
+def retention_digest_page(kind: str, lines: List[str], page: int, pages: int) -> str:
+    return f"📄 **{_DIGEST_TITLES.get(kind, kind)}** — повний список ({page}/{pages})\n\n" + "\n".join(lines)
+
+def retention_digest_document(kind: str, count: int) -> str:
+    return f"📎 {_DIGEST_TITLES.get(kind, kind)}: повний список ({count} файл(и))"
+
+# --- Закріплення файлів (захист від видалення) ---
+def pin_not_found(name: str) -> str:
+    return f"Файл `{_md(name)}` не знайдено в каталозі."
+
+def pin_ambiguous(name: str, paths: List[str]) -> str:
+    listed = "\n".join(f"• `{_md(p)}`" for p in paths[:10])
+    return f"Під назвою `{_md(name)}` кілька файлів — вкажіть шлях:\n{listed}"
+
+def pin_ok(path: str, pinned: bool) -> str:
+    if pinned:
+        return f"📌 Файл `{_md(path)}` закріплено: він не видалятиметься ні за віком, ні при нестачі місця."
+    return f"Файл `{_md(path)}` відкріплено."
+
+def pin_admins_only() -> str:
+    return "⛔ Закріплювати та відкріплювати файли можуть лише адміністратори."
+
+def pin_list(paths: List[str]) -> str:
+    if not paths:
+        return "📌 Закріплених файлів немає."
+    return "📌 **Закріплені файли**\n" + "\n".join(f"• `{_md(p)}`" for p in paths)
+
 # --- Користувачеві: успіх ---
 def download_success_user(filename: str, size_h: str, time_h: str, speed_h: str) -> str:
     return (
@@ -172,6 +231,15 @@ def admin_download_infected(filename: str, signature: str) -> str:
 def admin_scan_error(filename: str) -> str:
     return f"⚠️ Помилка перевірки антивірусом для `{_md(filename)}`; файл залишено."
 
+# --- Адмін: повторна перевірка після оновлення баз виявила загрозу ---
+def admin_rescan_infected(filename: str, signature: str, db_version: int, quarantined: bool) -> str:
+    status = "файл переміщено до карантину" if quarantined else "не вдалося перемістити файл до карантину"
+    return (
+        f"🚨 Повторна перевірка (база ClamAV {db_version}) виявила загрозу у файлі `{_md(filename)}`\n"
+        f"- Сигнатура: `{_md(signature)}`\n"
+        f"- Статус: {status}"
+    )
+
 # --- Адмін: збій завантаження ---
 def admin_download_crashed(filename: str) -> str:
     return f"❌ Збій під час завантаження `{_md(filename)}`."
@@ -220,7 +288,11 @@ def help_text() -> str:
         "• /leave — повернутися до кореневої папки\n"
         "• /get — показати поточну папку\n"
         "• /add `<посилання>` `[нова_назва]` — завантажити файл за посиланням на повідомлення\n"
-        "• /weekly — надіслати щотижневий звіт в адмін-канал"
+        "• /weekly — надіслати щотижневий звіт в адмін-канал\n"
+        "• /perf `[днів]` — затримки етапів завантаження (p50/p95)\n"
+        "• /stats `<від>` `<до>` `[user|ext]` — статистика за довільний період\n"
+        "• /export `<період>` `[csv|jsonl]` — стиснений експорт подій до адмін-каналу\n"
+        "• /pin `<файл>` / /unpin `<файл>` — захистити файл від видалення (без аргументу — список)"
     )
 
 def usage_text(total_h: str, used_h: str, free_h: str) -> str:
@@ -239,6 +311,9 @@ def use_path_warning(safe_path: str, original: str) -> str:
     orig = _md(original)
     return f"⚠️ Увага: шлях нормалізовано до `{safe}` (замість `{orig}`)."
 
+def use_bad_path(original: str) -> str:
+    return f"⛔ Шлях `{_md(original)}` не підходить: потрібна підпапка всередині сховища, без `..` і без `/` на початку."
+
 def use_ok() -> str:
     return "✅ Гаразд, наступні файли зберігатиму в цій папці."
 
@@ -269,6 +344,135 @@ def weekly_report_done() -> str:
 def weekly_report_failed() -> str:
     return "❌ Не вдалося сформувати щотижневий звіт."
 
+_STAGE_LABELS = {
+    "queued": "Черга",
+    "first_byte": "До першого байта",
+    "transfer": "Передача",
+    "scan": "Перевірка AV",
+    "notify": "Сповіщення",
+    "total": "Загалом",
+}
+
+def _stage_label(stage: str) -> str:
+    return _STAGE_LABELS.get(stage, stage)
+
+def _secs(v: float) -> str:
+    return f"{v:.1f}с" if v < 10 else f"{v:.0f}с"
+
+def perf_text(days: int, stages: List[Tuple[str, int, float, float]]) -> str:
+    """stages: (stage, jobs, p50 s, p95 s) in pipeline order."""
+    if not stages:
+        return f"⏱ **Етапи завантаження** — останні {days} дн.\n\nДаних поки немає."
+    lines = [f"⏱ **Етапи завантаження** — останні {days} дн.", ""]
+    for stage, jobs, p50, p95 in stages:
+        lines.append(f"• {_stage_label(stage)}: p50 {_secs(p50)} • p95 {_secs(p95)} ({jobs})")
+    return "\n".join(lines)
+
+_JOB_STAGES = {
+    "starting": "⏳ підготовка",
+    "downloading": "⬇️ завантаження",
+    "scanning": "🛡 перевірка AV",
+    "finishing": "✅ завершення",
+}
+
+def dashboard_text(
+    running: List[Tuple[str, str, str, str, float, str, str]],
+    queued: List[Tuple[str, str]],
+    throughput_h: str,
+    updated: str,
+    running_total: Optional[int] = None,
+    queued_total: Optional[int] = None,
+) -> str:
+    """
+    running: (filename, stage, got_h, total_h, pct, speed_h, time_h) where
+    time_h is the ETA while downloading and the time spent in any other stage;
+    queued: (filename, waiting_h). The totals count every job, including rows
+    that didn't fit the message (default: the rows given).
+    """
+    running_total = len(running) if running_total is None else running_total
+    queued_total = len(queued) if queued_total is None else queued_total
+    hidden = (running_total - len(running)) + (queued_total - len(queued))
+    lines = [f"📊 **Активні завантаження** — оновлено {updated}", ""]
+    if not running_total and not queued_total:
+        lines.append("Зараз нічого не завантажується.")
+        return "\n".join(lines)
+    lines.append(f"Виконується: {running_total} • У черзі: {queued_total} • Швидкість: {throughput_h}/с")
+    for filename, stage, got_h, total_h, pct, speed_h, time_h in running:
+        lines.append("")
+        lines.append(f"`{_md(filename)}`")
+        if stage == "downloading":
+            lines.append(f"{_JOB_STAGES[stage]} {got_h}/{total_h} ({pct:0.1f}%) • ~{speed_h}/с • лишилося {time_h}")
+        else:
+            lines.append(f"{_JOB_STAGES.get(stage, stage)} • {got_h} • вже {time_h}")
+    if queued:
+        lines.append("")
+        lines.append("**Черга:**")
+        for filename, waiting_h in queued:
+            lines.append(f"• `{_md(filename)}` — чекає {waiting_h}")
+    if hidden:
+        lines.append(f"… і ще {hidden}")
+    return "\n".join(lines)
+
+def perf_bad_days() -> str:
+    return "Вкажіть кількість днів числом. Приклад: `/perf 30`"
+
+def stats_usage() -> str:
+    return (
+        "Вкажіть період: `/stats <від> <до> [user|ext]`\n"
+        "Дати у форматі РРРР-ММ-ДД. Приклад: `/stats 2025-01-01 2025-03-31 user`"
+    )
+
+def stats_text(payload: Dict[str, Any]) -> str:
+    """payload from metrics.range_stats()."""
+    t = payload.get("totals") or {}
+    lines = [f"📈 **Статистика** — {payload['from']} … {payload['to']}", ""]
+    if not t:
+        lines.append("Подій за цей період немає.")
+        return "\n".join(lines)
+    lines.append(f"• Розпочато: {t.get('started', 0)} • Завершено: {t.get('finished', 0)}")
+    lines.append(
+        "• Результати: "
+        f"чистих {t.get('clean', 0)} • "
+        f"загроз {t.get('infected', 0)} • "
+        f"скасовано {t.get('cancelled', 0)} • "
+        f"збоїв {t.get('errors', 0)}"
+    )
+    lines.append(f"• Нових даних: {humanReadableSize(t.get('clean_bytes', 0))}")
+    if t.get("deleted"):
+        lines.append(f"• Видалено: {t['deleted']} файл(и) ({humanReadableSize(t.get('deleted_bytes', 0))})")
+    if t.get("clean"):
+        d = payload.get("duration") or {}
+        sp = payload.get("speed") or {}
+        lines.append(f"• Тривалість p50/p90: {_secs(d.get(0.5, 0.0))} / {_secs(d.get(0.9, 0.0))}")
+        lines.append(f"• Швидкість p50: {sp.get(0.5, 0.0):.1f} МБ/с")
+
+    rows = payload.get("rows") or []
+    if rows:
+        lines.append("")
+        lines.append("**Клієнти**" if payload.get("by") == "user" else "**Типи файлів**")
+        for r in rows:
+            key = (r["key"] or "").replace("`", "ʼ")
+            lines.append(f"• {key}: {r['clean']} • {humanReadableSize(r['clean_bytes'])} (усього {r['finished']})")
+    return "\n".join(lines)
+
+def export_usage() -> str:
+    return (
+        "Вкажіть період: `/export <період> [csv|jsonl]`\n"
+        "Період: `30d`, `2025-W05`, `2025-03`, `2025-03-01` або `2025-03-01..2025-03-31`"
+    )
+
+def export_started(label: str, fmt: str) -> str:
+    return f"⏳ Готую експорт `{_md(label)}` ({fmt}.gz) — файл надійде до адмін-каналу."
+
+def export_caption(label: str, fmt: str, count: int) -> str:
+    return f"📦 Експорт подій `{_md(label)}` — {count} запис(ів), {fmt}.gz"
+
+def export_done(count: int) -> str:
+    return f"✅ Експорт готовий: {count} запис(ів) надіслано до адмін-каналу."
+
+def export_failed() -> str:
+    return "⚠️ Не вдалося створити або надіслати експорт. Перевірте журнали."
+
 def weekly_report_text(payload: Dict[str, Any]) -> str:
     """
     Format a weekly report using precomputed payload from metrics.py.
@@ -285,6 +489,8 @@ def weekly_report_text(payload: Dict[str, Any]) -> str:
       retention_notice_days:int, soon:int,
       deleted_files_count:int, deleted_bytes:int,
       oldest: Optional[int],
+      duration_p50/p90/p99: float (s), speed_p50/p90: float (MB/s),
+      stages: List[Tuple[str,float,float]] (stage, p50 s, p95 s),
     """
     y = payload["iso_year"]
     w = payload["iso_week"]
@@ -346,6 +552,18 @@ def weekly_report_text(payload: Dict[str, Any]) -> str:
         lines.append(f"• Без опису: {missing_desc_count}")
     lines.append("")
 
+    # Performance (clean uploads)
+    if clean_count:
+        lines.append("**Продуктивність**")
+        lines.append(
+            "• Тривалість p50/p90/p99: "
+            f"{payload.get('duration_p50', 0.0):.0f}с / {payload.get('duration_p90', 0.0):.0f}с / {payload.get('duration_p99', 0.0):.0f}с"
+        )
+        lines.append(f"• Швидкість p50/p90: {payload.get('speed_p50', 0.0):.1f} / {payload.get('speed_p90', 0.0):.1f} МБ/с")
+        for stage, p50, p95 in payload.get("stages") or []:
+            lines.append(f"• {_stage_label(stage)} p50/p95: {_secs(p50)} / {_secs(p95)}")
+        lines.append("")
+
     # Clients
     lines.append("**Клієнти**")
     if top_by_bytes:
@@ -1,17 +1,19 @@
 # bot/metrics.py
-import os, json, logging
-from dataclasses import dataclass
+import os, re, csv, gzip, json, shutil, asyncio, logging, threading
+from dataclasses import dataclass, fields
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, Iterable, List, Optional, Tuple
+from typing import Dict, List, Optional, Set, Tuple
 from collections import defaultdict, Counter
 from typing import Tuple, Optional
 
 from pyrogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
-from . import CONFIG_FOLDER, folder
+from . import BASE_FOLDER, CONFIG_FOLDER, catalog, eventstore
+from .eventstore import client_key as _client_key, ext_of as _ext_of
 from .sysinfo import diskUsage
 from .util import humanReadableSize
+from .sketch import LogHistogram, SpaceSaving, TopK
 from .notifier import notify
 from .messages import weekly_report_text
 
@@ -20,10 +22,20 @@ from .messages import weekly_report_text
 
 METRICS_DIR = Path(CONFIG_FOLDER) / "metrics"
 CLIENTS_FILE = METRICS_DIR / "clients_seen.json"   # { user_id(str): first_ts(int) }
-EXPORTS_DIR = METRICS_DIR / "exports"
+CLIENTS_LOG = METRICS_DIR / "clients_seen.log"     # "<user_id> <first_ts>" lines appended since the last snapshot
+EXPORTS_DIR = METRICS_DIR / "exports"            # gzip-compressed /export output
+EXPORT_FORMATS = ("jsonl", "csv")
 
 RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "30") or "30")
 RETENTION_NOTICE_DAYS = int(os.getenv("RETENTION_NOTICE_DAYS", "2") or "2")
+CLIENTS_COMPACT_EVERY = int(os.getenv("CLIENTS_COMPACT_EVERY", "500") or "500")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "2") or "2")   # seconds; upper bound on events lost in a crash
+METRICS_FLUSH_BATCH = int(os.getenv("METRICS_FLUSH_BATCH", "200") or "200")      # flush early once this many events are pending
+TOPK_CAPACITY = int(os.getenv("METRICS_TOPK_CAPACITY", "1000") or "1000")        # clients/extensions tracked per rollup (exact below this)
+METRICS_COMPACT_SUMMARIES = os.getenv("METRICS_COMPACT_SUMMARIES", "1") != "0"    # persist a week summary when compacting its log
+
+# Download pipeline stages, in order, as recorded by job_spans events (see download.manager)
+STAGES = ("queued", "first_byte", "transfer", "scan", "notify", "total")
 
 # ========= Utilities =========
 
@@ -42,26 +54,6 @@ def _events_file_for_ts(ts: int) -> Path:
     y, w = _week_key_from_ts(ts)
     return METRICS_DIR / f"events-{y}-W{w:02d}.jsonl"
 
-def _safe_load_jsonl(path: Path) -> Iterable[dict]:
-    if not path.exists():
-        return []
-    out: List[dict] = []
-    with path.open("r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                out.append(json.loads(line))
-            except Exception:
-                continue
-    return out
-
-def _append_jsonl(path: Path, obj: dict):
-    _mkdirp(path.parent)
-    with path.open("a", encoding="utf-8") as f:
-        f.write(json.dumps(obj, ensure_ascii=False) + "\n")
-
 def _load_clients_seen() -> Dict[str, int]:
     try:
         if CLIENTS_FILE.exists():
@@ -79,30 +71,199 @@ def _save_clients_seen(data: Dict[str, int]):
     except Exception:
         logging.exception("metrics: failed to write clients_seen.json")
 
+# ========= First-seen client index =========
+# In-memory { user_id(str): first_ts(int) }, loaded once from the
+# clients_seen.json snapshot plus the append-only clients_seen.log.
+# New clients only cost one short append; the log is folded back into the
+# snapshot every CLIENTS_COMPACT_EVERY entries and on startup.
+
+_clients_seen: Optional[Dict[str, int]] = None
+_clients_log_lines = 0
+
+def load_clients_index() -> Dict[str, int]:
+    global _clients_seen, _clients_log_lines
+    seen = _load_clients_seen()
+    replayed = 0
+    try:
+        if CLIENTS_LOG.exists():
+            with CLIENTS_LOG.open("r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) != 2:
+                        continue
+                    try:
+                        seen.setdefault(parts[0], int(parts[1]))
+                        replayed += 1
+                    except ValueError:
+                        continue
+    except Exception:
+        logging.exception("metrics: failed to replay clients_seen.log")
+    _clients_seen = seen
+    _clients_log_lines = replayed
+    if replayed:
+        _compact_clients()
+    return seen
+
+def _clients_index() -> Dict[str, int]:
+    if _clients_seen is None:
+        return load_clients_index()
+    return _clients_seen
+
+def _compact_clients():
+    global _clients_log_lines
+    _save_clients_seen(_clients_index())
+    try:
+        # Snapshot is durable now; entries still in the log would replay as no-ops anyway
+        CLIENTS_LOG.unlink(missing_ok=True)
+        _clients_log_lines = 0
+    except Exception:
+        logging.exception("metrics: failed to truncate clients_seen.log")
+
+def first_seen(user_id) -> Optional[int]:
+    if user_id is None:
+        return None
+    return _clients_index().get(str(user_id))
+
+def _note_client(user_id, ts: int):
+    global _clients_log_lines
+    seen = _clients_index()
+    key = str(user_id)
+    if key in seen:
+        return
+    seen[key] = ts
+    try:
+        _mkdirp(CLIENTS_LOG.parent)
+        with CLIENTS_LOG.open("a", encoding="utf-8") as f:
+            f.write(f"{key} {ts}\n")
+        _clients_log_lines += 1
+    except Exception:
+        logging.exception("metrics: failed to append clients_seen.log")
+    if _clients_log_lines >= CLIENTS_COMPACT_EVERY:
+        _compact_clients()
+
+# ========= Buffered event writer =========
+# append_event() only queues the record; run_event_writer() drains the queue
+# in batches (every METRICS_FLUSH_INTERVAL seconds or METRICS_FLUSH_BATCH
+# events) on a worker thread, keeping the current week's file open and
+# mirroring each batch into the indexed store (bot.eventstore).
+# Until the writer task is running, events are written through synchronously.
+
+_pending: List[dict] = []
+_wake = asyncio.Event()
+_writer_running = False
+_flush_lock = asyncio.Lock()
+_io_lock = threading.Lock()        # guards the file handle across worker threads
+_fh = None
+_fh_path: Optional[Path] = None
+
+_resync: Set[Path] = set()             # logs whose store mirror fell behind the file (failed write or insert)
+
+def _write_batch(batch: List[dict]):
+    global _fh, _fh_path
+    with _io_lock:
+        written: Dict[str, int] = {}
+        touched = set()
+        try:
+            for rec in batch:
+                path = _events_file_for_ts(rec["ts"])
+                touched.add(path)
+                if path != _fh_path:
+                    # Week rollover (or a late event for another week)
+                    _close_fh()
+                    _mkdirp(path.parent)
+                    _fh = path.open("a", encoding="utf-8")
+                    _fh_path = path
+                _fh.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                written[path.name] = written.get(path.name, 0) + 1
+            if _fh is not None:
+                _fh.flush()
+                os.fsync(_fh.fileno())
+            if _resync:
+                # An earlier batch reached the file but not the store: catch up from the logs
+                eventstore.import_jsonl(sorted(_resync | touched))
+                _resync.clear()
+            else:
+                # The store's position in each log moves in the same transaction as the insert
+                eventstore.insert(batch, written)
+        except Exception:
+            _resync.update(touched)
+            _close_fh()
+            raise
+
+def _close_fh():
+    global _fh, _fh_path
+    if _fh is not None:
+        try:
+            _fh.close()
+        except Exception:
+            logging.exception("metrics: failed to close %s", _fh_path)
+    _fh, _fh_path = None, None
+
+async def flush_events():
+    """Write out everything queued so far (readers call this before rolling up)."""
+    global _pending
+    async with _flush_lock:
+        batch, _pending = _pending, []
+        if not batch:
+            return
+        try:
+            await asyncio.to_thread(_write_batch, batch)
+        except Exception:
+            logging.exception("metrics: failed to write %d event(s)", len(batch))
+
+async def run_event_writer():
+    global _writer_running
+    _writer_running = True
+    try:
+        while True:
+            try:
+                await asyncio.wait_for(_wake.wait(), timeout=METRICS_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            _wake.clear()
+            await flush_events()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        _writer_running = False
+
+async def close_event_writer():
+    """Final flush on shutdown; called from __main__ after the writer task is cancelled."""
+    await flush_events()
+    with _io_lock:
+        _close_fh()
+
 # ========= Public API: event appenders =========
 
 def append_event(kind: str, **kwargs):
     """
-    Append a single metrics event to the current ISO week JSONL file.
+    Queue a single metrics event for the current ISO week JSONL file.
     DB-free, append-only.
     """
+    global _pending
     ts = int(kwargs.pop("ts", _now_ts()))
     rec = {"ts": ts, "kind": kind}
     rec.update(kwargs)
-    try:
-        _append_jsonl(_events_file_for_ts(ts), rec)
-    except Exception:
-        logging.exception("metrics: append_event failed (%s)", kind)
+    _pending.append(rec)
+    if not _writer_running:
+        batch, _pending = _pending, []
+        try:
+            _write_batch(batch)
+        except Exception:
+            logging.exception("metrics: append_event failed (%s)", kind)
+    elif len(_pending) >= METRICS_FLUSH_BATCH:
+        _wake.set()
 
     # Track first-seen time for clients (for "new client this week")
     if kind == "upload_started":
         uid = kwargs.get("user_id")
         if uid is not None:
-            seen = _load_clients_seen()
-            key = str(uid)
-            if key not in seen:
-                seen[key] = ts
-                _save_clients_seen(seen)
+            _note_client(uid, ts)
+
+    try:
+        _track_event(rec)
+    except Exception:
+        logging.exception("metrics: rollup update failed (%s)", kind)
 
 # ========= Aggregation / rollup =========
 
@@ -120,133 +281,408 @@ class WeekRollup:
     scan_error_count: int = 0
     total_clean_bytes: int = 0
     # performance
-    durations: List[float] = None
-    speeds: List[float] = None
+    durations: LogHistogram = None      # quantile sketch, seconds
+    speeds: LogHistogram = None         # quantile sketch, MB/s
     # clients
-    per_client_bytes: Dict[str, int] = None
-    per_client_count: Dict[str, int] = None
-    new_clients: List[str] = None
+    per_client_bytes: SpaceSaving = None    # heavy hitters by bytes
+    per_client_count: SpaceSaving = None    # heavy hitters by uploads
+    new_clients: Set[str] = None     # serialized as a sorted list
     missing_desc_count: int = 0
     # timing buckets
     started_by_hour: Counter = None
     # file mix
-    by_ext_bytes: Dict[str, int] = None
-    by_ext_count: Dict[str, int] = None
+    by_ext_bytes: SpaceSaving = None
+    by_ext_count: SpaceSaving = None
     size_buckets: Dict[str, int] = None
-    largest_files: List[Tuple[str, int, str]] = None  # (filename, size, client)
+    largest_files: TopK = None  # size -> (filename, client)
     # retention/deletions (this week)
     deleted_files_count: int = 0
     deleted_bytes: int = 0
 
-def _client_key(username: Optional[str], user_id: Optional[int]) -> str:
-    if username:
-        return f"@{username}"
-    return f"id:{user_id}" if user_id is not None else "unknown"
-
-def _ext_of(name: str) -> str:
-    _, ext = os.path.splitext(name or "")
-    return (ext[1:].lower() if ext else "noext")
-
 def _size_bucket(sz: int) -> str:
     if sz < 10 * 1024 * 1024: return "<10MB"
     if sz < 100 * 1024 * 1024: return "10–100MB"
     if sz < 1024 * 1024 * 1024: return "100MB–1GB"
     return ">1GB"
 
-def _percentile(vals: List[float], p: float) -> float:
-    if not vals:
-        return 0.0
-    a = sorted(vals)
-    k = int(round((len(a) - 1) * p))
-    return a[k]
+def percentiles(name: str, start_ts: int, end_ts: int, qs=(0.5, 0.9, 0.99)) -> Dict[float, float]:
+    """
+    Quantiles of a sketched upload_finished field ("duration_sec" or "speed_mb_s")
+    over any range, merged from the persisted per-day sketches (day granularity).
+    """
+    h = eventstore.merged_sketch(name, start_ts, end_ts)
+    return {q: h.quantile(q) for q in qs}
 
-def _iter_week_files() -> List[Path]:
-    if not METRICS_DIR.exists():
-        return []
-    return sorted(METRICS_DIR.glob("events-*-W*.jsonl"))
+def stage_percentiles(start_ts: int, end_ts: int, qs=(0.5, 0.95)) -> List[Tuple[str, int, Dict[float, float]]]:
+    """
+    (stage, jobs, {q: seconds}) for every pipeline stage with samples in the
+    range, from the per-day stage sketches fed by job_spans events.
+    """
+    out = []
+    for stage in STAGES:
+        h = eventstore.merged_sketch(f"stage_{stage}", start_ts, end_ts)
+        if h.count:
+            out.append((stage, h.count, {q: h.quantile(q) for q in qs}))
+    return out
 
-def _prev_weeks_keys(curr: Tuple[int, int], max_weeks: int = 4) -> List[Tuple[int, int]]:
-    files = _iter_week_files()
-    keys = []
-    for p in files:
-        try:
-            name = p.stem  # events-YYYY-Www
-            _, y, W = name.split("-")
-            y = int(y)
-            w = int(W[1:])
-            keys.append((y, w))
-        except Exception:
-            continue
-    keys = sorted(set(keys))
-    y0, w0 = curr
-    keys = [k for k in keys if k <= (y0, w0)]
-    return keys[-max_weeks:]
+def range_stats(first_day: str, last_day: str, by: Optional[str] = None, top: int = 10) -> dict:
+    """
+    Totals for the local dates first_day..last_day (YYYY-MM-DD, inclusive) read
+    from the daily aggregates, plus the top `top` clients ("user") or
+    extensions ("ext") when `by` is given. Cost grows with days, not events.
+    """
+    start = int(datetime.strptime(first_day, "%Y-%m-%d").timestamp())
+    end = int((datetime.strptime(last_day, "%Y-%m-%d") + timedelta(days=1)).timestamp())
+    totals = eventstore.day_stats(first_day, last_day)
+    return {
+        "from": first_day,
+        "to": last_day,
+        "totals": totals[0] if totals else {},
+        "by": by,
+        "rows": eventstore.day_stats(first_day, last_day, by, top) if by else [],
+        "duration": percentiles("duration_sec", start, end, (0.5, 0.9)),
+        "speed": percentiles("speed_mb_s", start, end, (0.5,)),
+    }
 
-def _load_week(iso_year: int, iso_week: int) -> List[dict]:
-    path = METRICS_DIR / f"events-{iso_year}-W{iso_week:02d}.jsonl"
-    return list(_safe_load_jsonl(path))
+# ---- exports ----
 
-def rollup_week(iso_year: int, iso_week: int) -> WeekRollup:
-    events = _load_week(iso_year, iso_week)
-    roll = WeekRollup(
+_EXPORT_COLUMNS = (
+    "ts", "time", "kind", "user_id", "username", "chat", "filename", "result",
+    "size_bytes", "duration_sec", "speed_mb_s", "has_desc", "media", "extra",
+)
+
+def parse_range(text: str) -> Tuple[int, int, str]:
+    """
+    Parse an export range into (start_ts, end_ts, label). Accepted forms:
+    "30d" (last 30 days), "2025-W05", "2025-03", "2025-03-01" and
+    "2025-03-01..2025-03-31" (inclusive). Raises ValueError otherwise.
+    """
+    text = (text or "").strip()
+    if text.endswith("d") and text[:-1].isdigit():
+        end = _now_ts() + 1
+        return end - int(text[:-1]) * 86400, end, f"last{int(text[:-1])}d"
+    if "-W" in text:
+        y, w = text.split("-W")
+        start, end = _week_bounds(int(y), int(w))
+        return start, end, f"{int(y)}-W{int(w):02d}"
+    if ".." in text:
+        a, b = text.split("..", 1)
+        first, last = datetime.strptime(a, "%Y-%m-%d"), datetime.strptime(b, "%Y-%m-%d")
+        if first > last:
+            raise ValueError("empty range")
+        return int(first.timestamp()), int((last + timedelta(days=1)).timestamp()), f"{a}_{b}"
+    if len(text) == 7:
+        first = datetime.strptime(text, "%Y-%m")
+        nxt = (first + timedelta(days=32)).replace(day=1)
+        return int(first.timestamp()), int(nxt.timestamp()), text
+    day = datetime.strptime(text, "%Y-%m-%d")
+    return int(day.timestamp()), int((day + timedelta(days=1)).timestamp()), text
+
+def _export_rows(events):
+    for ev in events:
+        row = {k: ev.pop(k, None) for k in _EXPORT_COLUMNS if k not in ("time", "extra")}
+        row["time"] = datetime.fromtimestamp(int(row["ts"] or 0)).isoformat(sep=" ")
+        row["extra"] = json.dumps(ev, ensure_ascii=False) if ev else ""
+        yield row
+
+def export_events(start_ts: int, end_ts: int, fmt: str, label: str) -> Tuple[Path, int]:
+    """
+    Stream events in [start_ts, end_ts) from the store into a gzip-compressed
+    EXPORTS_DIR/events-<label>.<fmt>.gz. Rows go straight from the batched
+    cursor to the compressor, so memory stays flat for any range. Blocking;
+    run it in a worker thread. Returns (path, events written).
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"unknown export format {fmt!r}")
+    _mkdirp(EXPORTS_DIR)
+    path = EXPORTS_DIR / f"events-{label}.{fmt}.gz"
+    tmp = path.with_suffix(".gz.tmp")
+    n = 0
+    with gzip.open(tmp, "wt", encoding="utf-8", newline="") as f:
+        events = eventstore.query(start_ts, end_ts)
+        if fmt == "csv":
+            w = csv.DictWriter(f, fieldnames=_EXPORT_COLUMNS)
+            w.writeheader()
+            for row in _export_rows(events):
+                w.writerow(row)
+                n += 1
+        else:
+            for ev in events:
+                f.write(json.dumps(ev, ensure_ascii=False) + "\n")
+                n += 1
+    os.replace(tmp, path)
+    logging.info("metrics: exported %d event(s) to %s", n, path)
+    return path, n
+
+def _week_bounds(iso_year: int, iso_week: int) -> Tuple[int, int]:
+    # Local midnights, so a week with a DST change is 167 or 169 hours long, like its log file
+    monday = datetime.fromisocalendar(iso_year, iso_week, 1)
+    return int(monday.timestamp()), int((monday + timedelta(days=7)).timestamp())
+
+def _summary_file(iso_year: int, iso_week: int) -> Path:
+    return METRICS_DIR / f"summary-{iso_year}-W{iso_week:02d}.json"
+
+def _prev_weeks_keys(curr: Tuple[int, int], max_weeks: int = 4) -> List[Tuple[int, int]]:
+    """
+    The last `max_weeks` ISO weeks up to and including `curr` that have data,
+    found through the summaries and the store's ts index.
+    """
+    keys = []
+    ref = datetime.fromisocalendar(curr[0], curr[1], 1)
+    for i in range(max_weeks):
+        y, w, _ = (ref - timedelta(days=7 * i)).isocalendar()
+        if (y, w) == _live_key() or _summary_file(y, w).exists() or eventstore.has_events(*_week_bounds(y, w)):
+            keys.append((int(y), int(w)))
+    return sorted(keys)
+
+def _new_rollup(iso_year: int, iso_week: int) -> WeekRollup:
+    return WeekRollup(
         iso_year=iso_year, iso_week=iso_week,
-        durations=[], speeds=[],
-        per_client_bytes=defaultdict(int),
-        per_client_count=defaultdict(int),
-        new_clients=[],
+        durations=LogHistogram(), speeds=LogHistogram(),
+        per_client_bytes=SpaceSaving(TOPK_CAPACITY),
+        per_client_count=SpaceSaving(TOPK_CAPACITY),
+        new_clients=set(),
         started_by_hour=Counter(),
-        by_ext_bytes=defaultdict(int),
-        by_ext_count=defaultdict(int),
+        by_ext_bytes=SpaceSaving(TOPK_CAPACITY),
+        by_ext_count=SpaceSaving(TOPK_CAPACITY),
         size_buckets=defaultdict(int),
-        largest_files=[],
+        largest_files=TopK(5),
     )
 
-    for ev in events:
-        k = ev.get("kind")
-        if k == "upload_started":
-            roll.uploads_started += 1
-            if not ev.get("has_desc", False):
-                roll.missing_desc_count += 1
-            ts = int(ev.get("ts", 0))
-            hour = datetime.fromtimestamp(ts).hour
-            roll.started_by_hour[hour] += 1
-
-        elif k == "upload_finished":
-            roll.uploads_finished += 1
-            uid = ev.get("user_id")
-            uname = ev.get("username")
-            key = _client_key(uname, uid)
-
-            result = ev.get("result")
-            size_b = int(ev.get("size_bytes", 0) or 0)
-            if result == "clean":
-                roll.clean_count += 1
-                roll.total_clean_bytes += size_b
-                roll.per_client_bytes[key] += size_b
-                roll.per_client_count[key] += 1
-                roll.durations.append(float(ev.get("duration_sec", 0) or 0.0))
-                roll.speeds.append(float(ev.get("speed_mb_s", 0) or 0.0))
-                ext = _ext_of(ev.get("filename", ""))
-                roll.by_ext_bytes[ext] += size_b
-                roll.by_ext_count[ext] += 1
-                roll.size_buckets[_size_bucket(size_b)] += 1
-                roll.largest_files.append((ev.get("filename",""), size_b, key))
-            elif result == "infected":
-                roll.infected_count += 1
-            elif result == "cancelled":
-                roll.cancelled_count += 1
-            elif result == "scan_error":
-                roll.scan_error_count += 1
-            else:
-                roll.error_count += 1
+def _apply_event(roll: WeekRollup, ev: dict, bounds: Tuple[int, int]):
+    k = ev.get("kind")
+    if k == "upload_started":
+        roll.uploads_started += 1
+        if not ev.get("has_desc", False):
+            roll.missing_desc_count += 1
+        ts = int(ev.get("ts", 0))
+        hour = datetime.fromtimestamp(ts).hour
+        roll.started_by_hour[hour] += 1
+        fs = first_seen(ev.get("user_id"))
+        if fs is not None and bounds[0] <= fs < bounds[1]:
+            key = _client_key(ev.get("username"), ev.get("user_id"))
+            roll.new_clients.add(key)
+
+    elif k == "upload_finished":
+        roll.uploads_finished += 1
+        uid = ev.get("user_id")
+        uname = ev.get("username")
+        key = _client_key(uname, uid)
+
+        result = ev.get("result")
+        size_b = int(ev.get("size_bytes", 0) or 0)
+        if result == "clean":
+            roll.clean_count += 1
+            roll.total_clean_bytes += size_b
+            roll.per_client_bytes.add(key, size_b)
+            roll.per_client_count.add(key, 1)
+            roll.durations.add(float(ev.get("duration_sec", 0) or 0.0))
+            roll.speeds.add(float(ev.get("speed_mb_s", 0) or 0.0))
+            ext = _ext_of(ev.get("filename", ""))
+            roll.by_ext_bytes.add(ext, size_b)
+            roll.by_ext_count.add(ext, 1)
+            roll.size_buckets[_size_bucket(size_b)] += 1
+            roll.largest_files.add(size_b, (ev.get("filename",""), key))
+        elif result == "infected":
+            roll.infected_count += 1
+        elif result == "cancelled":
+            roll.cancelled_count += 1
+        elif result == "scan_error":
+            roll.scan_error_count += 1
+        else:
+            roll.error_count += 1
+
+    elif k == "retention_deleted":
+        roll.deleted_files_count += 1
+        roll.deleted_bytes += int(ev.get("size_bytes", 0) or 0)
+
+def rollup_range(start_ts: int, end_ts: int) -> WeekRollup:
+    """
+    Reduce events with start_ts <= ts < end_ts straight from the indexed store.
+    The result is labelled with the ISO week of start_ts.
+    """
+    y, w = _week_key_from_ts(start_ts)
+    roll = _new_rollup(y, w)
+    for ev in eventstore.query(start_ts, end_ts):
+        _apply_event(roll, ev, (start_ts, end_ts))
+    return roll
 
-        elif k == "retention_deleted":
-            roll.deleted_files_count += 1
-            roll.deleted_bytes += int(ev.get("size_bytes", 0) or 0)
+def _reduce_week(iso_year: int, iso_week: int) -> WeekRollup:
+    roll = rollup_range(*_week_bounds(iso_year, iso_week))
+    roll.iso_year, roll.iso_week = iso_year, iso_week
+    return roll
 
-    roll.largest_files = sorted(roll.largest_files, key=lambda x: x[1], reverse=True)[:5]
+# ---- closed-week summaries ----
+
+def _largest_files(roll: WeekRollup) -> List[Tuple[str, int, str]]:
+    """(filename, size, client), largest first."""
+    return [(fn, sz, who) for sz, (fn, who) in roll.largest_files.items()]
+
+def _rollup_to_dict(roll: WeekRollup) -> dict:
+    d = {f.name: getattr(roll, f.name) for f in fields(roll)}
+    for name in ("per_client_bytes", "per_client_count", "by_ext_bytes", "by_ext_count"):
+        d[name] = getattr(roll, name).to_dict()
+    d["new_clients"] = sorted(roll.new_clients or ())
+    d["size_buckets"] = dict(roll.size_buckets or {})
+    d["started_by_hour"] = {str(h): n for h, n in (roll.started_by_hour or {}).items()}
+    d["largest_files"] = [list(x) for x in _largest_files(roll)]
+    d["durations"] = roll.durations.to_dict()
+    d["speeds"] = roll.speeds.to_dict()
+    return d
+
+def _rollup_from_dict(d: dict) -> WeekRollup:
+    roll = _new_rollup(int(d["iso_year"]), int(d["iso_week"]))
+    for f in fields(roll):
+        v = d[f.name]
+        if f.name in ("per_client_bytes", "per_client_count", "by_ext_bytes", "by_ext_count"):
+            setattr(roll, f.name, SpaceSaving.from_dict(v))
+        elif f.name == "new_clients":
+            roll.new_clients = set(v)
+        elif f.name == "size_buckets":
+            roll.size_buckets.update(v)
+        elif f.name == "started_by_hour":
+            roll.started_by_hour.update({int(h): n for h, n in v.items()})
+        elif f.name == "largest_files":
+            for fn, sz, who in v:
+                roll.largest_files.add(sz, (fn, who))
+        elif f.name in ("durations", "speeds"):
+            setattr(roll, f.name, LogHistogram.from_dict(v))
+        else:
+            setattr(roll, f.name, v)
     return roll
 
+def _save_summary(roll: WeekRollup):
+    try:
+        path = _summary_file(roll.iso_year, roll.iso_week)
+        _mkdirp(path.parent)
+        tmp = path.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(_rollup_to_dict(roll), ensure_ascii=False), encoding="utf-8")
+        tmp.replace(path)
+    except Exception:
+        logging.exception("metrics: failed to write summary for %s-W%02d", roll.iso_year, roll.iso_week)
+
+def _load_summary(iso_year: int, iso_week: int) -> Optional[WeekRollup]:
+    path = _summary_file(iso_year, iso_week)
+    try:
+        if path.exists():
+            return _rollup_from_dict(json.loads(path.read_text("utf-8")))
+    except Exception:
+        logging.exception("metrics: failed to read %s", path)
+    return None
+
+# ---- live (current week) rollup ----
+# Kept up to date by append_event(); rebuilt from the store once at startup.
+
+_live: Optional[WeekRollup] = None
+
+def _live_key() -> Optional[Tuple[int, int]]:
+    return (_live.iso_year, _live.iso_week) if _live is not None else None
+
+def load_rollups():
+    """Rebuild the current week's rollup from disk (startup)."""
+    global _live
+    y, w = _week_key_from_ts(_now_ts())
+    _live = _reduce_week(y, w)
+
+def _live_rollup() -> WeekRollup:
+    """Return the live rollup, closing it into a summary if the ISO week has rolled over."""
+    global _live
+    y, w = _week_key_from_ts(_now_ts())
+    if _live is None:
+        load_rollups()
+    elif (_live.iso_year, _live.iso_week) < (y, w):
+        if _live.uploads_started or _live.uploads_finished or _live.deleted_files_count:
+            _save_summary(_live)
+        _live = _new_rollup(y, w)
+    return _live
+
+def _track_event(rec: dict):
+    key = _week_key_from_ts(rec["ts"])
+    live = _live_rollup()
+    if key == (live.iso_year, live.iso_week):
+        _apply_event(live, rec, _week_bounds(*key))
+    else:
+        # Late event for a closed week: drop its summary so it is reduced again
+        with_summary = _summary_file(*key)
+        if with_summary.exists():
+            with_summary.unlink(missing_ok=True)
+
+def rollup_week(iso_year: int, iso_week: int) -> WeekRollup:
+    """
+    Rollup for one ISO week: the live rollup for the current week, a persisted
+    summary for closed weeks (reduced from the store once, on first request).
+    """
+    live = _live_rollup()
+    if (iso_year, iso_week) == (live.iso_year, live.iso_week):
+        return live
+    roll = _load_summary(iso_year, iso_week)
+    if roll is not None:
+        return roll
+    roll = _reduce_week(iso_year, iso_week)
+    if (iso_year, iso_week) < (live.iso_year, live.iso_week) and eventstore.has_events(*_week_bounds(iso_year, iso_week)):
+        _save_summary(roll)
+    return roll
+
+# ---- compaction of closed weekly logs ----
+
+_WEEK_LOG_RE = re.compile(r"^events-(\d{4})-W(\d{2})\.jsonl$")
+
+def _compact_record(rec: dict) -> dict:
+    # Empty/zero/false fields read back identically through .get(..., default)
+    return {k: v for k, v in rec.items() if k in ("ts", "kind") or v not in (None, "", 0, False, [], {})}
+
+def _import_locked(path: Path):
+    # Under the writer's lock, so a batch can't land in the file between import and insert
+    with _io_lock:
+        eventstore.import_jsonl([path])
+
+def _compact_week_file(path: Path) -> Tuple[int, int]:
+    """
+    Fold a closed week's plain JSONL log into its gzip segment (appending a
+    new gzip member if the segment already exists) and remove the plain file.
+    Returns (events, bytes freed). Blocking; runs in a worker thread.
+    """
+    seg = path.with_name(path.name + ".gz")
+    tmp = path.with_name(path.name + ".gz.tmp")
+    with _io_lock:
+        if _fh_path == path:
+            _close_fh()
+        before = path.stat().st_size + (seg.stat().st_size if seg.exists() else 0)
+        if seg.exists():
+            shutil.copyfile(seg, tmp)
+        n = 0
+        with gzip.open(tmp, "at", encoding="utf-8") as out:
+            for rec in eventstore.iter_log(path):
+                out.write(json.dumps(_compact_record(rec), ensure_ascii=False, separators=(",", ":")) + "\n")
+                n += 1
+        os.replace(tmp, seg)
+        path.unlink()
+    return n, before - seg.stat().st_size
+
+async def compact_event_logs():
+    """
+    Compact every closed week's events-*.jsonl into a .jsonl.gz segment,
+    persisting the week's summary first (METRICS_COMPACT_SUMMARIES).
+    """
+    await flush_events()
+    live = _live_rollup()
+    for path in sorted(METRICS_DIR.glob("events-*-W*.jsonl")):
+        m = _WEEK_LOG_RE.match(path.name)
+        if not m:
+            continue
+        key = (int(m.group(1)), int(m.group(2)))
+        if key >= (live.iso_year, live.iso_week):
+            continue
+        try:
+            # Everything in the log must be in the store before the plain file goes
+            await asyncio.to_thread(_import_locked, path)
+            if METRICS_COMPACT_SUMMARIES:
+                rollup_week(*key)
+            n, freed = await asyncio.to_thread(_compact_week_file, path)
+            logging.info("metrics: compacted %s (%d event(s), %s freed)", path.name, n, humanReadableSize(max(0, freed)))
+        except Exception:
+            logging.exception("metrics: failed to compact %s", path.name)
+
 def _aggregate_net_growth(week_keys: List[Tuple[int,int]]) -> List[int]:
     out = []
     for (y, w) in week_keys:
@@ -259,7 +695,7 @@ def _aggregate_net_growth(week_keys: List[Tuple[int,int]]) -> List[int]:
 def _mk_dm_button_for_top_client(roll: WeekRollup) -> Optional[InlineKeyboardMarkup]:
     if not roll.per_client_bytes:
         return None
-    top_client = max(roll.per_client_bytes.items(), key=lambda kv: kv[1])[0]  # "@name" or "id:123"
+    top_client = roll.per_client_bytes.top(1)[0][0]  # "@name" or "id:123"
     if top_client.startswith("@"):
         url = f"https://t.me/{top_client[1:]}"
     elif top_client.startswith("id:"):
@@ -274,29 +710,11 @@ def _mk_dm_button_for_top_client(roll: WeekRollup) -> Optional[InlineKeyboardMar
 
 
 def _retention_outlook() -> Tuple[int, Optional[int]]:
-    base = Path(folder.get())
-    if not base.exists():
-        return (0, None)
-
-    def age_days(p: Path) -> int:
-        try:
-            st = p.stat()
-            return int((datetime.now().timestamp() - st.st_mtime) / 86400.0)
-        except Exception:
-            return 0
-
-    warn_start = RETENTION_DAYS - RETENTION_NOTICE_DAYS
-    soon = 0
-    oldest = 0
-    for p in base.iterdir():
-        if p.is_file():
-            a = age_days(p)
-            if warn_start <= a < RETENTION_DAYS:
-                soon += 1
-            if a > oldest:
-                oldest = a
-
-    return (soon, oldest or None)
+    """(files entering the warning window or expiring soon, age in days of the oldest stored file)."""
+    now = _now_ts()
+    soon = catalog.count_expiring(now, now + RETENTION_NOTICE_DAYS * 86400)
+    oldest = catalog.oldest_mtime()
+    return (soon, int((now - oldest) / 86400.0) if oldest is not None else None)
 
 
 def _avg_growth_last_weeks(incl_year: int, incl_week: int, window: int = 4) -> Optional[float]:
@@ -341,7 +759,7 @@ def generate_weekly_text_and_buttons(mode: str = "completed") -> Tuple[str, Opti
     date_range = f"{week_start.strftime('%b %d')}–{week_end.strftime('%b %d, %Y')}"
 
     # Disk usage
-    usage = diskUsage(folder.get())
+    usage = diskUsage(BASE_FOLDER)
     used = usage.used
     total = usage.capacity
 
@@ -358,9 +776,9 @@ def generate_weekly_text_and_buttons(mode: str = "completed") -> Tuple[str, Opti
 
     # Top lists & busiest hour
     busiest_hour = max(this.started_by_hour.items(), key=lambda kv: kv[1])[0] if this.started_by_hour else None
-    top_by_bytes = sorted(this.per_client_bytes.items(), key=lambda kv: kv[1], reverse=True)[:5]
-    top_by_count = sorted(this.per_client_count.items(), key=lambda kv: kv[1], reverse=True)[:5]
-    top_ext      = sorted(this.by_ext_count.items(),   key=lambda kv: kv[1], reverse=True)[:6]
+    top_by_bytes = this.per_client_bytes.top(5)
+    top_by_count = this.per_client_count.top(5)
+    top_ext      = this.by_ext_count.top(6)
 
     # Retention outlook from filesystem
     soon, oldest = _retention_outlook()
@@ -386,13 +804,19 @@ def generate_weekly_text_and_buttons(mode: str = "completed") -> Tuple[str, Opti
         "top_by_bytes": list(top_by_bytes),
         "top_by_count": list(top_by_count),
         "top_ext": list(top_ext),
-        "largest_files": list(this.largest_files),
+        "largest_files": _largest_files(this),
         "retention_notice_days": RETENTION_NOTICE_DAYS,
         "soon": int(soon),
         "deleted_files_count": int(this.deleted_files_count),
         "deleted_bytes": int(this.deleted_bytes),
         "oldest": oldest,
-        "new_clients": list(this.new_clients or []),
+        "new_clients": sorted(this.new_clients or ()),
+        "duration_p50": this.durations.quantile(0.5),
+        "duration_p90": this.durations.quantile(0.9),
+        "duration_p99": this.durations.quantile(0.99),
+        "speed_p50": this.speeds.quantile(0.5),
+        "speed_p90": this.speeds.quantile(0.9),
+        "stages": [(st, p[0.5], p[0.95]) for st, _, p in stage_percentiles(*_week_bounds(y, w))],
     }
 
     text = weekly_report_text(payload)
@@ -401,5 +825,6 @@ def generate_weekly_text_and_buttons(mode: str = "completed") -> Tuple[str, Opti
 
 
 async def send_weekly_report():
+    await flush_events()
     text, buttons = generate_weekly_text_and_buttons()
     await notify(text, reply_markup=buttons)
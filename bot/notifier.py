@@ -1,25 +1,49 @@
 import os
+import asyncio
 import logging
+from typing import Optional
 
-from . import app
+from . import outbox
 from pyrogram.enums import ParseMode
 from .messages import notify_new_upload, weekly_usage, retention_warning, retention_deleted
 
 PRIVATE_CHANNEL_ID = int(os.getenv("PRIVATE_CHANNEL_ID", "0") or "0")
 
-async def safe_send(text: str, reply_markup=None):
+async def safe_send(text: str, reply_markup=None) -> Optional[asyncio.Future]:
+    """
+    Queue a notification for the private channel and return at once; the
+    outbox delivers it (retrying FloodWaits) behind anything user-facing.
+    Returns the outbox future (done once the message is sent or has failed),
+    or None when there is no channel to notify.
+    """
     if not PRIVATE_CHANNEL_ID:
         logging.debug("PRIVATE_CHANNEL_ID not set; skipping notify: %s", text)
-        return
+        return None
+    return outbox.send_message(
+        PRIVATE_CHANNEL_ID,
+        text,
+        priority=outbox.ADMIN,
+        parse_mode=ParseMode.MARKDOWN,
+        disable_web_page_preview=True,
+        reply_markup=reply_markup,          # ← NEW
+    )
+
+notify = safe_send
+
+async def notify_document(path: str, caption: str = "") -> bool:
+    """Upload a file to the private channel; returns False if it couldn't be delivered."""
+    if not PRIVATE_CHANNEL_ID:
+        logging.debug("PRIVATE_CHANNEL_ID not set; skipping document: %s", path)
+        return False
     try:
-        await app.send_message(
+        await outbox.send_document(
             PRIVATE_CHANNEL_ID,
-            text,
+            path,
+            priority=outbox.ADMIN,
+            caption=caption,
             parse_mode=ParseMode.MARKDOWN,
-            disable_web_page_preview=True,
-            reply_markup=reply_markup,          # ← NEW
         )
+        return True
     except Exception:
-        logging.exception("Failed to notify private channel")
-
-notify = safe_send
\ No newline at end of file
+        logging.exception("Failed to send document %s to private channel", path)
+        return False
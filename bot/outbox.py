@@ -0,0 +1,282 @@
+# bot/outbox.py
+"""
+Single outbound queue for everything the bot sends or edits on Telegram.
+
+Callers submit a send/edit and get a future back; one dispatcher task
+drains the queue in priority order:
+
+    USER      replies and status edits the uploader is looking at
+    ADMIN     private-channel notifications, digests, reports
+    PROGRESS  transfer progress edits (only the newest one per message is kept)
+
+Sends respect a global rate (OUTBOX_GLOBAL_RATE per second) and a minimum
+interval per chat (OUTBOX_CHAT_INTERVAL for private chats,
+OUTBOX_GROUP_INTERVAL for groups and channels), and each chat has at most
+one request in flight, so its messages land in order. A FloodWait blocks
+only that chat for the delay Telegram asks for, and the request goes back
+to the head of its lane to be retried (up to OUTBOX_MAX_RETRIES times).
+"""
+import os
+import time
+import asyncio
+import logging
+from bisect import insort
+from itertools import count
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from pyrogram.errors import FloodWait
+
+from . import app, telemetry
+
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "25") or "25")          # requests per second, all chats
+OUTBOX_CHAT_INTERVAL = float(os.getenv("OUTBOX_CHAT_INTERVAL", "1") or "1")        # seconds between requests to one private chat
+OUTBOX_GROUP_INTERVAL = float(os.getenv("OUTBOX_GROUP_INTERVAL", "3") or "3")      # ... to one group/channel (20/min)
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "4") or "4")              # requests in flight across chats
+OUTBOX_MAX_RETRIES = int(os.getenv("OUTBOX_MAX_RETRIES", "5") or "5")              # FloodWait retries per request
+
+USER, ADMIN, PROGRESS = 0, 1, 2
+PRIORITY_NAMES = {USER: "user", ADMIN: "admin", PROGRESS: "progress"}
+
+_queue_wait = telemetry.Histogram(
+    "outbox_wait_seconds", "Time a request spent queued before it was sent, per priority",
+    (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 15, 60, 300), ("priority",),
+)
+_sent = telemetry.Counter("outbox_sent", "Requests delivered by the outbound queue", ("method",))
+_failed = telemetry.Counter("outbox_failed", "Requests the outbound queue gave up on", ("method",))
+_dropped = telemetry.Counter("outbox_coalesced", "Queued edits replaced by a newer edit of the same message")
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "chat_id", "method", "call", "key", "futures", "queued_at", "attempts")
+
+    def __init__(self, priority: int, chat_id: int, method: str, call: Callable[[], Awaitable[Any]], key: Optional[Hashable]):
+        self.priority = priority
+        self.seq = next(_seq)
+        self.chat_id = chat_id
+        self.method = method
+        self.call = call
+        self.key = key
+        self.futures: List[asyncio.Future] = []
+        self.queued_at = time.monotonic()
+        self.attempts = 0
+
+    def __lt__(self, other: "_Job") -> bool:
+        return self.seq < other.seq
+
+
+_seq = count()
+_lanes: Dict[int, List[_Job]] = {USER: [], ADMIN: [], PROGRESS: []}     # each kept in submission order
+_by_key: Dict[Hashable, _Job] = {}          # queued (not yet in flight) jobs that can be coalesced
+_busy: Set[int] = set()                     # chats with a request in flight
+_next_at: Dict[int, float] = {}             # chat -> monotonic time it may be sent to again
+_wakeup: Optional[asyncio.Event] = None
+_tokens = 0.0
+_refilled = 0.0
+
+
+def _event() -> asyncio.Event:
+    global _wakeup
+    if _wakeup is None:
+        _wakeup = asyncio.Event()
+    return _wakeup
+
+
+def _retrieve(fut: asyncio.Future):
+    # Fire-and-forget callers never await their future; the dispatcher already logged the failure
+    if not fut.cancelled():
+        fut.exception()
+
+
+def submit(
+    chat_id: int,
+    call: Callable[[], Awaitable[Any]],
+    priority: int = ADMIN,
+    method: str = "send",
+    key: Optional[Hashable] = None,
+) -> asyncio.Future:
+    """
+    Queue `call` (a zero-argument coroutine factory doing one API request)
+    for `chat_id`. Await the returned future for the request's result, or
+    ignore it to fire and forget. With `key`, a still-queued request with the
+    same key is replaced by this one (keeping its place in line), so only the
+    latest edit of a message is ever sent.
+    """
+    fut = asyncio.get_running_loop().create_future()
+    fut.add_done_callback(_retrieve)
+    job = _by_key.get(key) if key is not None else None
+    if job is not None:
+        _dropped.inc()
+        job.call, job.method = call, method
+        if priority < job.priority:
+            _lanes[job.priority].remove(job)
+            job.priority = priority
+            insort(_lanes[priority], job)
+    else:
+        job = _Job(priority, chat_id or 0, method, call, key)
+        insort(_lanes[priority], job)
+        if key is not None:
+            _by_key[key] = job
+    job.futures.append(fut)
+    _event().set()
+    return fut
+
+
+def send_message(chat_id: int, text: str, priority: int = ADMIN, **kwargs) -> asyncio.Future:
+    return submit(chat_id, lambda: app.send_message(chat_id, text, **kwargs), priority, "send_message")
+
+
+def send_document(chat_id: int, path: str, priority: int = ADMIN, **kwargs) -> asyncio.Future:
+    return submit(chat_id, lambda: app.send_document(chat_id, path, **kwargs), priority, "send_document")
+
+
+def reply(message, text: str, priority: int = USER, **kwargs) -> asyncio.Future:
+    """message.reply() through the queue."""
+    return submit(_chat_of(message), lambda: message.reply(text, **kwargs), priority, "reply")
+
+
+def edit(message, text: str, priority: int = USER, method: str = "edit", **kwargs) -> asyncio.Future:
+    """message.edit() through the queue; replaces any queued edit of the same message."""
+    chat_id = _chat_of(message)
+    return submit(
+        chat_id, lambda: message.edit(text, **kwargs), priority, method,
+        key=("edit", chat_id, getattr(message, "id", None)),
+    )
+
+
+def _chat_of(message) -> int:
+    return getattr(getattr(message, "chat", None), "id", None) or 0
+
+
+def depth() -> Dict[str, int]:
+    """Queued requests per priority class (in-flight ones excluded)."""
+    return {PRIORITY_NAMES[p]: len(lane) for p, lane in _lanes.items()}
+
+
+# ========= Dispatcher =========
+
+def _interval(chat_id: int) -> float:
+    return OUTBOX_GROUP_INTERVAL if chat_id < 0 else OUTBOX_CHAT_INTERVAL
+
+
+def _take_token() -> float:
+    """Spend one global token; returns 0, or how long to wait for the next one."""
+    global _tokens, _refilled
+    now = time.monotonic()
+    burst = max(1.0, OUTBOX_GLOBAL_RATE)
+    _tokens = min(burst, _tokens + (now - _refilled) * OUTBOX_GLOBAL_RATE)
+    _refilled = now
+    if _tokens >= 1:
+        _tokens -= 1
+        return 0.0
+    return (1 - _tokens) / OUTBOX_GLOBAL_RATE
+
+
+def _pick() -> Tuple[Optional[_Job], Optional[float]]:
+    """Highest-priority, oldest job whose chat is free; else (None, seconds until one may be)."""
+    now = time.monotonic()
+    soonest: Optional[float] = None
+    for p in sorted(_lanes):
+        lane = _lanes[p]
+        for i, job in enumerate(lane):
+            if job.chat_id in _busy:
+                continue
+            at = _next_at.get(job.chat_id, 0.0)
+            if at <= now:
+                del lane[i]
+                if job.key is not None and _by_key.get(job.key) is job:
+                    del _by_key[job.key]
+                return job, None
+            soonest = at - now if soonest is None else min(soonest, at - now)
+    return None, soonest
+
+
+async def _deliver(job: _Job, slots: asyncio.Semaphore):
+    chat = job.chat_id
+    try:
+        job.attempts += 1
+        result = await job.call()
+    except asyncio.CancelledError:
+        for f in job.futures:
+            f.cancel()
+        raise
+    except FloodWait as e:
+        telemetry.floodwaits.inc(method=job.method)
+        wait = float(getattr(e, "value", 0) or 0) + 1
+        _next_at[chat] = time.monotonic() + wait
+        if job.attempts <= OUTBOX_MAX_RETRIES:
+            logging.warning("outbox: FloodWait %.0fs on %s to %s; retrying", wait, job.method, chat)
+            insort(_lanes[job.priority], job)
+            return
+        _fail(job, e)
+    except Exception as e:
+        telemetry.note_error(job.method, e)
+        _next_at[chat] = time.monotonic() + _interval(chat)
+        _fail(job, e)
+    else:
+        _next_at[chat] = time.monotonic() + _interval(chat)
+        _sent.inc(method=job.method)
+        if job.method == "edit_progress":
+            telemetry.progress_edits.inc()
+        for f in job.futures:
+            if not f.done():
+                f.set_result(result)
+    finally:
+        _busy.discard(chat)
+        slots.release()
+        _event().set()
+
+
+def _fail(job: _Job, exc: BaseException):
+    _failed.inc(method=job.method)
+    if job.priority == PROGRESS or job.method.startswith("edit"):
+        # Deleted or unchanged messages are routine for edits
+        logging.debug("outbox: %s to %s failed: %r", job.method, job.chat_id, exc)
+    else:
+        logging.warning("outbox: %s to %s failed after %d attempt(s): %r", job.method, job.chat_id, job.attempts, exc)
+    for f in job.futures:
+        if not f.done():
+            f.set_exception(exc)
+
+
+async def run_outbox():
+    """Drain the outbound queue until cancelled; requests still queued then are cancelled."""
+    global _tokens, _refilled
+    slots = asyncio.Semaphore(max(1, OUTBOX_CONCURRENCY))
+    tasks: Set[asyncio.Task] = set()
+    _tokens, _refilled = max(1.0, OUTBOX_GLOBAL_RATE), time.monotonic()
+    wake = _event()
+    try:
+        while True:
+            await slots.acquire()
+            job, delay = _pick()
+            if job is None:
+                slots.release()
+                wake.clear()
+                try:
+                    await asyncio.wait_for(wake.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            while True:
+                wait = _take_token()
+                if not wait:
+                    break
+                await asyncio.sleep(wait)
+            _busy.add(job.chat_id)
+            _queue_wait.observe(time.monotonic() - job.queued_at, priority=PRIORITY_NAMES[job.priority])
+            t = asyncio.create_task(_deliver(job, slots), name=f"outbox-{job.method}")
+            tasks.add(t)
+            t.add_done_callback(tasks.discard)
+    except asyncio.CancelledError:
+        pass
+    finally:
+        for t in list(tasks):
+            t.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        for lane in _lanes.values():
+            for job in lane:
+                for f in job.futures:
+                    f.cancel()
+            lane.clear()
+        _by_key.clear()
@@ -0,0 +1,238 @@
+# bot/rescan.py
+import os
+import json
+import time
+import shutil
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import psutil
+
+from . import BASE_FOLDER, CONFIG_FOLDER, catalog
+from .scanner import scan_path, db_version
+from .notifier import notify
+from .messages import admin_rescan_infected
+from .metrics import append_event
+
+RESCAN_ENABLED = os.getenv("RESCAN_ENABLED", "1") != "0"
+RESCAN_CHECK_INTERVAL = int(os.getenv("RESCAN_CHECK_INTERVAL", "3600") or "3600")      # seconds between DB version checks
+RESCAN_BYTES_PER_SEC = int(os.getenv("RESCAN_BYTES_PER_SEC", "20971520") or "20971520")  # 20 MiB/s
+QUARANTINE_FOLDER = os.getenv("QUARANTINE_FOLDER", os.path.join(CONFIG_FOLDER, "quarantine"))
+
+STATE_FILE = Path(CONFIG_FOLDER) / "rescan_state.json"
+# {
+#   "db_version": int | null,          # last version a full pass completed for (or baseline)
+#   "pass": {                           # in-progress pass, null when idle
+#       "db_version": int, "started": int,
+#       "cursor": [mtime, path] | null, # last file done; files are walked newest first
+#       "files": int, "bytes": int, "infected": int,
+#   } | null
+# }
+
+
+# ========= Checkpoint =========
+
+def _load_state() -> dict:
+    try:
+        if STATE_FILE.exists():
+            return json.loads(STATE_FILE.read_text("utf-8"))
+    except Exception:
+        logging.exception("rescan: failed to read %s", STATE_FILE)
+    return {"db_version": None, "pass": None}
+
+def _save_state(state: dict):
+    try:
+        tmp = STATE_FILE.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(state), encoding="utf-8")
+        tmp.replace(STATE_FILE)
+    except Exception:
+        logging.exception("rescan: failed to write %s", STATE_FILE)
+
+
+# ========= Low-priority worker =========
+
+def _lower_priority():
+    """
+    Executor initializer: put the rescan thread into the idle I/O class and
+    lowest CPU niceness. On Linux both are per-thread, so the rest of the bot
+    keeps its normal priority.
+    """
+    tid = threading.get_native_id()
+    try:
+        psutil.Process(tid).ionice(psutil.IOPRIO_CLASS_IDLE)
+    except Exception:
+        logging.debug("rescan: ionice not available", exc_info=True)
+    try:
+        os.setpriority(os.PRIO_PROCESS, tid, 19)
+    except Exception:
+        logging.debug("rescan: setpriority not available", exc_info=True)
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rescan", initializer=_lower_priority)
+
+def _list_stored_files(started_before: float) -> List[Tuple[float, str, int]]:
+    """
+    (mtime, path, size) for every regular file under BASE_FOLDER, newest first.
+    Files modified after the pass started were scanned on arrival with the
+    current signatures and are skipped.
+    """
+    out: List[Tuple[float, str, int]] = []
+    for root, dirs, files in os.walk(BASE_FOLDER):
+        for name in files:
+            if name.endswith(".warned"):
+                continue
+            p = os.path.join(root, name)
+            try:
+                st = os.lstat(p)
+            except OSError:
+                continue
+            if not os.path.isfile(p) or os.path.islink(p):
+                continue
+            if st.st_mtime >= started_before:
+                continue
+            out.append((st.st_mtime, p, st.st_size))
+    out.sort(key=lambda x: (-x[0], x[1]))
+    return out
+
+def _quarantine(path: str) -> Optional[str]:
+    try:
+        Path(QUARANTINE_FOLDER).mkdir(parents=True, exist_ok=True)
+        dest = os.path.join(QUARANTINE_FOLDER, f"{int(time.time())}-{os.path.basename(path)}")
+        shutil.move(path, dest)
+        return dest
+    except Exception:
+        logging.exception("rescan: failed to quarantine %s", path)
+        return None
+
+
+# ========= Pass =========
+
+_MAX_FILE_ERRORS = 3     # consecutive scan errors on one file before the pass moves past it
+
+def _after_cursor(item: Tuple[float, str, int], cursor) -> bool:
+    if not cursor:
+        return True
+    mtime, path, _ = item
+    # Newest-first order: everything sorting after the cursor is still to do
+    return (-mtime, path) > (-cursor[0], cursor[1])
+
+async def _run_pass(state: dict):
+    loop = asyncio.get_running_loop()
+    p = state["pass"]
+    version = p["db_version"]
+    files = await loop.run_in_executor(_executor, _list_stored_files, float(p["started"]))
+    todo = [f for f in files if _after_cursor(f, p.get("cursor"))]
+    logging.info("rescan: DB %s — %d file(s) to rescan (%d already done)", version, len(todo), len(files) - len(todo))
+
+    for mtime, path, size in todo:
+        t0 = time.monotonic()
+        res = await loop.run_in_executor(_executor, scan_path, path, size)
+
+        if res.status == "infected":
+            sig = res.signature or "unknown"
+            dest = await loop.run_in_executor(_executor, _quarantine, path)
+            if dest:
+                catalog.remove(catalog.rel(path))
+            p["infected"] = int(p.get("infected", 0)) + 1
+            append_event(
+                "rescan_infected",
+                filename=os.path.relpath(path, BASE_FOLDER),
+                size_bytes=int(size),
+                signature=sig,
+                db_version=version,
+                quarantined=bool(dest),
+            )
+            await notify(admin_rescan_infected(os.path.relpath(path, BASE_FOLDER), sig, version, bool(dest)))
+            logging.warning("rescan: %s infected (%s), quarantined to %s", path, sig, dest)
+        elif res.status == "error":
+            # clamd down or every endpoint ejected: stop here and retry this file on the next tick,
+            # unless it is this one file that keeps failing
+            stuck = p.get("stuck") or [None, 0]
+            tries = stuck[1] + 1 if stuck[0] == path else 1
+            if tries < _MAX_FILE_ERRORS:
+                p["stuck"] = [path, tries]
+                _save_state(state)
+                logging.warning("rescan: scan error for %s; pausing the pass until the next check", path)
+                return
+            logging.warning("rescan: %s failed %d times in a row; skipping it", path, tries)
+        else:
+            catalog.set_verdict(path, "clean")
+        p["stuck"] = None
+
+        p["cursor"] = [mtime, path]
+        p["files"] = int(p.get("files", 0)) + 1
+        p["bytes"] = int(p.get("bytes", 0)) + int(size)
+        _save_state(state)
+
+        # Pace to RESCAN_BYTES_PER_SEC: clamd reads the file itself, so the only
+        # lever we have is how fast we hand it new work.
+        if RESCAN_BYTES_PER_SEC > 0:
+            budget = size / RESCAN_BYTES_PER_SEC
+            spent = time.monotonic() - t0
+            if budget > spent:
+                await asyncio.sleep(budget - spent)
+
+    append_event(
+        "rescan_pass",
+        db_version=version,
+        files=int(p.get("files", 0)),
+        size_bytes=int(p.get("bytes", 0)),
+        infected=int(p.get("infected", 0)),
+        duration_sec=float(max(0, int(time.time()) - int(p["started"]))),
+    )
+    logging.info("rescan: pass for DB %s done (%d file(s), %d infected)", version, p.get("files", 0), p.get("infected", 0))
+    state["db_version"] = version
+    state["pass"] = None
+    _save_state(state)
+
+
+async def _tick():
+    loop = asyncio.get_running_loop()
+    version = await loop.run_in_executor(_executor, db_version)
+    if version is None:
+        return
+
+    state = _load_state()
+    p = state.get("pass")
+    if p and p.get("db_version") == version:
+        await _run_pass(state)      # resume after restart
+        return
+
+    if state.get("db_version") is None:
+        # First run: files on disk were scanned with whatever was current; use as baseline
+        state["db_version"] = version
+        _save_state(state)
+        logging.info("rescan: baseline DB version %s", version)
+        return
+
+    if version != state.get("db_version") or p:
+        # New signatures (or a newer one arrived mid-pass): start over from the newest file
+        state["pass"] = {
+            "db_version": version, "started": int(time.time()),
+            "cursor": None, "files": 0, "bytes": 0, "infected": 0,
+        }
+        _save_state(state)
+        await _run_pass(state)
+
+
+async def run_rescanner():
+    """
+    Background loop: poll clamd's DB version and rescan stored files when it changes.
+    """
+    if not RESCAN_ENABLED:
+        logging.info("rescan: disabled")
+        return
+    while True:
+        try:
+            await _tick()
+        except asyncio.CancelledError:
+            break
+        except Exception:
+            logging.exception("rescan tick failed")
+        try:
+            await asyncio.sleep(RESCAN_CHECK_INTERVAL)
+        except asyncio.CancelledError:
+            break
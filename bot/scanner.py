@@ -1,25 +1,174 @@
 import os
+import time
 import clamd
+import asyncio
 import logging
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+from . import telemetry
 
 CLAMAV_HOST = os.getenv("CLAMAV_HOST", "clamav")
 CLAMAV_PORT = int(os.getenv("CLAMAV_PORT", "3310"))
+# Optional list of clamd daemons ("host:port host2:port"); falls back to CLAMAV_HOST/CLAMAV_PORT
+CLAMAV_ENDPOINTS = os.getenv("CLAMAV_ENDPOINTS", "")
+CLAMAV_TIMEOUT = int(os.getenv("CLAMAV_TIMEOUT", "30") or "30")
+CLAMAV_FAIL_THRESHOLD = int(os.getenv("CLAMAV_FAIL_THRESHOLD", "3") or "3")      # consecutive failures before ejecting
+CLAMAV_PROBE_INTERVAL = int(os.getenv("CLAMAV_PROBE_INTERVAL", "15") or "15")    # seconds between re-probes of ejected daemons
 
 class ScanResult:
     def __init__(self, status: str, signature: str | None):
         self.status = status      # "clean" | "infected" | "error"
         self.signature = signature
 
-def _client():
-    return clamd.ClamdNetworkSocket(host=CLAMAV_HOST, port=CLAMAV_PORT, timeout=30)
 
-def scan_path(path: str) -> ScanResult:
-    try:
-        cd = _client()
-        # PING ensures daemon is ready; raises on failure
-        cd.ping()
-        # clamd returns dict: {"path": ("FOUND"/"OK"/"ERROR", "SigName" or None)}
-        result = cd.scan(path)
+# ========= Endpoints & circuit breakers =========
+
+class Endpoint:
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        # load
+        self.in_flight = 0
+        self.outstanding_bytes = 0
+        # breaker: closed while healthy, open (ejected) after CLAMAV_FAIL_THRESHOLD failures
+        self.healthy = True
+        self.failures = 0
+        self.ejected_at = 0.0
+        # latency
+        self.scans = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        self.latencies = deque(maxlen=512)
+
+    @property
+    def name(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    def client(self):
+        return clamd.ClamdNetworkSocket(host=self.host, port=self.port, timeout=CLAMAV_TIMEOUT)
+
+def _parse_endpoints() -> List[Endpoint]:
+    out: List[Endpoint] = []
+    for item in CLAMAV_ENDPOINTS.replace(",", " ").split():
+        host, _, port = item.rpartition(":")
+        if not host:
+            host, port = item, str(CLAMAV_PORT)
+        try:
+            out.append(Endpoint(host, int(port)))
+        except ValueError:
+            logging.error("ClamAV: bad endpoint %r in CLAMAV_ENDPOINTS", item)
+    return out or [Endpoint(CLAMAV_HOST, CLAMAV_PORT)]
+
+_endpoints: List[Endpoint] = _parse_endpoints()
+# scan_path() runs on worker threads (to_thread / executors), so guard the counters
+_lock = threading.Lock()
+
+_scan_seconds = telemetry.Histogram(
+    "clamav_scan_seconds", "ClamAV scan latency per endpoint (successful scans)",
+    (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300), ("endpoint",),
+)
+_scan_errors = telemetry.Counter("clamav_scan_errors", "ClamAV scans that failed on an endpoint", ("endpoint",))
+
+def _collect_endpoints():
+    for st in endpoint_stats():
+        yield {"endpoint": st["endpoint"], "state": "up" if st["healthy"] else "ejected"}, st["in_flight"]
+
+telemetry.register_collector(
+    "clamav_scans_in_flight", "Scans currently submitted to each clamd endpoint (and its breaker state)",
+    "gauge", _collect_endpoints,
+)
+telemetry.register_collector(
+    "clamav_outstanding_bytes", "Bytes of files currently being scanned per endpoint", "gauge",
+    lambda: [({"endpoint": st["endpoint"]}, st["outstanding_bytes"]) for st in endpoint_stats()],
+)
+
+def _acquire(size: int, tried: set) -> Optional[Endpoint]:
+    """Pick the healthy endpoint with the least outstanding bytes and charge it."""
+    with _lock:
+        candidates = [e for e in _endpoints if e.healthy and e not in tried]
+        if not candidates and not tried:
+            # Everything is ejected: try the one that has been out the longest (half-open)
+            candidates = sorted(_endpoints, key=lambda e: e.ejected_at)[:1]
+        if not candidates:
+            return None
+        ep = min(candidates, key=lambda e: (e.outstanding_bytes, e.in_flight))
+        ep.in_flight += 1
+        ep.outstanding_bytes += size
+        return ep
+
+def _release(ep: Endpoint, size: int, ok: bool, elapsed: float):
+    with _lock:
+        ep.in_flight -= 1
+        ep.outstanding_bytes -= size
+        if ok:
+            _scan_seconds.observe(elapsed, endpoint=ep.name)
+            ep.scans += 1
+            ep.latency_sum += elapsed
+            ep.latencies.append(elapsed)
+            ep.failures = 0
+            if not ep.healthy:
+                ep.healthy = True
+                logging.warning("ClamAV: %s is back", ep.name)
+            return
+        _scan_errors.inc(endpoint=ep.name)
+        ep.errors += 1
+        ep.failures += 1
+        if ep.healthy and ep.failures >= CLAMAV_FAIL_THRESHOLD:
+            ep.healthy = False
+            ep.ejected_at = time.time()
+            logging.warning("ClamAV: ejecting %s after %d failure(s)", ep.name, ep.failures)
+        elif not ep.healthy:
+            ep.ejected_at = time.time()
+
+def endpoint_stats() -> List[Dict]:
+    """Snapshot of per-endpoint health, load and scan latency (seconds)."""
+    out = []
+    with _lock:
+        for e in _endpoints:
+            lat = sorted(e.latencies)
+            out.append({
+                "endpoint": e.name,
+                "healthy": e.healthy,
+                "in_flight": e.in_flight,
+                "outstanding_bytes": e.outstanding_bytes,
+                "scans": e.scans,
+                "errors": e.errors,
+                "latency_avg": (e.latency_sum / e.scans) if e.scans else 0.0,
+                "latency_p50": lat[int((len(lat) - 1) * 0.5)] if lat else 0.0,
+                "latency_p95": lat[int((len(lat) - 1) * 0.95)] if lat else 0.0,
+            })
+    return out
+
+
+# ========= Scanning =========
+
+def scan_path(path: str, size: int | None = None) -> ScanResult:
+    if size is None:
+        try:
+            size = os.path.getsize(path)
+        except Exception:
+            size = 0
+
+    tried: set = set()
+    while True:
+        ep = _acquire(size, tried)
+        if ep is None:
+            logging.error("ClamAV: no endpoint could scan %s", path)
+            return ScanResult("error", None)
+        tried.add(ep)
+
+        t0 = time.monotonic()
+        try:
+            # clamd returns dict: {"path": ("FOUND"/"OK"/"ERROR", "SigName" or None)}
+            result = ep.client().scan(path)
+        except Exception:
+            _release(ep, size, False, time.monotonic() - t0)
+            logging.warning("ClamAV scan failed on %s for %s; failing over", ep.name, path, exc_info=True)
+            continue
+        _release(ep, size, True, time.monotonic() - t0)
+
         if not result or path not in result:
             return ScanResult("error", None)
         status, sig = result[path]
@@ -28,6 +177,52 @@ def scan_path(path: str) -> ScanResult:
         if status == "FOUND":
             return ScanResult("infected", sig)
         return ScanResult("error", sig)
-    except Exception as e:
-        logging.exception("ClamAV scan failed for %s", path)
-        return ScanResult("error", None)
+
+def db_version() -> int | None:
+    """
+    Signature database version reported by clamd, or None if unreachable.
+    clamd answers VERSION with "ClamAV <engine>/<db version>/<db date>".
+    With several daemons the newest version wins.
+    """
+    best = None
+    for ep in [e for e in _endpoints if e.healthy]:
+        try:
+            raw = ep.client().version() or ""
+            parts = raw.split("/")
+            if len(parts) < 2:
+                continue
+            v = int(parts[1].strip())
+            best = v if best is None else max(best, v)
+        except Exception:
+            logging.warning("ClamAV: VERSION query failed on %s", ep.name, exc_info=True)
+    return best
+
+
+# ========= Background re-probe =========
+
+def _probe(ep: Endpoint) -> bool:
+    try:
+        return ep.client().ping() == "PONG"
+    except Exception:
+        return False
+
+async def run_health_probes():
+    """
+    Re-probe ejected daemons and close their breaker once they answer PING.
+    """
+    while True:
+        try:
+            await asyncio.sleep(CLAMAV_PROBE_INTERVAL)
+            for ep in [e for e in _endpoints if not e.healthy]:
+                ok = await asyncio.to_thread(_probe, ep)
+                with _lock:
+                    if ok:
+                        ep.healthy = True
+                        ep.failures = 0
+                        logging.warning("ClamAV: %s answered PING, back in rotation", ep.name)
+                    else:
+                        ep.ejected_at = time.time()
+        except asyncio.CancelledError:
+            break
+        except Exception:
+            logging.exception("ClamAV health probe failed")
@@ -0,0 +1,206 @@
+# bot/scheduler.py
+"""
+Timer-based job scheduler with cron expressions.
+
+Each job's next fire time is computed from its cron expression and the loop
+sleeps until the earliest one. Last-run times are persisted, so runs missed
+while the bot was down (or while the loop was busy) are caught up once on
+the next pass, and a job never overlaps with itself.
+
+Cron syntax is the classic five fields, "minute hour day-of-month month
+day-of-week", each "*", a number, a range "a-b", a list "a,b" or a step
+"*/n" / "a-b/n". Day-of-week is 0-7 (0 and 7 are Sunday) or mon..sun.
+Like cron, when both day fields are restricted a day matching either fires.
+"""
+import json
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from . import CONFIG_FOLDER
+
+STATE_FILE = Path(CONFIG_FOLDER) / "schedule_state.json"      # { job name: last run (epoch s) }
+
+# Upper bound on a single sleep, so wall-clock jumps (DST, NTP) are noticed
+_MAX_SLEEP = 300
+
+_DOW_NAMES = {"sun": 0, "mon": 1, "tue": 2, "wed": 3, "thu": 4, "fri": 5, "sat": 6}
+_MON_NAMES = {m: i for i, m in enumerate(
+    ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"), start=1)}
+
+
+# ========= Cron =========
+
+class Cron:
+    """A parsed five-field cron expression."""
+
+    __slots__ = ("expr", "minutes", "hours", "days", "months", "weekdays", "_any_day", "_any_weekday")
+
+    def __init__(self, expr: str):
+        parts = expr.split()
+        if len(parts) != 5:
+            raise ValueError(f"cron expression needs 5 fields: {expr!r}")
+        self.expr = expr
+        self.minutes = self._field(parts[0], 0, 59)
+        self.hours = self._field(parts[1], 0, 23)
+        self.days = self._field(parts[2], 1, 31)
+        self.months = self._field(parts[3], 1, 12, _MON_NAMES)
+        self.weekdays = {d % 7 for d in self._field(parts[4], 0, 7, _DOW_NAMES)}
+        self._any_day = parts[2] == "*"
+        self._any_weekday = parts[4] == "*"
+
+    @staticmethod
+    def _field(text: str, lo: int, hi: int, names: Optional[Dict[str, int]] = None) -> Set[int]:
+        def num(s: str) -> int:
+            s = s.lower()
+            v = names[s] if names and s in names else int(s)
+            if not lo <= v <= hi:
+                raise ValueError(f"{v} out of range {lo}-{hi}")
+            return v
+
+        out: Set[int] = set()
+        for item in text.split(","):
+            rng, _, step = item.partition("/")
+            if rng == "*":
+                a, b = lo, hi
+            elif "-" in rng:
+                a, b = (num(x) for x in rng.split("-", 1))
+            else:
+                a = b = num(rng)
+                if step:
+                    b = hi
+            n = int(step) if step else 1
+            if n < 1 or a > b:
+                raise ValueError(f"bad cron field {text!r}")
+            out.update(range(a, b + 1, n))
+        return out
+
+    def _day_matches(self, d: datetime) -> bool:
+        if d.month not in self.months:
+            return False
+        dom = d.day in self.days
+        dow = ((d.weekday() + 1) % 7) in self.weekdays
+        if self._any_day or self._any_weekday:
+            return dom and dow
+        return dom or dow
+
+    def next_after(self, after: datetime) -> datetime:
+        """First matching minute strictly after `after` (local time)."""
+        t = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = t.replace(hour=0, minute=0)
+        for _ in range(366 * 5):        # leap-day-only expressions need up to 4 years
+            if self._day_matches(day):
+                for h in sorted(self.hours):
+                    for m in sorted(self.minutes):
+                        cand = day.replace(hour=h, minute=m)
+                        if cand >= t:
+                            return cand
+            day += timedelta(days=1)
+        raise ValueError(f"cron expression never fires: {self.expr!r}")
+
+
+# ========= Jobs =========
+
+class Job:
+    def __init__(self, name: str, cron: str, func: Callable[[], Awaitable[None]], catch_up: bool = True):
+        self.name = name
+        self.cron = Cron(cron)
+        self.func = func
+        self.catch_up = catch_up
+        self.next_run: Optional[datetime] = None
+        self.task: Optional[asyncio.Task] = None
+
+_jobs: List[Job] = []
+
+
+def add_job(name: str, cron: str, func: Callable[[], Awaitable[None]], catch_up: bool = True) -> Job:
+    """
+    Register `func` to run on the `cron` schedule. With catch_up, a run that
+    was due while the bot was down happens once as soon as the scheduler starts.
+    """
+    job = Job(name, cron, func, catch_up)
+    _jobs.append(job)
+    return job
+
+
+def _load_state() -> Dict[str, float]:
+    try:
+        if STATE_FILE.exists():
+            return {k: float(v) for k, v in json.loads(STATE_FILE.read_text("utf-8")).items()}
+    except Exception:
+        logging.exception("scheduler: failed to read %s", STATE_FILE)
+    return {}
+
+def _save_state(state: Dict[str, float]):
+    try:
+        tmp = STATE_FILE.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(state), encoding="utf-8")
+        tmp.replace(STATE_FILE)
+    except Exception:
+        logging.exception("scheduler: failed to write %s", STATE_FILE)
+
+
+async def _run_job(job: Job, state: Dict[str, float]):
+    started = time.time()
+    t0 = time.monotonic()
+    try:
+        await job.func()
+        logging.info("scheduler: %s done in %.1fs", job.name, time.monotonic() - t0)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logging.exception("scheduler: %s failed", job.name)
+    # Recorded even on failure: the next attempt is the next scheduled slot, not a tight retry loop.
+    # The start time (not the slot) is kept, so one catch-up covers every slot missed before it.
+    state[job.name] = started
+    _save_state(state)
+
+
+def _first_run(job: Job, last: Optional[float], now: datetime) -> datetime:
+    if last is None:
+        return job.cron.next_after(now)
+    due = job.cron.next_after(datetime.fromtimestamp(last))
+    if due <= now and not job.catch_up:
+        return job.cron.next_after(now)
+    return due      # may be in the past: a missed run, fired straight away
+
+
+async def run_scheduler():
+    """Run registered jobs on their schedules until cancelled."""
+    state = _load_state()
+    now = datetime.now()
+    for job in _jobs:
+        job.next_run = _first_run(job, state.get(job.name), now)
+        if job.next_run <= now:
+            logging.warning("scheduler: %s missed its run at %s; catching up", job.name, job.next_run)
+        logging.info("scheduler: %s (%s) next at %s", job.name, job.cron.expr, job.next_run)
+
+    try:
+        while True:
+            now = datetime.now()
+            for job in _jobs:
+                if job.next_run > now:
+                    continue
+                if job.task is not None and not job.task.done():
+                    # Still running from the previous slot: skip this one rather than overlap
+                    logging.warning("scheduler: %s still running; skipping the %s run", job.name, job.next_run)
+                else:
+                    job.task = asyncio.create_task(_run_job(job, state), name=f"job-{job.name}")
+                job.next_run = job.cron.next_after(max(now, job.next_run))
+
+            if not _jobs:
+                await asyncio.sleep(_MAX_SLEEP)
+                continue
+            wait = (min(j.next_run for j in _jobs) - datetime.now()).total_seconds()
+            await asyncio.sleep(min(_MAX_SLEEP, max(0.0, wait)))
+    except asyncio.CancelledError:
+        pass
+    finally:
+        running = [j.task for j in _jobs if j.task is not None and not j.task.done()]
+        for t in running:
+            t.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
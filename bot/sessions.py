@@ -0,0 +1,264 @@
+# bot/sessions.py
+"""
+Per-chat session state: the /use download folder, the pending free-text
+description for the next upload, and per-chat settings.
+
+Sessions live in an LRU map capped at SESSIONS_MAX chats; a timer wheel
+ages them out: the pending description after DESC_TTL_SECONDS, the whole
+session after SESSIONS_IDLE_TTL seconds without activity. Touching a
+session is O(1): the wheel is not updated, an entry that fires early is
+simply re-armed at the session's current deadline.
+
+With SESSIONS_PERSIST=1 the folder and settings are also kept in
+CONFIG_FOLDER/sessions.db, so they survive restarts, LRU eviction and idle
+expiry (an evicted chat is reloaded on its next message). Descriptions are
+never persisted.
+"""
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from . import BASE_FOLDER, CONFIG_FOLDER, telemetry
+
+SESSIONS_MAX = int(os.getenv("SESSIONS_MAX", "10000") or "10000")                    # chats kept in memory
+SESSIONS_IDLE_TTL = int(os.getenv("SESSIONS_IDLE_TTL", "86400") or "86400")          # seconds without activity
+SESSIONS_PERSIST = os.getenv("SESSIONS_PERSIST", "0") == "1"
+DESC_TTL = int(os.getenv("DESC_TTL_SECONDS", "180") or "180")                         # pending description lifetime
+
+SESSIONS_DB = Path(CONFIG_FOLDER) / "sessions.db"
+
+_TICK = 5           # seconds per wheel slot
+_SLOTS = 64         # wheel horizon = _TICK * _SLOTS; later deadlines wait in the last slot and re-arm
+
+_evictions = telemetry.Counter("session_evictions", "Chat sessions dropped from memory", ("reason",))
+
+
+class Session:
+    __slots__ = ("chat_id", "folder", "desc", "desc_at", "touched", "settings", "armed")
+
+    def __init__(self, chat_id: int, folder: str = "", settings: Optional[Dict[str, Any]] = None):
+        self.chat_id = chat_id
+        self.folder = folder                    # relative to BASE_FOLDER, "" = root
+        self.desc: Optional[str] = None
+        self.desc_at = 0.0
+        self.touched = time.monotonic()
+        self.settings: Dict[str, Any] = settings or {}
+        self.armed = -1                         # wheel slot holding its entry, -1 = none
+
+    def deadline(self) -> float:
+        d = self.touched + SESSIONS_IDLE_TTL
+        if self.desc is not None:
+            d = min(d, self.desc_at + DESC_TTL)
+        return d
+
+
+_sessions: "OrderedDict[int, Session]" = OrderedDict()
+_wheel: List[Dict[int, float]] = [{} for _ in range(_SLOTS)]     # slot -> {chat_id: deadline when armed}
+_cursor = 0
+
+telemetry.register_collector(
+    "sessions", "Chat sessions held in memory", "gauge", lambda: [({}, len(_sessions))],
+)
+
+
+# ========= Persistence =========
+
+_conn: Optional[sqlite3.Connection] = None
+
+
+def _db() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        SESSIONS_DB.parent.mkdir(parents=True, exist_ok=True)
+        _conn = sqlite3.connect(str(SESSIONS_DB))
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "chat_id INTEGER PRIMARY KEY, folder TEXT NOT NULL DEFAULT '', "
+            "settings TEXT NOT NULL DEFAULT '{}', updated_at INTEGER NOT NULL)"
+        )
+    return _conn
+
+
+def close():
+    global _conn
+    if _conn is not None:
+        _conn.close()
+        _conn = None
+
+
+def _load(chat_id: int) -> Optional[Session]:
+    try:
+        row = _db().execute("SELECT folder, settings FROM sessions WHERE chat_id = ?", (chat_id,)).fetchone()
+    except sqlite3.Error:
+        logging.exception("sessions: failed to load chat %s", chat_id)
+        return None
+    if row is None:
+        return None
+    return Session(chat_id, row[0] or "", json.loads(row[1] or "{}"))
+
+
+def _save(s: Session):
+    if not SESSIONS_PERSIST:
+        return
+    try:
+        db = _db()
+        with db:
+            if not s.folder and not s.settings:
+                db.execute("DELETE FROM sessions WHERE chat_id = ?", (s.chat_id,))
+            else:
+                db.execute(
+                    "INSERT INTO sessions (chat_id, folder, settings, updated_at) VALUES (?,?,?,?) "
+                    "ON CONFLICT (chat_id) DO UPDATE SET folder = excluded.folder, "
+                    "settings = excluded.settings, updated_at = excluded.updated_at",
+                    (s.chat_id, s.folder, json.dumps(s.settings), int(time.time())),
+                )
+    except sqlite3.Error:
+        logging.exception("sessions: failed to save chat %s", s.chat_id)
+
+
+# ========= Store =========
+
+def _arm(s: Session):
+    ticks = int(max(0.0, s.deadline() - time.monotonic()) // _TICK) + 1
+    s.armed = (_cursor + min(ticks, _SLOTS - 1)) % _SLOTS
+    _wheel[s.armed][s.chat_id] = s.deadline()
+
+
+def get(chat_id: int) -> Session:
+    """The chat's session (loaded or created on first use); counts as activity."""
+    s = _sessions.get(chat_id)
+    if s is None:
+        s = (_load(chat_id) if SESSIONS_PERSIST else None) or Session(chat_id)
+        _sessions[chat_id] = s
+        while len(_sessions) > max(1, SESSIONS_MAX):
+            _sessions.popitem(last=False)
+            _evictions.inc(reason="lru")
+    else:
+        _sessions.move_to_end(chat_id)
+        s.touched = time.monotonic()
+    if s.armed < 0:
+        _arm(s)
+    return s
+
+
+def peek(chat_id: int) -> Optional[Session]:
+    """The in-memory session, without creating one or counting as activity."""
+    return _sessions.get(chat_id)
+
+
+# ----- folder -----
+
+def clean_folder(path: str) -> str:
+    """`path` as a folder relative to BASE_FOLDER; ValueError if absolute or it climbs out with ".."."""
+    path = (path or "").strip().replace("\\", "/")
+    if path.startswith("/") or os.path.isabs(path):
+        raise ValueError(f"absolute folder: {path!r}")
+    parts = [p for p in path.split("/") if p and p != "."]
+    if any(p == ".." for p in parts):
+        raise ValueError(f"folder leaves the share: {path!r}")
+    return "/".join(parts)
+
+
+def set_folder(chat_id: int, path: str) -> str:
+    """Point the chat's downloads at BASE_FOLDER/path (created if missing); returns the absolute folder."""
+    rel = clean_folder(path)
+    s = get(chat_id)
+    s.folder = rel
+    target = os.path.join(BASE_FOLDER, s.folder)
+    os.makedirs(target, exist_ok=True)
+    _save(s)
+    return target
+
+
+def reset_folder(chat_id: int):
+    s = get(chat_id)
+    s.folder = ""
+    _save(s)
+
+
+def folder(chat_id: int, activity: bool = False) -> str:
+    """
+    The chat's download folder relative to BASE_FOLDER ("" = root). With
+    activity=True (an upload being queued) the lookup keeps the session
+    alive, so a chat that only uploads after /use doesn't idle out of it.
+    """
+    s = peek(chat_id)
+    if (s is not None and activity) or (s is None and SESSIONS_PERSIST):
+        s = get(chat_id)
+    return s.folder if s is not None else ""
+
+
+# ----- pending description -----
+
+def put_desc(chat_id: int, text: str):
+    if text and text.strip():
+        s = get(chat_id)
+        s.desc, s.desc_at = text.strip(), time.monotonic()
+
+
+def take_desc(chat_id: int) -> Optional[str]:
+    s = peek(chat_id)
+    if s is None or s.desc is None:
+        return None
+    text, s.desc = s.desc, None
+    if time.monotonic() - s.desc_at > DESC_TTL:
+        return None
+    return text
+
+
+# ----- settings -----
+
+def setting(chat_id: int, key: str, default: Any = None) -> Any:
+    s = peek(chat_id)
+    if s is None and SESSIONS_PERSIST:
+        s = get(chat_id)
+    return s.settings.get(key, default) if s is not None else default
+
+
+def set_setting(chat_id: int, key: str, value: Any):
+    s = get(chat_id)
+    if value is None:
+        s.settings.pop(key, None)
+    else:
+        s.settings[key] = value
+    _save(s)
+
+
+# ========= Sweeper =========
+
+def _advance(now: float):
+    """Fire one wheel slot: expire stale descriptions and idle sessions, re-arm the rest."""
+    global _cursor
+    _cursor = (_cursor + 1) % _SLOTS
+    due, _wheel[_cursor] = _wheel[_cursor], {}
+    for chat_id in due:
+        s = _sessions.get(chat_id)
+        if s is None or s.armed != _cursor:
+            continue        # evicted, or a stale entry from before an eviction and reload
+        s.armed = -1
+        if s.desc is not None and now - s.desc_at > DESC_TTL:
+            s.desc = None
+        if now - s.touched >= SESSIONS_IDLE_TTL:
+            del _sessions[chat_id]
+            _evictions.inc(reason="idle")
+            continue
+        _arm(s)
+
+
+async def run_sweeper():
+    """Advance the timer wheel every few seconds until cancelled."""
+    while True:
+        try:
+            await asyncio.sleep(_TICK)
+            _advance(time.monotonic())
+        except asyncio.CancelledError:
+            break
+        except Exception:
+            logging.exception("sessions: sweep failed")
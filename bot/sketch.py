@@ -0,0 +1,238 @@
+# bot/sketch.py
+"""
+Fixed-memory, mergeable summaries used by the metrics rollups.
+"""
+import heapq
+import math
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class LogHistogram:
+    """
+    Log-bucketed quantile sketch (DDSketch / HDR style).
+
+    Positive values land in bucket ceil(log(v) / log(gamma)), so every
+    quantile is answered within `rel_err` relative error. Zero and negative
+    samples are counted separately. When more than `max_buckets` buckets are
+    in use, the lowest ones are collapsed together: only the smallest
+    quantiles lose accuracy and memory stays bounded however many samples
+    are added. Two sketches with the same parameters merge by adding counts.
+    """
+
+    __slots__ = ("rel_err", "max_buckets", "_gamma", "_log_gamma", "buckets", "zeros", "count", "total", "min", "max")
+
+    def __init__(self, rel_err: float = 0.01, max_buckets: int = 2048):
+        self.rel_err = rel_err
+        self.max_buckets = max_buckets
+        self._gamma = (1 + rel_err) / (1 - rel_err)
+        self._log_gamma = math.log(self._gamma)
+        self.buckets: Dict[int, int] = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def add(self, v: float, n: int = 1):
+        v = float(v)
+        if n <= 0 or math.isnan(v):
+            return
+        self.count += n
+        self.total += v * n
+        self.min = v if self.min is None else min(self.min, v)
+        self.max = v if self.max is None else max(self.max, v)
+        if v <= 0:
+            self.zeros += n
+            return
+        i = math.ceil(math.log(v) / self._log_gamma)
+        self.buckets[i] = self.buckets.get(i, 0) + n
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+
+    def _collapse(self):
+        keys = sorted(self.buckets)
+        extra = len(keys) - self.max_buckets
+        into = keys[extra]
+        for k in keys[:extra]:
+            self.buckets[into] += self.buckets.pop(k)
+
+    def extend(self, values: Iterable[float]):
+        for v in values:
+            self.add(v)
+
+    def merge(self, other: "LogHistogram") -> "LogHistogram":
+        if other.rel_err != self.rel_err:
+            raise ValueError("cannot merge sketches with different accuracy")
+        for i, n in other.buckets.items():
+            self.buckets[i] = self.buckets.get(i, 0) + n
+        self.zeros += other.zeros
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        if other.max is not None:
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        if len(self.buckets) > self.max_buckets:
+            self._collapse()
+        return self
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return min(self.min, 0.0)
+        for i in sorted(self.buckets):
+            seen += self.buckets[i]
+            if rank < seen:
+                # Bucket midpoint (in relative terms), clamped to the observed range
+                v = 2 * self._gamma ** i / (self._gamma + 1)
+                return max(self.min, min(self.max, v))
+        return self.max or 0.0
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, LogHistogram) and self.to_dict() == other.to_dict()
+
+    def to_dict(self) -> dict:
+        return {
+            "rel_err": self.rel_err,
+            "max_buckets": self.max_buckets,
+            "buckets": {str(i): n for i, n in self.buckets.items()},
+            "zeros": self.zeros,
+            "count": self.count,
+            "total": self.total,
+            "min": self.min,
+            "max": self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "LogHistogram":
+        h = cls(d["rel_err"], d["max_buckets"])
+        h.buckets = {int(i): int(n) for i, n in d["buckets"].items()}
+        h.zeros = int(d["zeros"])
+        h.count = int(d["count"])
+        h.total = float(d["total"])
+        h.min = d["min"]
+        h.max = d["max"]
+        return h
+
+
+class TopK:
+    """
+    Bounded top-K by weight, kept in a min-heap of size k: adding is
+    O(log k) and the whole population is never held or sorted.
+    """
+
+    __slots__ = ("k", "_heap", "_seq")
+
+    def __init__(self, k: int = 5):
+        self.k = k
+        self._heap: List[tuple] = []    # (weight, seq, item); seq keeps ties stable and items uncompared
+        self._seq = 0
+
+    def add(self, weight: float, item):
+        self._seq += 1
+        entry = (weight, self._seq, item)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+        elif weight > self._heap[0][0]:
+            heapq.heapreplace(self._heap, entry)
+
+    def items(self) -> List[tuple]:
+        """(weight, item) pairs, largest first."""
+        return [(w, it) for w, _, it in sorted(self._heap, key=lambda e: (-e[0], e[1]))]
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+
+class SpaceSaving:
+    """
+    Heavy-hitter sketch (Space-Saving, Metwally et al.) over weighted keys.
+
+    At most `capacity` keys are tracked. A new key arriving when full takes
+    over the smallest counter and inherits its count as error, so any key
+    whose true total exceeds total/capacity is guaranteed to be present and
+    the reported top entries are exact whenever fewer than `capacity` keys
+    were ever seen.
+
+    The smallest counter is found through a min-heap of (count, seq, key)
+    entries. Increments push a fresh entry instead of updating in place;
+    entries whose count no longer matches are skipped when they surface and
+    the heap is rebuilt once stale entries outnumber live ones, so adding is
+    O(log capacity) amortised.
+    """
+
+    __slots__ = ("capacity", "counts", "errors", "total", "_heap", "_seq")
+
+    def __init__(self, capacity: int = 100):
+        self.capacity = capacity
+        self.counts: Dict[str, float] = {}
+        self.errors: Dict[str, float] = {}
+        self.total = 0
+        self._heap: List[tuple] = []    # (count, seq, key); stale when counts[key] has moved on
+        self._seq = 0
+
+    def _push(self, key: str):
+        self._seq += 1
+        heapq.heappush(self._heap, (self.counts[key], self._seq, key))
+        if len(self._heap) > 2 * max(self.capacity, len(self.counts)) + 16:
+            self._reheap()
+
+    def _reheap(self):
+        self._heap = [(c, i, k) for i, (k, c) in enumerate(self.counts.items())]
+        heapq.heapify(self._heap)
+        self._seq = len(self._heap)
+
+    def _pop_min(self) -> str:
+        while True:
+            c, _, key = heapq.heappop(self._heap)
+            if self.counts.get(key) == c:
+                return key
+
+    def add(self, key: str, weight: float = 1):
+        self.total += weight
+        if key in self.counts:
+            self.counts[key] += weight
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = weight
+            self.errors[key] = 0
+        else:
+            victim = self._pop_min()
+            floor = self.counts.pop(victim)
+            self.errors.pop(victim, None)
+            self.counts[key] = floor + weight
+            self.errors[key] = floor
+        self._push(key)
+
+    def top(self, n: int) -> List[Tuple[str, float]]:
+        return heapq.nlargest(n, self.counts.items(), key=lambda kv: kv[1])
+
+    def __bool__(self) -> bool:
+        return bool(self.counts)
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, SpaceSaving) and self.to_dict() == other.to_dict()
+
+    def to_dict(self) -> dict:
+        return {"capacity": self.capacity, "counts": dict(self.counts), "errors": dict(self.errors), "total": self.total}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "SpaceSaving":
+        s = cls(int(d["capacity"]))
+        s.counts = dict(d["counts"])
+        s.errors = dict(d["errors"])
+        s.total = d["total"]
+        s._reheap()
+        return s
@@ -0,0 +1,220 @@
+# bot/telemetry.py
+"""
+Live process metrics in Prometheus text format, served from the bot's own
+event loop (no extra dependency). Disabled unless PROMETHEUS_PORT is set.
+
+Modules create their metrics here at import time and update them inline;
+values that are cheaper to read than to track (queue lengths, clamd
+endpoint state) are registered as collectors and sampled on each scrape.
+"""
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+PROMETHEUS_PORT = int(os.getenv("PROMETHEUS_PORT", "0") or "0")      # 0 = disabled
+PROMETHEUS_BIND = os.getenv("PROMETHEUS_BIND", "0.0.0.0")
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5") or "0.5")
+
+_PREFIX = "tgdl_"
+
+Sample = Tuple[str, Dict[str, str], float]      # (name suffix, labels, value)
+
+
+# ========= Metric types =========
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = _PREFIX + name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[tuple, float] = {}
+        # inc() may be called from worker threads (scans, metrics writer)
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._values[()] = 0        # unlabelled series are exported from the start
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, v in items:
+            yield "", dict(zip(self.labelnames, key)), v
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        k = self._key(labels)
+        with self._lock:
+            self._values[k] = self._values.get(k, 0) + amount
+
+    def samples(self):
+        for suffix, labels, v in super().samples():
+            yield "_total", labels, v
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        k = self._key(labels)
+        with self._lock:
+            self._values[k] = self._values.get(k, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float], labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[tuple, List[float]] = {}     # key -> bucket counts + [sum, count]
+        if not self.labelnames:
+            self._series[()] = [0.0] * (len(self.buckets) + 2)
+
+    def observe(self, value: float, **labels):
+        k = self._key(labels)
+        with self._lock:
+            s = self._series.get(k)
+            if s is None:
+                s = self._series[k] = [0.0] * (len(self.buckets) + 2)
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    s[i] += 1
+            s[-2] += value
+            s[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(k, list(s)) for k, s in self._series.items()]
+        for key, s in items:
+            labels = dict(zip(self.labelnames, key))
+            for b, n in zip(self.buckets, s):
+                yield "_bucket", {**labels, "le": _fmt(b)}, n
+            yield "_bucket", {**labels, "le": "+Inf"}, s[-1]
+            yield "_sum", labels, s[-2]
+            yield "_count", labels, s[-1]
+
+
+_registry: List[_Metric] = []
+# (name, help, kind, fn) — fn() returns [(labels, value), ...] at scrape time
+_collectors: List[Tuple[str, str, str, Callable[[], Iterable[Tuple[Dict[str, str], float]]]]] = []
+
+def register_collector(name: str, help: str, kind: str, fn: Callable[[], Iterable[Tuple[Dict[str, str], float]]]):
+    _collectors.append((_PREFIX + name, help, kind, fn))
+
+
+# ========= Exposition =========
+
+def _fmt(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    esc = lambda s: str(s).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels.items()) + "}"
+
+def render() -> str:
+    out: List[str] = []
+    for m in _registry:
+        out.append(f"# HELP {m.name} {m.help}")
+        out.append(f"# TYPE {m.name} {m.kind}")
+        for suffix, labels, v in m.samples():
+            out.append(f"{m.name}{suffix}{_labels(labels)} {_fmt(v)}")
+    for name, help, kind, fn in _collectors:
+        out.append(f"# HELP {name} {help}")
+        out.append(f"# TYPE {name} {kind}")
+        try:
+            for labels, v in fn():
+                out.append(f"{name}{_labels(labels)} {_fmt(v)}")
+        except Exception:
+            logging.exception("telemetry: collector %s failed", name)
+    return "\n".join(out) + "\n"
+
+
+# ========= Shared metrics =========
+
+reconnects = Counter("reconnects", "Full stop/start reconnect cycles run by _ensure_connected")
+floodwaits = Counter("floodwaits", "FloodWait errors returned by Telegram", ("method",))
+progress_edits = Counter("progress_edits", "Progress message edits sent")
+download_bytes = Counter("download_bytes", "Bytes received by running downloads")
+loop_lag = Gauge("event_loop_lag_last_seconds", "Most recent event-loop scheduling delay")
+loop_lag_hist = Histogram(
+    "event_loop_lag_seconds", "Event-loop scheduling delay",
+    (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+def note_error(method: str, exc: BaseException):
+    """Count FloodWaits from a swallowed send/edit error."""
+    if type(exc).__name__ == "FloodWait":
+        floodwaits.inc(method=method)
+
+
+# ========= Loops =========
+
+async def run_loop_lag_monitor():
+    """Measure how late a fixed sleep wakes up; that delay is time the loop spent blocked."""
+    while True:
+        try:
+            t0 = time.monotonic()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            lag = max(0.0, time.monotonic() - t0 - LOOP_LAG_INTERVAL)
+            loop_lag.set(lag)
+            loop_lag_hist.observe(lag)
+        except asyncio.CancelledError:
+            break
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Drain headers
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=5)
+            if not line or line in (b"\r\n", b"\n"):
+                break
+        parts = request.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            body = render().encode("utf-8")
+            status, ctype = "200 OK", "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body, status, ctype = b"not found\n", "404 Not Found", "text/plain"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {ctype}\r\nContent-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except Exception:
+        logging.debug("telemetry: request failed", exc_info=True)
+    finally:
+        writer.close()
+
+async def run_server():
+    """Serve /metrics until cancelled (no-op when PROMETHEUS_PORT is 0)."""
+    if not PROMETHEUS_PORT:
+        return
+    server = await asyncio.start_server(_handle, PROMETHEUS_BIND, PROMETHEUS_PORT)
+    logging.info("telemetry: serving /metrics on %s:%d", PROMETHEUS_BIND, PROMETHEUS_PORT)
+    try:
+        async with server:
+            await server.serve_forever()
+    except asyncio.CancelledError:
+        pass
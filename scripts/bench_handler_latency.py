@@ -0,0 +1,143 @@
+"""
+Latency benchmark for the upload handler: how long addFile() holds the
+update and how long a job waits before the scheduler starts it.
+
+    python scripts/bench_handler_latency.py [uploads] [chats] [rtt_ms]
+
+Runs the real handler, outbox, metrics writer and scheduler against fake
+messages whose Telegram calls take `rtt_ms` (default 80). The "sequential"
+column replays the previous handler order (await the reply, append the
+job, write the metrics event, send the admin notice; scheduler polling
+once a second) with the same building blocks. Uploads arrive 50 ms apart,
+spread over `chats` chats, so the per-chat send interval of the outbox
+applies as it does in production. Needs the bot's requirements installed,
+but no credentials: dummy ones and temporary folders are used.
+"""
+import os
+import sys
+import time
+import shutil
+import asyncio
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+_tmp = tempfile.mkdtemp(prefix="bench-handler-")
+for k, v in {
+    "BOT_TOKEN": "0:bench", "TELEGRAM_API_ID": "1", "TELEGRAM_API_HASH": "bench",
+    "DOWNLOAD_FOLDER": os.path.join(_tmp, "data"), "CONFIG_FOLDER": os.path.join(_tmp, "config"),
+    "PRIVATE_CHANNEL_ID": "-1001", "ENV_FILE": os.path.join(_tmp, "none.env"),
+}.items():
+    os.environ.setdefault(k, v)
+
+from pyrogram.enums import ParseMode  # noqa: E402
+
+from bot import app, outbox  # noqa: E402
+from bot.download import handler, manager  # noqa: E402
+from bot.download.types import QueuedJob  # noqa: E402
+from bot.messages import admin_upload_started, file_added  # noqa: E402
+from bot.metrics import append_event  # noqa: E402
+from bot.notifier import notify  # noqa: E402
+
+RTT = 0.08
+GAP = 0.05
+
+_started = {}       # message id -> monotonic time the scheduler started its job
+_ids = iter(range(1, 10 ** 9))
+
+
+class _Message(SimpleNamespace):
+    async def reply(self, text, **kwargs):
+        await asyncio.sleep(RTT)
+        return _Message(id=next(_ids), chat=self.chat, from_user=None, media=None, caption=None)
+
+
+def _upload(chat_id: int) -> _Message:
+    mid = next(_ids)
+    user = SimpleNamespace(id=chat_id, username=f"user{chat_id}", first_name="Name", last_name=None)
+    chat = SimpleNamespace(id=chat_id, username=f"user{chat_id}", title=None)
+    return _Message(id=mid, chat=chat, from_user=user, media=None, caption=f">bench-{mid}.bin")
+
+
+async def _send_message(*args, **kwargs):
+    await asyncio.sleep(RTT)
+
+
+async def _start_job(job: QueuedJob):
+    _started[job.message_id] = time.monotonic()
+    if job.reply is not None:
+        await job.reply
+    manager.running -= 1
+    manager.wake()
+
+
+async def _sequential(_, message):
+    """addFile as it was: every step awaited before the job is queued."""
+    filename = message.caption[1:]
+    progress = await outbox.reply(message, file_added(filename), quote=True, parse_mode=ParseMode.MARKDOWN)
+    manager.downloads.append(QueuedJob(
+        client=app, fetch_client=app, from_message=message, progress_message=progress,
+        filename=filename, enqueued=time.time(),
+    ))
+    append_event("upload_started", user_id=message.from_user.id, username=message.from_user.username,
+                 chat=message.chat.username, filename=filename, has_desc=False, media=None)
+    await notify(admin_upload_started(channel_handle="@bench", filename=filename, resolution=None,
+                                      link=None, author="bench"))
+
+
+async def _round(add, uploads: int, chats: int, first_chat: int):
+    handled, tasks = {}, []
+
+    async def one(message):
+        t0 = time.monotonic()
+        await add(None, message)
+        handled[message.id] = (t0, time.monotonic())
+
+    for i in range(uploads):
+        tasks.append(asyncio.create_task(one(_upload(first_chat + i % chats))))
+        await asyncio.sleep(GAP)
+    await asyncio.gather(*tasks)
+    while len([m for m in handled if m in _started]) < uploads:
+        await asyncio.sleep(0.05)
+    hold = sorted(done - t0 for t0, done in handled.values())
+    wait = sorted(_started[m] - t0 for m, (t0, _) in handled.items())
+    return hold, wait
+
+
+def _pct(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+
+async def main():
+    global RTT
+    uploads = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    chats = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    RTT = (int(sys.argv[3]) if len(sys.argv) > 3 else 80) / 1000
+
+    app.send_message = _send_message
+    manager.startJob = _start_job
+    outbox_task = asyncio.create_task(outbox.run_outbox())
+    scheduler = asyncio.create_task(manager.run())
+
+    wake, manager.wake = manager.wake, lambda: None       # the old scheduler only polled
+    before = await _round(_sequential, uploads, chats, 1000)
+    manager.wake = wake
+    after = await _round(handler.addFile, uploads, chats, 2000)
+
+    scheduler.cancel()
+    outbox_task.cancel()
+    await asyncio.gather(scheduler, outbox_task, return_exceptions=True)
+
+    print(f"{uploads} uploads over {chats} chats, Telegram RTT {RTT * 1000:.0f} ms")
+    print(f"  {'':28} {'sequential':>12} {'enqueue-first':>14}")
+    for label, i in (("handler time", 0), ("upload -> job start", 1)):
+        for p in (0.5, 0.95):
+            print(f"  {label + f' p{int(p * 100)}':28} {_pct(before[i], p):9.1f} ms {_pct(after[i], p):11.1f} ms")
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    finally:
+        shutil.rmtree(_tmp, ignore_errors=True)
@@ -0,0 +1,101 @@
+"""
+Memory benchmark: a download backlog held as full Download records (two
+Pyrogram Message objects each) vs. compact QueuedJob records.
+
+    python scripts/bench_queue_memory.py [jobs]
+
+Builds `jobs` synthetic document messages shaped like real uploads (chat,
+sender, document media, caption, the bot's quoted reply) and reports the
+memory each queue retains, measured with tracemalloc. The synthetic
+messages carry fewer fields than live ones, so the Download figure is a
+lower bound. Needs the bot's requirements installed, but no credentials.
+"""
+import gc
+import sys
+import importlib.util
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+from pyrogram.enums import ChatType, MessageMediaType
+from pyrogram.types import Chat, Document, Message, User
+
+# Load the record types without importing the bot package (which needs a token and folders)
+_spec = importlib.util.spec_from_file_location(
+    "download_types", Path(__file__).resolve().parent.parent / "bot" / "download" / "types.py"
+)
+types = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(types)
+
+CLIENT = object()       # shared by every job either way; not part of the comparison
+
+
+def _messages(i: int):
+    chat = Chat(id=100000 + i, type=ChatType.PRIVATE, username=f"user{i}", first_name="Name", last_name="Surname")
+    sender = User(id=100000 + i, is_bot=False, first_name="Name", last_name="Surname", username=f"user{i}", language_code="uk")
+    doc = Document(
+        file_id="BQACAgIAAxkBAAI" + "x" * 60 + str(i),
+        file_unique_id="AgAD" + str(i).rjust(12, "0"),
+        file_name=f"report-{i}.pdf",
+        mime_type="application/pdf",
+        file_size=25 * 1024 * 1024,
+        date=datetime.now(),
+    )
+    source = Message(
+        id=i, chat=chat, from_user=sender, date=datetime.now(), media=MessageMediaType.DOCUMENT,
+        document=doc, caption=f"Quarterly report {i} for the archive",
+    )
+    bot = User(id=1, is_bot=True, first_name="Downloader", username="downloader_bot")
+    progress = Message(
+        id=10 ** 6 + i, chat=chat, from_user=bot, date=datetime.now(),
+        text=f"File `/report-{i}.pdf` added to list.", reply_to_message=source,
+    )
+    return source, progress
+
+
+def _full(n: int):
+    out = []
+    for i in range(n):
+        source, progress = _messages(i)
+        out.append(types.Download(
+            client=CLIENT, id=source.id, filename=f"report-{i}.pdf", from_message=source,
+            progress_message=progress, description=source.caption, enqueued=1.0,
+        ))
+    return out
+
+
+def _compact(n: int):
+    out = []
+    for i in range(n):
+        source, progress = _messages(i)
+        out.append(types.QueuedJob(
+            client=CLIENT, fetch_client=CLIENT, from_message=source, progress_message=progress,
+            filename=f"report-{i}.pdf", description=source.caption, enqueued=1.0,
+        ))
+    return out
+
+
+def _retained(build, n: int) -> int:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    queue = build(n)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(queue) == n
+    return after - before
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    full = _retained(_full, n)
+    compact = _retained(_compact, n)
+    print(f"{n} queued jobs")
+    print(f"  Download (2 Messages each): {full / 2**20:8.2f} MiB  ({full // n} B/job)")
+    print(f"  QueuedJob (__slots__):      {compact / 2**20:8.2f} MiB  ({compact // n} B/job)")
+    print(f"  saving: {(1 - compact / full) * 100:.0f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Importing the bot package needs credentials and folders; tests get dummies
+_tmp = tempfile.mkdtemp(prefix="bot-tests-")
+atexit.register(shutil.rmtree, _tmp, True)
+for key, value in {
+    "BOT_TOKEN": "0:test",
+    "TELEGRAM_API_ID": "1",
+    "TELEGRAM_API_HASH": "test",
+    "DOWNLOAD_FOLDER": os.path.join(_tmp, "data"),
+    "CONFIG_FOLDER": os.path.join(_tmp, "config"),
+    "ENV_FILE": os.path.join(_tmp, "none.env"),
+}.items():
+    os.environ.setdefault(key, value)
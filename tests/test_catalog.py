@@ -0,0 +1,92 @@
+"""
+Path matching in bot.catalog: subtree operations and bare-name lookups
+must not reach rows whose paths differ only in case or contain wildcards.
+"""
+import os
+
+import pytest
+
+from bot import catalog
+
+
+@pytest.fixture
+def share(tmp_path, monkeypatch):
+    """An empty catalog over a fresh share folder."""
+    base = tmp_path / "share"
+    base.mkdir()
+    monkeypatch.setattr(catalog, "BASE_FOLDER", str(base))
+    monkeypatch.setattr(catalog, "CATALOG_DB", tmp_path / "catalog.db")
+    catalog.close()
+    yield base
+    catalog.close()
+
+
+def _put(base, relpath: str, data: bytes = b"x"):
+    path = base / relpath
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    catalog.upsert(str(path))
+
+
+def _paths():
+    return sorted(r["path"] for r in catalog._db().execute("SELECT path FROM files"))
+
+
+def test_remove_tree_keeps_folder_differing_in_case(share):
+    _put(share, "Docs/a.txt")
+    _put(share, "docs/b.txt")
+
+    catalog.remove_tree(str(share / "docs"))
+
+    assert _paths() == ["Docs/a.txt"]
+
+
+def test_rename_tree_keeps_folder_differing_in_case(share):
+    _put(share, "Docs/a.txt")
+    _put(share, "docs/b.txt")
+
+    catalog.rename_tree(str(share / "docs"), str(share / "notes"))
+
+    assert _paths() == ["Docs/a.txt", "notes/b.txt"]
+
+
+def test_subtree_match_treats_wildcards_literally(share):
+    _put(share, "a_b/one.txt")
+    _put(share, "axb/two.txt")
+    _put(share, "x*/three.txt")
+    _put(share, "xy/four.txt")
+
+    catalog.remove_tree(str(share / "a_b"))
+    catalog.remove_tree(str(share / "x*"))
+
+    assert _paths() == ["axb/two.txt", "xy/four.txt"]
+
+
+def test_sync_dir_leaves_other_case_folder_alone(share):
+    _put(share, "Docs/a.txt")
+    _put(share, "docs/b.txt")
+    os.unlink(share / "docs" / "b.txt")
+    catalog._db().execute("UPDATE files SET added_at = added_at - 60")     # known before the walk
+
+    stats = catalog.sync_dir(str(share / "docs"))
+
+    assert stats["removed"] == 1
+    assert _paths() == ["Docs/a.txt"]
+
+
+def test_find_bare_name_is_case_sensitive(share):
+    _put(share, "a/report.pdf")
+    _put(share, "b/Report.PDF")
+    _put(share, "c/report_pdf")
+
+    assert [r["path"] for r in catalog.find("report.pdf")] == ["a/report.pdf"]
+    assert [r["path"] for r in catalog.find("Report.PDF")] == ["b/Report.PDF"]
+
+
+def test_upsert_keeps_top_level_dotdot_names_and_skips_outside(share, tmp_path):
+    _put(share, "..notes")
+    outside = tmp_path / "outside.txt"
+    outside.write_bytes(b"x")
+    catalog.upsert(str(outside))
+
+    assert _paths() == ["..notes"]
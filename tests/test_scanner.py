@@ -0,0 +1,162 @@
+"""
+Endpoint balancing, circuit breaker and failover in bot.scanner, against
+fake clamd daemons speaking the newline protocol (PING, VERSION, SCAN).
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from bot import scanner
+
+
+class FakeClamd:
+    """A clamd on 127.0.0.1 served from its own thread; stop() makes it refuse connections."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.scans = []
+        self.port = 0
+        self._loop = asyncio.new_event_loop()
+        self._server = None
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        self.start()
+
+    async def _handle(self, reader, writer):
+        line = (await reader.readline()).decode().strip()
+        cmd, _, arg = line[1:].partition(" ")
+        if cmd == "PING":
+            reply = "PONG"
+        elif cmd == "VERSION":
+            reply = "ClamAV 1.4.1/27432/Mon Oct 19 08:00:00 2026"
+        elif cmd == "SCAN":
+            self.scans.append(arg)
+            await asyncio.sleep(self.delay)
+            reply = f"{arg}: Eicar-Test-Signature FOUND" if "eicar" in arg else f"{arg}: OK"
+        else:
+            reply = "UNKNOWN COMMAND ERROR"
+        writer.write((reply + "\n").encode())
+        await writer.drain()
+        writer.close()
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(5)
+
+    def start(self):
+        async def serve():
+            self._server = await asyncio.start_server(self._handle, "127.0.0.1", self.port)
+            self.port = self._server.sockets[0].getsockname()[1]
+        self._call(serve())
+
+    def stop(self):
+        async def close():
+            self._server.close()
+            await self._server.wait_closed()
+        self._call(close())
+
+    def close(self):
+        self.stop()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+@pytest.fixture
+def daemons(monkeypatch):
+    """Two fake daemons wired in as the scanner's endpoints (A first, B second)."""
+    a, b = FakeClamd(), FakeClamd()
+    monkeypatch.setattr(scanner, "_endpoints", [scanner.Endpoint("127.0.0.1", d.port) for d in (a, b)])
+    monkeypatch.setattr(scanner, "CLAMAV_FAIL_THRESHOLD", 3)
+    yield a, b
+    a.close()
+    b.close()
+
+
+def _ep(i: int) -> scanner.Endpoint:
+    return scanner._endpoints[i]
+
+
+def test_picks_endpoint_with_least_outstanding_bytes(daemons):
+    a, b = daemons
+    a.delay = 0.5
+    big = threading.Thread(target=scanner.scan_path, args=("/data/big.mkv", 4 << 30))
+    big.start()
+    deadline = time.monotonic() + 2
+    while not a.scans and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert _ep(0).outstanding_bytes == 4 << 30
+
+    # A is busy with 4 GiB, so the next scan goes to B even though A is listed first
+    res = scanner.scan_path("/data/small.txt", 1024)
+    big.join()
+
+    assert res.status == "clean"
+    assert a.scans == ["/data/big.mkv"]
+    assert b.scans == ["/data/small.txt"]
+    assert [e.outstanding_bytes for e in scanner._endpoints] == [0, 0]
+    assert [e.in_flight for e in scanner._endpoints] == [0, 0]
+
+
+def test_fails_over_to_next_endpoint(daemons):
+    a, b = daemons
+    a.stop()
+
+    res = scanner.scan_path("/data/eicar.com", 68)
+
+    assert res.status == "infected"
+    assert res.signature == "Eicar-Test-Signature"
+    assert b.scans == ["/data/eicar.com"]
+    assert _ep(0).failures == 1 and _ep(0).healthy
+
+
+def test_ejects_endpoint_after_consecutive_failures(daemons):
+    a, b = daemons
+    a.stop()
+
+    for i in range(scanner.CLAMAV_FAIL_THRESHOLD):
+        assert scanner.scan_path(f"/data/f{i}", 10).status == "clean"
+    assert not _ep(0).healthy
+
+    # Ejected: further scans go straight to B without touching A
+    assert scanner.scan_path("/data/after", 10).status == "clean"
+    assert _ep(0).failures == scanner.CLAMAV_FAIL_THRESHOLD
+    assert len(b.scans) == scanner.CLAMAV_FAIL_THRESHOLD + 1
+    assert scanner.db_version() == 27432      # only the healthy daemon is asked
+
+
+def test_no_endpoint_left_is_an_error(daemons):
+    a, b = daemons
+    a.stop()
+    b.stop()
+
+    assert scanner.scan_path("/data/f", 10).status == "error"
+    assert [e.failures for e in scanner._endpoints] == [1, 1]
+
+
+def test_reprobe_returns_endpoint_to_rotation(daemons, monkeypatch):
+    a, b = daemons
+    a.stop()
+    for i in range(scanner.CLAMAV_FAIL_THRESHOLD):
+        scanner.scan_path(f"/data/f{i}", 10)
+    assert not _ep(0).healthy
+
+    monkeypatch.setattr(scanner, "CLAMAV_PROBE_INTERVAL", 0.05)
+
+    async def probe_while_down_then_up():
+        task = asyncio.create_task(scanner.run_health_probes())
+        await asyncio.sleep(0.2)
+        still_out = not _ep(0).healthy
+        a.start()                       # same port: the daemon is back
+        for _ in range(100):
+            if _ep(0).healthy:
+                break
+            await asyncio.sleep(0.02)
+        task.cancel()
+        await task
+        return still_out
+
+    assert asyncio.run(probe_while_down_then_up())
+    assert _ep(0).healthy and _ep(0).failures == 0
+
+    before = len(a.scans)
+    scanner.scan_path("/data/back", 10)
+    assert len(a.scans) == before + 1
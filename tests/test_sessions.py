@@ -0,0 +1,54 @@
+"""
+Idle expiry in bot.sessions: the timer wheel must keep a chat's /use
+folder while the chat keeps uploading, and drop it once the chat goes quiet.
+"""
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from bot import sessions
+
+TTL = 60
+
+
+@pytest.fixture
+def clock(tmp_path, monkeypatch):
+    """A fresh session store on a manual monotonic clock; returns a function advancing it tick by tick."""
+    now = [1000.0]
+    monkeypatch.setattr(sessions, "time", SimpleNamespace(monotonic=lambda: now[0], time=time.time))
+    monkeypatch.setattr(sessions, "BASE_FOLDER", str(tmp_path))
+    monkeypatch.setattr(sessions, "SESSIONS_IDLE_TTL", TTL)
+    monkeypatch.setattr(sessions, "SESSIONS_PERSIST", False)
+    monkeypatch.setattr(sessions, "_sessions", type(sessions._sessions)())
+    monkeypatch.setattr(sessions, "_wheel", [{} for _ in range(sessions._SLOTS)])
+    monkeypatch.setattr(sessions, "_cursor", 0)
+
+    def advance(seconds: float, each_tick=None):
+        for _ in range(int(seconds // sessions._TICK)):
+            now[0] += sessions._TICK
+            sessions._advance(now[0])
+            if each_tick:
+                each_tick()
+
+    return advance
+
+
+def test_uploads_keep_the_folder_past_the_idle_ttl(clock):
+    sessions.set_folder(7, "Docs")
+    seen = []
+
+    clock(3 * TTL, each_tick=lambda: seen.append(sessions.folder(7, activity=True)))
+
+    assert set(seen) == {"Docs"}
+    assert sessions.folder(7) == "Docs"
+
+
+def test_idle_chat_loses_the_folder_after_the_ttl(clock):
+    sessions.set_folder(7, "Docs")
+
+    clock(TTL - sessions._TICK, each_tick=lambda: sessions.folder(7))     # plain reads are not activity
+    assert sessions.folder(7) == "Docs"
+
+    clock(2 * sessions._TICK)
+    assert sessions.folder(7) == ""